@@ -0,0 +1,189 @@
+import mmap
+import os
+import struct
+import threading
+import time
+
+MAGIC = b'CHADDRX1'
+# magic, key count, value count, then the byte offsets of the four sections
+HEADER = struct.Struct('<8sQQQQQQ')
+# Company numbers are stored as fixed width ASCII
+COMPANY_NUMBER_WIDTH = 8
+
+
+def build_index(entries: dict, index_fp: str) -> None:
+    """
+    Write an immutable index of key -> company numbers and atomically replace index_fp with it.
+
+    Layout: header, sorted utf-8 keys back to back, uint64 key offsets (n + 1),
+    company numbers back to back, uint64 value offsets (n + 1). Everything is read
+    in place through mmap, so processes opening the same file share its pages.
+    """
+    keys = sorted(entries)
+    key_blob = bytearray()
+    key_offsets = [0]
+    value_blob = bytearray()
+    value_offsets = [0]
+    for key in keys:
+        key_blob += key.encode('utf-8')
+        key_offsets.append(len(key_blob))
+        for company_number in sorted(set(entries[key])):
+            value_blob += company_number.encode('ascii').ljust(COMPANY_NUMBER_WIDTH)[:COMPANY_NUMBER_WIDTH]
+        value_offsets.append(len(value_blob) // COMPANY_NUMBER_WIDTH)
+
+    keys_start = HEADER.size
+    key_offsets_start = keys_start + len(key_blob)
+    key_offsets_start += -key_offsets_start % 8  # keep the offset arrays 8 byte aligned
+    values_start = key_offsets_start + 8 * len(key_offsets)
+    value_offsets_start = values_start + len(value_blob)
+    value_offsets_start += -value_offsets_start % 8
+
+    tmp_fp = f"{index_fp}.{os.getpid()}.tmp"
+    with open(tmp_fp, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, len(keys), value_offsets[-1], keys_start, key_offsets_start, values_start,
+                            value_offsets_start))
+        f.write(key_blob)
+        f.write(b'\0' * (key_offsets_start - keys_start - len(key_blob)))
+        f.write(struct.pack(f'<{len(key_offsets)}Q', *key_offsets))
+        f.write(value_blob)
+        f.write(b'\0' * (value_offsets_start - values_start - len(value_blob)))
+        f.write(struct.pack(f'<{len(value_offsets)}Q', *value_offsets))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_fp, index_fp)
+
+
+class AddressIndex():
+    """
+    Read-only view of an index file built by build_index.
+    """
+
+    def __init__(self, index_fp: str) -> None:
+        with open(index_fp, 'rb') as f:
+            self._stat = os.fstat(f.fileno())
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self._key_count, value_count, keys_start, key_offsets_start, values_start, value_offsets_start = \
+            HEADER.unpack_from(self._mmap, 0)
+        if magic != MAGIC:
+            raise ValueError(f"'{index_fp}' is not an address index.")
+        view = memoryview(self._mmap)
+        self._keys_start = keys_start
+        self._key_offsets = view[key_offsets_start:key_offsets_start + 8 * (self._key_count + 1)].cast('Q')
+        self._values = view[values_start:value_offsets_start]
+        self._value_offsets = view[value_offsets_start:value_offsets_start + 8 * (self._key_count + 1)].cast('Q')
+
+    def __len__(self) -> int:
+        return self._key_count
+
+    @property
+    def inode(self) -> tuple:
+        return (self._stat.st_dev, self._stat.st_ino)
+
+    def key(self, position: int) -> bytes:
+        start = self._keys_start + self._key_offsets[position]
+        return self._mmap[start:self._keys_start + self._key_offsets[position + 1]]
+
+    def bisect(self, key: bytes) -> int:
+        """
+        Position of the first key >= key.
+        """
+        low, high = 0, self._key_count
+        while low < high:
+            middle = (low + high) // 2
+            if self.key(middle) < key:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def companies(self, position: int) -> list:
+        start = self._value_offsets[position] * COMPANY_NUMBER_WIDTH
+        end = self._value_offsets[position + 1] * COMPANY_NUMBER_WIDTH
+        values = bytes(self._values[start:end])
+        return [values[i:i + COMPANY_NUMBER_WIDTH].decode('ascii').strip()
+                for i in range(0, len(values), COMPANY_NUMBER_WIDTH)]
+
+    def get(self, key: str) -> list:
+        """
+        Company numbers stored under exactly this key, or an empty list.
+        """
+        encoded = key.encode('utf-8')
+        position = self.bisect(encoded)
+        if position < self._key_count and self.key(position) == encoded:
+            return self.companies(position)
+        return []
+
+    def prefix(self, prefix: str, limit: int = 10) -> list:
+        """
+        Up to limit keys starting with prefix, in sorted order.
+        """
+        encoded = prefix.encode('utf-8')
+        position = self.bisect(encoded)
+        keys = []
+        while position < self._key_count and len(keys) < limit:
+            key = self.key(position)
+            if not key.startswith(encoded):
+                break
+            keys.append(key.decode('utf-8'))
+            position += 1
+        return keys
+
+    def close(self) -> None:
+        for view in (self._key_offsets, self._values, self._value_offsets):
+            view.release()
+        self._mmap.close()
+
+
+class SharedAddressIndex():
+    """
+    The current index file of a worker process, reopened when a rebuild replaces the file.
+
+    The file is checked at most every check_interval seconds, so lookups stay a stat call away
+    from the latest build without paying for one on every request. opener reads the file; any
+    read-only view with an inode property works, e.g. autocomplete.Autocomplete.
+    """
+
+    def __init__(self, index_fp: str, check_interval: float = 5.0, opener=AddressIndex) -> None:
+        self._index_fp = index_fp
+        self._check_interval = check_interval
+        self._opener = opener
+        self._index = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+
+    @property
+    def index_fp(self) -> str:
+        return self._index_fp
+
+    def get(self) -> AddressIndex:
+        """
+        The latest index, or None if it has not been built yet.
+        """
+        now = time.monotonic()
+        if self._index is not None and now - self._checked_at < self._check_interval:
+            return self._index
+        with self._lock:
+            self._checked_at = now
+            try:
+                stat = os.stat(self._index_fp)
+            except FileNotFoundError:
+                return self._index
+            if self._index is None or self._index.inode != (stat.st_dev, stat.st_ino):
+                # Readers still holding the old index keep their mapping until it is garbage collected
+                self._index = self._opener(self._index_fp)
+            return self._index
+
+
+def company_entries() -> dict:
+    """
+    Normalised address and postcode -> company numbers of the stored companies.
+    """
+    from .models import Company
+
+    entries = dict()
+    for company_number, address, postcode in Company.objects.values_list(
+            'company_number', 'normalised_address', 'postal_code').iterator(chunk_size=5000):
+        for key in (address, postcode):
+            if key:
+                entries.setdefault(key, []).append(company_number)
+    return entries
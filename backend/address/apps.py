@@ -1,6 +1,40 @@
+import os
+
 from django.apps import AppConfig
 
 
 class AddressConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "address"
+
+    def ready(self):
+        from django.conf import settings
+        from companies_house.circuit_breaker import CircuitBreaker
+        from companies_house.companies_house_api import ChAPI
+        from companies_house.concurrency_limit import AdaptiveConcurrencyLimiter
+        from companies_house.credentials import MissingCredentialsError
+        from companies_house.rate_limit import RateLimiter
+        from companies_house.response_cache import DjangoResponseCache, SqliteResponseCache
+
+        ChAPI.setTimeout((3.05, settings.CH_REQUEST_TIMEOUT))
+        ChAPI.setCircuitBreaker(CircuitBreaker('companies_house', slow_call_duration=settings.CH_SLOW_CALL_SECONDS,
+                                               open_seconds=settings.CH_CIRCUIT_OPEN_SECONDS))
+        if settings.CH_RATE_LIMIT:
+            try:
+                keys = len(ChAPI.getCredentialPool())
+            except MissingCredentialsError:
+                # Without a key every search is refused anyway, the limiter just needs a rate
+                keys = 1
+            ChAPI.setRateLimiter(RateLimiter(rate=settings.CH_RATE_LIMIT * keys, period=settings.CH_RATE_PERIOD,
+                                             state_fp=settings.CH_RATE_LIMIT_FILE))
+        if settings.CH_MAX_CONCURRENCY:
+            ChAPI.setConcurrencyLimiter(AdaptiveConcurrencyLimiter(
+                'companies_house', initial=min(4, settings.CH_MAX_CONCURRENCY), max_limit=settings.CH_MAX_CONCURRENCY))
+        if settings.CH_RESPONSE_CACHE == 'sqlite':
+            os.makedirs(os.path.dirname(settings.CH_RESPONSE_CACHE_PATH), exist_ok=True)
+            ChAPI.setResponseCache(SqliteResponseCache(settings.CH_RESPONSE_CACHE_PATH,
+                                                       max_bytes=settings.CH_RESPONSE_CACHE_MAX_MB * 1024 * 1024,
+                                                       ttls=settings.CH_RESPONSE_CACHE_TTLS))
+        elif settings.CH_RESPONSE_CACHE == 'django':
+            from django.core.cache import cache
+            ChAPI.setResponseCache(DjangoResponseCache(cache, ttls=settings.CH_RESPONSE_CACHE_TTLS))
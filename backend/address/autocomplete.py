@@ -0,0 +1,185 @@
+import mmap
+import os
+import re
+import struct
+
+from .normalise import STREET_ABBREVIATIONS, normalise_postcode
+
+MAGIC = b'CHACMPL1'
+# Suggestion kinds, each a sorted vocabulary of its own
+KINDS = ('postcode', 'street', 'address')
+# magic, then per kind: key count and the byte offsets of its keys, key offsets and company counts
+HEADER = struct.Struct('<8s' + 'QQQQ' * len(KINDS))
+# Letters of the outward code, then anything a partly typed postcode can continue with
+POSTCODE_PREFIX_PATTERN = re.compile(r'^[A-Z]{1,2}[0-9][A-Z0-9]{0,4}$|^[A-Z]{1,2}$')
+# Leading house, flat and unit numbers, e.g. '12A ' or '3 5 '
+HOUSE_NUMBER_PATTERN = re.compile(r'^(?:\S*[0-9]\S* )+')
+
+
+def vocabularies(rows) -> dict:
+    """
+    {kind: {key: companies}} from (normalised address, postcode, companies) rows.
+
+    Postcodes are keyed without their space so that 'SS91' and 'SS9 1' find the same ones,
+    streets without their house numbers, and addresses as street and postcode.
+    """
+    entries = {kind: dict() for kind in KINDS}
+    for normalised_address, postcode, companies in rows:
+        postcode = normalise_postcode(postcode)
+        suffix = f', {postcode}'
+        street = normalised_address[:-len(suffix)] if postcode and normalised_address.endswith(suffix) \
+            else normalised_address
+        keys = {
+            'postcode': postcode.replace(' ', ''),
+            'street': HOUSE_NUMBER_PATTERN.sub('', street),
+            'address': f'{street} {postcode}'.strip(),
+        }
+        for kind, key in keys.items():
+            if key:
+                entries[kind][key] = entries[kind].get(key, 0) + companies
+    return entries
+
+
+def stored_vocabularies() -> dict:
+    """
+    Vocabularies of every address with a stored risk summary.
+    """
+    from .models import AddressRiskSummary
+
+    return vocabularies(AddressRiskSummary.objects.values_list(
+        'normalised_address', 'postal_code', 'company_count').iterator(chunk_size=5000))
+
+
+def build_autocomplete(entries: dict, autocomplete_fp: str) -> None:
+    """
+    Write the vocabularies as sorted arrays and atomically replace autocomplete_fp.
+
+    Per kind: newline separated utf-8 keys, uint32 key offsets (n + 1) and uint32 company counts,
+    so a vocabulary costs its text plus 8 bytes a key, read in place through mmap.
+    """
+    sections = []
+    body = bytearray()
+    for kind in KINDS:
+        keys = sorted(entries.get(kind, {}))
+        blob = '\n'.join(keys).encode('utf-8')
+        offsets, position = [0], 0
+        for key in keys:
+            position += len(key.encode('utf-8')) + 1
+            offsets.append(position)
+        if position > 2 ** 32 - 1:
+            raise ValueError(f"The {kind} vocabulary is too large for 32 bit offsets.")
+        keys_start = HEADER.size + len(body)
+        body += blob + b'\n'
+        body += b'\0' * (-len(body) % 4)
+        offsets_start = HEADER.size + len(body)
+        body += struct.pack(f'<{len(offsets)}I', *offsets)
+        counts_start = HEADER.size + len(body)
+        body += struct.pack(f'<{len(keys)}I', *(min(entries[kind][key], 2 ** 32 - 1) for key in keys))
+        sections += [len(keys), keys_start, offsets_start, counts_start]
+
+    tmp_fp = f"{autocomplete_fp}.{os.getpid()}.tmp"
+    with open(tmp_fp, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, *sections))
+        f.write(body)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_fp, autocomplete_fp)
+
+
+def query_prefixes(query: str) -> dict:
+    """
+    {kind: [prefixes]} to look up for a partly typed query.
+
+    Finished words are normalised like stored addresses. The word being typed is looked up both
+    as typed and, if it is an abbreviation, expanded: 'ST' may be the start of STATION or STREET.
+    """
+    words = re.sub(r'[^A-Z0-9 ]', ' ', (query or '').upper()).split()
+    if not words:
+        return {}
+    typing = not query[-1].isspace() and query[-1] not in ',.'
+    finished = ' '.join(STREET_ABBREVIATIONS.get(word, word) for word in (words[:-1] if typing else words))
+    if typing:
+        endings = [words[-1]] + ([STREET_ABBREVIATIONS[words[-1]]] if words[-1] in STREET_ABBREVIATIONS else [])
+        addresses = [f'{finished} {ending}'.strip() for ending in endings]
+    else:
+        addresses = [finished + ' ']
+    prefixes = {'address': addresses}
+    streets = [street for street in (HOUSE_NUMBER_PATTERN.sub('', address) for address in addresses) if street]
+    if streets:
+        prefixes['street'] = streets
+    postcode = ''.join(words)
+    if POSTCODE_PREFIX_PATTERN.match(postcode):
+        prefixes['postcode'] = [postcode]
+    return prefixes
+
+
+class Autocomplete():
+    """
+    Read-only view of a file built by build_autocomplete.
+    """
+
+    def __init__(self, autocomplete_fp: str) -> None:
+        with open(autocomplete_fp, 'rb') as f:
+            self._stat = os.fstat(f.fileno())
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        header = HEADER.unpack_from(self._mmap, 0)
+        if header[0] != MAGIC:
+            raise ValueError(f"'{autocomplete_fp}' is not an autocomplete file.")
+        view = memoryview(self._mmap)
+        self._vocabularies = dict()
+        for i, kind in enumerate(KINDS):
+            count, keys_start, offsets_start, counts_start = header[1 + 4 * i:5 + 4 * i]
+            self._vocabularies[kind] = (count, keys_start, view[offsets_start:offsets_start + 4 * (count + 1)].cast('I'),
+                                        view[counts_start:counts_start + 4 * count].cast('I'))
+
+    def __len__(self) -> int:
+        return sum(vocabulary[0] for vocabulary in self._vocabularies.values())
+
+    @property
+    def inode(self) -> tuple:
+        return (self._stat.st_dev, self._stat.st_ino)
+
+    def prefix(self, kind: str, prefix: str, limit: int = 10) -> list:
+        """
+        Up to limit (key, companies) of the kind starting with prefix, in sorted order.
+        """
+        count, keys_start, offsets, counts = self._vocabularies[kind]
+        keys = self._mmap
+        encoded = prefix.encode('utf-8')
+        low, high = 0, count
+        while low < high:
+            middle = (low + high) // 2
+            # Offsets include the newline after each key
+            if keys[keys_start + offsets[middle]:keys_start + offsets[middle + 1] - 1] < encoded:
+                low = middle + 1
+            else:
+                high = middle
+        matches = []
+        while low < count and len(matches) < limit:
+            key = keys[keys_start + offsets[low]:keys_start + offsets[low + 1] - 1]
+            if not key.startswith(encoded):
+                break
+            matches.append((key.decode('utf-8'), counts[low]))
+            low += 1
+        return matches
+
+    def suggest(self, query: str, limit: int = 10, kinds: tuple = KINDS) -> list:
+        """
+        Up to limit suggestions for a partly typed query: postcodes first, then streets and full addresses.
+        """
+        suggestions = []
+        for kind, prefixes in query_prefixes(query).items():
+            if kind not in kinds:
+                continue
+            matches = sorted({match for prefix in prefixes for match in self.prefix(kind, prefix, limit)})
+            for key, companies in matches[:limit]:
+                value = normalise_postcode(key) if kind == 'postcode' else key
+                suggestions.append({'kind': kind, 'value': value, 'companies': companies})
+        suggestions.sort(key=lambda suggestion: KINDS.index(suggestion['kind']))
+        return suggestions[:limit]
+
+    def close(self) -> None:
+        for vocabulary in self._vocabularies.values():
+            vocabulary[2].release()
+            vocabulary[3].release()
+        self._mmap.close()
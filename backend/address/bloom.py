@@ -0,0 +1,152 @@
+import hashlib
+import math
+import os
+import struct
+import threading
+import time
+
+from django.db.models import Count, Q
+
+from .models import AreaAggregate, Company
+from .normalise import normalise_address, split_postcode
+
+MAGIC = b'CHBLOOM1'
+# magic, number of bits, number of hashes, number of keys added
+HEADER = struct.Struct('<8sQII')
+
+
+class BloomFilter():
+    """
+    Set membership with no false negatives and a bounded false positive rate.
+
+    Sized for an expected number of keys and a target false positive rate. Each key
+    sets hash_count bits chosen by double hashing one blake2b digest.
+    """
+
+    def __init__(self, bit_count: int, hash_count: int, bits: bytearray = None, key_count: int = 0) -> None:
+        self._bit_count = bit_count
+        self._hash_count = hash_count
+        self._bits = bits if bits is not None else bytearray((bit_count + 7) // 8)
+        self._key_count = key_count
+
+    @classmethod
+    def for_capacity(cls, capacity: int, fp_rate: float) -> 'BloomFilter':
+        capacity = max(capacity, 1)
+        bit_count = max(int(math.ceil(-capacity * math.log(fp_rate) / math.log(2) ** 2)), 8)
+        hash_count = max(int(round(bit_count / capacity * math.log(2))), 1)
+        return cls(bit_count, hash_count)
+
+    def __len__(self) -> int:
+        return self._key_count
+
+    @property
+    def size(self) -> int:
+        """
+        Size of the bit array in bytes.
+        """
+        return len(self._bits)
+
+    @property
+    def fp_rate(self) -> float:
+        """
+        Expected false positive rate for the keys added so far.
+        """
+        return (1 - math.exp(-self._hash_count * self._key_count / self._bit_count)) ** self._hash_count
+
+    def _positions(self, key: str):
+        digest = hashlib.blake2b(key.encode('utf-8'), digest_size=16).digest()
+        first, second = struct.unpack('<QQ', digest)
+        for i in range(self._hash_count):
+            yield (first + i * second) % self._bit_count
+
+    def add(self, key: str) -> None:
+        for position in self._positions(key):
+            self._bits[position >> 3] |= 1 << (position & 7)
+        self._key_count += 1
+
+    def __contains__(self, key: str) -> bool:
+        return all(self._bits[position >> 3] & (1 << (position & 7)) for position in self._positions(key))
+
+    def save(self, filter_fp: str) -> None:
+        tmp_fp = f"{filter_fp}.{os.getpid()}.tmp"
+        with open(tmp_fp, 'wb') as f:
+            f.write(HEADER.pack(MAGIC, self._bit_count, self._hash_count, self._key_count))
+            f.write(self._bits)
+        os.replace(tmp_fp, filter_fp)
+
+    @classmethod
+    def load(cls, filter_fp: str) -> 'BloomFilter':
+        with open(filter_fp, 'rb') as f:
+            magic, bit_count, hash_count, key_count = HEADER.unpack(f.read(HEADER.size))
+            if magic != MAGIC:
+                raise ValueError(f"'{filter_fp}' is not a Bloom filter.")
+            return cls(bit_count, hash_count, bytearray(f.read()), key_count)
+
+
+class SharedBloomFilter():
+    """
+    The Bloom filter file of a worker process, loaded once and reloaded when a rebuild replaces it.
+    """
+
+    def __init__(self, filter_fp: str, check_interval: float = 30.0) -> None:
+        self._filter_fp = filter_fp
+        self._check_interval = check_interval
+        self._filter = None
+        self._inode = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+
+    def get(self) -> BloomFilter:
+        """
+        The latest filter, or None if it has not been built yet.
+        """
+        now = time.monotonic()
+        if self._filter is not None and now - self._checked_at < self._check_interval:
+            return self._filter
+        with self._lock:
+            self._checked_at = now
+            try:
+                stat = os.stat(self._filter_fp)
+            except FileNotFoundError:
+                return self._filter
+            if self._inode != (stat.st_dev, stat.st_ino):
+                self._filter = BloomFilter.load(self._filter_fp)
+                self._inode = (stat.st_dev, stat.st_ino)
+            return self._filter
+
+
+def query_keys(query: str) -> list:
+    """
+    Filter keys a free text search can match: its normalised address and its postcode unit.
+    """
+    street, postcode = split_postcode(query)
+    if not postcode:
+        return []
+    keys = [postcode]
+    if street.strip(' ,'):
+        keys.append(normalise_address(street, postcode))
+    return keys
+
+
+def risky_keys(min_companies: int) -> set:
+    """
+    Normalised addresses and postcode units with at least min_companies companies,
+    plus the addresses of companies whose registered office is undeliverable or in dispute.
+    """
+    keys = set(Company.objects.exclude(normalised_address='').values('normalised_address')
+               .annotate(companies=Count('id')).filter(companies__gte=min_companies)
+               .values_list('normalised_address', flat=True))
+    keys.update(Company.objects.exclude(normalised_address='')
+                .filter(Q(undeliverable_registered_office_address=True) | Q(registered_office_is_in_dispute=True))
+                .values_list('normalised_address', flat=True))
+    keys.update(AreaAggregate.objects.filter(level='unit', company_count__gte=min_companies)
+                .values_list('area', flat=True))
+    return keys
+
+
+def build_risk_filter(min_companies: int, fp_rate: float) -> BloomFilter:
+    keys = risky_keys(min_companies)
+    bloom = BloomFilter.for_capacity(len(keys), fp_rate)
+    for key in keys:
+        bloom.add(key)
+    return bloom
@@ -0,0 +1,101 @@
+import os
+import re
+import uuid
+import zipfile
+
+# Tables written by CompanySearch and BatchSearch, as {prefix}_{table}_{timestamp}.csv
+EXPORT_TABLES = ('companies', 'company_officers', 'officer_appointments', 'sic_codes', 'previous_company_names',
+                 'persons_significant_control', 'natures_of_control', 'company_charges', 'charges_persons_entitled',
+                 'charges_transactions')
+EXPORT_FILE_PATTERN = re.compile(
+    r'^(?P<prefix>.+?)_(?P<table>' + '|'.join(EXPORT_TABLES) + r')_(?P<timestamp>[^_]+)\.csv$')
+CHUNK_SIZE = 64 * 1024
+
+
+def list_exports(data_dir: str) -> dict:
+    """
+    Searches stored in data_dir: {export id: {table: file path}}, where the export id is {prefix}_{timestamp}.
+    """
+    exports = dict()
+    if not os.path.isdir(data_dir):
+        return exports
+    for file_name in sorted(os.listdir(data_dir)):
+        match = EXPORT_FILE_PATTERN.match(file_name)
+        if match:
+            export_id = f"{match.group('prefix')}_{match.group('timestamp')}"
+            exports.setdefault(export_id, dict())[match.group('table')] = os.path.join(data_dir, file_name)
+    return exports
+
+
+def export_files(data_dir: str, export_id: str, tables: list = None) -> dict:
+    """
+    {table: file path} of one stored search in EXPORT_TABLES order, restricted to the given tables.
+    """
+    files = list_exports(data_dir).get(export_id, {})
+    return {table: files[table] for table in EXPORT_TABLES if table in files and (not tables or table in tables)}
+
+
+def read_chunks(file_fp: str):
+    with open(file_fp, 'rb') as f:
+        while chunk := f.read(CHUNK_SIZE):
+            yield chunk
+
+
+class StreamBuffer():
+    """
+    Write-only file object that zipfile writes into and the response drains after every write.
+
+    It has no seek, so zipfile writes local headers with data descriptors instead of
+    seeking back, and nothing but the current chunk is ever held in memory.
+    """
+
+    def __init__(self) -> None:
+        self._chunks = []
+        self._position = 0
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._position
+
+    def flush(self) -> None:
+        pass
+
+    def drain(self) -> bytes:
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def stream_zip(files: dict, export_id: str):
+    """
+    Zip archive of the files, produced chunk by chunk.
+    """
+    buffer = StreamBuffer()
+    with zipfile.ZipFile(buffer, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+        for table, file_fp in files.items():
+            with archive.open(f"{export_id}/{table}.csv", 'w', force_zip64=True) as entry:
+                for chunk in read_chunks(file_fp):
+                    entry.write(chunk)
+                    yield buffer.drain()
+            yield buffer.drain()
+    yield buffer.drain()
+
+
+def multipart_boundary() -> str:
+    return f"export-{uuid.uuid4().hex}"
+
+
+def stream_multipart(files: dict, export_id: str, boundary: str):
+    """
+    multipart/mixed body with one text/csv part per file, produced chunk by chunk.
+    """
+    for table, file_fp in files.items():
+        yield (f"--{boundary}\r\nContent-Type: text/csv; charset=utf-8\r\n"
+               f"Content-Disposition: attachment; filename=\"{export_id}_{table}.csv\"\r\n\r\n").encode('utf-8')
+        yield from read_chunks(file_fp)
+        yield b"\r\n"
+    yield f"--{boundary}--\r\n".encode('utf-8')
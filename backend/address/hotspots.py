@@ -0,0 +1,98 @@
+from collections import Counter
+
+from django.db import transaction
+
+from .models import AreaAggregate, Company
+from .normalise import POSTCODE_PATTERN, normalise_postcode, postcode_district, postcode_sector
+
+LEVELS = ('unit', 'sector', 'district')
+ORDERINGS = ('company_count', 'dissolved_ratio', 'overdue_ratio')
+
+
+def company_areas(company: Company) -> dict:
+    """
+    Postcode unit, sector and district of a company's registered office, if its postcode is valid.
+    """
+    postcode = normalise_postcode(company.postal_code)
+    if not POSTCODE_PATTERN.match(postcode):
+        return {}
+    return {'unit': postcode, 'sector': postcode_sector(postcode), 'district': postcode_district(postcode)}
+
+
+def add_contribution(deltas: dict, company: Company, sign: int) -> None:
+    """
+    Add (sign=1) or remove (sign=-1) one company's counts to the per-area deltas.
+    """
+    for level, area in company_areas(company).items():
+        delta = deltas.setdefault((level, area), {
+            'company_count': 0, 'dissolved_count': 0, 'overdue_count': 0, 'incorporations': Counter()})
+        delta['company_count'] += sign
+        if company.company_status == 'dissolved':
+            delta['dissolved_count'] += sign
+        if company.accounts_overdue:
+            delta['overdue_count'] += sign
+        if company.date_of_creation:
+            delta['incorporations'][company.date_of_creation.strftime('%Y-%m')] += sign
+
+
+def apply_company_changes(changes: list) -> None:
+    """
+    Update the area aggregates for changed companies.
+
+    Args:
+        changes (list): (old, new) company pairs; old is None for new companies
+            and new is None for removed ones
+    """
+    deltas = dict()
+    for old, new in changes:
+        if old is not None:
+            add_contribution(deltas, old, -1)
+        if new is not None:
+            add_contribution(deltas, new, 1)
+
+    with transaction.atomic():
+        for (level, area), delta in deltas.items():
+            if not any(delta[field] for field in ('company_count', 'dissolved_count', 'overdue_count')) \
+                    and not any(delta['incorporations'].values()):
+                continue
+            aggregate, _ = AreaAggregate.objects.select_for_update().get_or_create(level=level, area=area)
+            aggregate.company_count += delta['company_count']
+            aggregate.dissolved_count += delta['dissolved_count']
+            aggregate.overdue_count += delta['overdue_count']
+            incorporations = Counter(aggregate.incorporations)
+            incorporations.update(delta['incorporations'])
+            aggregate.incorporations = {month: count for month, count in sorted(incorporations.items()) if count > 0}
+            if aggregate.company_count <= 0:
+                aggregate.delete()
+                continue
+            set_ratios(aggregate)
+            aggregate.save()
+
+
+def set_ratios(aggregate: AreaAggregate) -> None:
+    aggregate.dissolved_ratio = aggregate.dissolved_count / aggregate.company_count
+    aggregate.overdue_ratio = aggregate.overdue_count / aggregate.company_count
+
+
+def rebuild_aggregates(chunk_size: int = 2000) -> int:
+    """
+    Recompute every area aggregate from the stored companies.
+
+    Returns:
+        int: number of areas
+    """
+    deltas = dict()
+    for company in Company.objects.iterator(chunk_size=chunk_size):
+        add_contribution(deltas, company, 1)
+
+    aggregates = []
+    for (level, area), delta in deltas.items():
+        aggregate = AreaAggregate(level=level, area=area, company_count=delta['company_count'],
+                                  dissolved_count=delta['dissolved_count'], overdue_count=delta['overdue_count'],
+                                  incorporations=dict(sorted(delta['incorporations'].items())))
+        set_ratios(aggregate)
+        aggregates.append(aggregate)
+    with transaction.atomic():
+        AreaAggregate.objects.all().delete()
+        AreaAggregate.objects.bulk_create(aggregates, batch_size=chunk_size)
+    return len(aggregates)
@@ -0,0 +1,124 @@
+import copy
+import csv
+from datetime import date
+
+from django.db import transaction
+from django.utils import timezone
+
+from . import hotspots, risk
+from .models import Company, CompanyOfficer
+from .normalise import normalise_address, normalise_postcode
+
+# Company fields taken from the {prefix}_companies_{timestamp}.csv files written by CompanyInfo
+COMPANY_FIELDS = ['company_name', 'company_status', 'company_type', 'date_of_creation', 'address_line_1', 'locality',
+                  'postal_code', 'normalised_address', 'accounts_overdue', 'undeliverable_registered_office_address',
+                  'registered_office_is_in_dispute', 'etag']
+
+
+def parse_date(value: str):
+    try:
+        return date.fromisoformat(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def company_fields(row: dict) -> dict:
+    """
+    Model field values for one row of a companies CSV file.
+    """
+    return {
+        'company_name': row.get('company_name', ''),
+        'company_status': row.get('company_status', ''),
+        'company_type': row.get('company_type', ''),
+        'date_of_creation': parse_date(row.get('date_of_creation')),
+        'address_line_1': row.get('address_line_1', ''),
+        'locality': row.get('locality', ''),
+        'postal_code': normalise_postcode(row.get('postal_code', '')),
+        'normalised_address': normalise_address(row.get('address_line_1', ''), row.get('postal_code', '')),
+        'accounts_overdue': row.get('accounts_overdue') == 'True',
+        'undeliverable_registered_office_address': row.get('undeliverable_registered_office_address') == 'True',
+        'registered_office_is_in_dispute': row.get('registered_office_is_in_dispute') == 'True',
+        'etag': row.get('etag', ''),
+    }
+
+
+def ingest_companies(rows, batch_size: int = 1000) -> dict:
+    """
+    Insert or update companies from companies CSV rows and refresh everything derived from them.
+
+    Returns:
+        dict: number of created, updated and unchanged companies
+    """
+    counts = {'created': 0, 'updated': 0, 'unchanged': 0}
+    batch = dict()
+    for row in rows:
+        if row.get('company_number'):
+            batch[row['company_number']] = company_fields(row)
+        if len(batch) >= batch_size:
+            ingest_batch(batch, counts)
+            batch = dict()
+    if batch:
+        ingest_batch(batch, counts)
+    return counts
+
+
+def ingest_batch(batch: dict, counts: dict) -> None:
+    with transaction.atomic():
+        existing = Company.objects.in_bulk(list(batch), field_name='company_number')
+        now = timezone.now()
+        created, updated, changes = [], [], []
+        for company_number, fields in batch.items():
+            company = existing.get(company_number)
+            if company is None:
+                company = Company(company_number=company_number, **fields)
+                created.append(company)
+                changes.append((None, company))
+                continue
+            if all(getattr(company, field) == value for field, value in fields.items()):
+                counts['unchanged'] += 1
+                continue
+            old = copy.copy(company)
+            for field, value in fields.items():
+                setattr(company, field, value)
+            company.date_updated = now
+            updated.append(company)
+            changes.append((old, company))
+
+        Company.objects.bulk_create(created)
+        Company.objects.bulk_update(updated, COMPANY_FIELDS + ['date_updated'])
+        hotspots.apply_company_changes(changes)
+        risk.refresh_summaries({company.normalised_address for pair in changes for company in pair if company})
+    counts['created'] += len(created)
+    counts['updated'] += len(updated)
+
+
+def ingest_officers(rows) -> dict:
+    """
+    Replace the stored officers of each company in company officers CSV rows.
+
+    Each file lists every officer of the companies it covers, so officers no longer
+    listed are removed. Rows of companies that have not been loaded are skipped.
+
+    Returns:
+        dict: number of companies updated and skipped
+    """
+    officers = dict()
+    for row in rows:
+        if row.get('company_number'):
+            company_officers = officers.setdefault(row['company_number'], set())
+            if row.get('officer_id'):
+                company_officers.add(row['officer_id'])
+
+    with transaction.atomic():
+        companies = Company.objects.in_bulk(list(officers), field_name='company_number')
+        CompanyOfficer.objects.filter(company_id__in=list(companies)).delete()
+        CompanyOfficer.objects.bulk_create(
+            [CompanyOfficer(company_id=company_number, officer_id=officer_id)
+             for company_number in companies for officer_id in officers[company_number]], batch_size=1000)
+        risk.refresh_summaries({company.normalised_address for company in companies.values()})
+    return {'updated': len(companies), 'skipped': len(officers) - len(companies)}
+
+
+def read_csv_rows(csv_fp: str):
+    with open(csv_fp, 'r', newline='') as csv_file:
+        yield from csv.DictReader(csv_file)
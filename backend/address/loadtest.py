@@ -0,0 +1,241 @@
+import json
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import requests
+
+ENDPOINTS = ('search-address', 'add-user-data')
+
+
+class StubCompaniesHouse():
+    """
+    Local stand-in for the Companies House advanced search endpoint.
+
+    Answers every search with size synthetic companies after latency seconds, and sends the
+    rate limit headers the real API sends. With a limit, requests beyond limit per period
+    get a 429 with Retry-After like the real API.
+    """
+
+    def __init__(self, latency: float = 0.05, limit: int = None, period: float = 300.0) -> None:
+        self.latency = latency
+        self.limit = limit
+        self.period = period
+        self.requests = 0
+        self._window_start = time.time()
+        self._window_count = 0
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), self._handler())
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self._server.server_address[1]}"
+
+    def start(self) -> 'StubCompaniesHouse':
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def take(self) -> tuple:
+        """
+        Count one request against the window: (allowed, remaining, reset time).
+        """
+        with self._lock:
+            self.requests += 1
+            now = time.time()
+            if now - self._window_start >= self.period:
+                self._window_start, self._window_count = now, 0
+            self._window_count += 1
+            limit = self.limit if self.limit is not None else 10 ** 9
+            return self._window_count <= limit, max(limit - self._window_count, 0), int(self._window_start + self.period)
+
+    def _handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                allowed, remaining, reset = stub.take()
+                time.sleep(stub.latency)
+                if not allowed:
+                    self.respond(429, {'error': 'rate limited'}, {'Retry-After': str(max(reset - int(time.time()), 1))},
+                                 remaining, reset)
+                    return
+                url = urlparse(self.path)
+                if url.path != '/advanced-search/companies':
+                    self.respond(404, {'error': 'not found'}, {}, remaining, reset)
+                    return
+                params = parse_qs(url.query)
+                location = params.get('location', [''])[0]
+                size = min(int(params.get('size', ['20'])[0]), 5000)
+                self.respond(200, search_results(location, size), {}, remaining, reset)
+
+            def respond(self, status, body, headers, remaining, reset):
+                content = json.dumps(body).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(content)))
+                self.send_header('X-Ratelimit-Limit', str(stub.limit or 10 ** 9))
+                self.send_header('X-Ratelimit-Remain', str(remaining))
+                self.send_header('X-Ratelimit-Reset', str(reset))
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(content)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+
+def search_results(location: str, size: int) -> dict:
+    items = [{
+        'company_number': f'{n:08d}',
+        'company_name': f'{location.upper()} TRADING {n} LTD',
+        'company_status': 'active' if n % 4 else 'dissolved',
+        'company_type': 'ltd',
+        'date_of_creation': f'20{10 + n % 14}-0{1 + n % 9}-01',
+        'sic_codes': ['99999'],
+        'registered_office_address': {'address_line_1': location, 'postal_code': 'SS9 1AA'},
+        'kind': 'search-results#company',
+    } for n in range(size)]
+    return {'hits': size, 'items': items, 'kind': 'search-results#advanced-search'}
+
+
+def percentile(values: list, q: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(int(round(q / 100 * (len(values) - 1))), len(values) - 1)]
+
+
+class LoadGenerator():
+    """
+    Closed-loop virtual users hitting the search and add user endpoints of a running server.
+
+    Each user sends its next request as soon as the previous one returns, so the offered
+    load grows with the number of users until the server saturates.
+    """
+
+    def __init__(self, base_url: str, add_ratio: float = 0.2, distinct_queries: int = 50, size: int = 100,
+                 timeout: float = 30.0) -> None:
+        self.base_url = base_url.rstrip('/')
+        self.add_ratio = add_ratio
+        self.queries = [f'{n} Example Road, Leigh-on-Sea SS9 {n % 9}AA' for n in range(distinct_queries)]
+        self.size = size
+        self.timeout = timeout
+
+    def request(self, session: requests.Session) -> tuple:
+        """
+        Send one request: (endpoint, ok, latency in seconds, database queries or None).
+        """
+        if random.random() < self.add_ratio:
+            endpoint = 'add-user-data'
+            call = lambda: session.post(f'{self.base_url}/address/add-user-data/', timeout=self.timeout, json={
+                'email': f'{uuid.uuid4().hex}@loadtest.local', 'streetNo': '12', 'streetName': 'Example Road',
+                'postcode': 'SS9 1AA', 'existingBusinesses': 0, 'additionalAddress': False})
+        else:
+            endpoint = 'search-address'
+            call = lambda: session.get(f'{self.base_url}/address/search-address/', timeout=self.timeout,
+                                       params={'query': random.choice(self.queries), 'size': self.size})
+        start = time.perf_counter()
+        try:
+            response = call()
+            ok = response.status_code < 400
+            queries = response.headers.get('X-DB-Queries')
+        except requests.RequestException:
+            ok, queries = False, None
+        return endpoint, ok, time.perf_counter() - start, int(queries) if queries is not None else None
+
+    def run_stage(self, concurrency: int, duration: float) -> dict:
+        samples = []
+        lock = threading.Lock()
+        deadline = time.perf_counter() + duration
+
+        def user():
+            with requests.Session() as session:
+                while time.perf_counter() < deadline:
+                    sample = self.request(session)
+                    with lock:
+                        samples.append(sample)
+
+        start = time.perf_counter()
+        users = [threading.Thread(target=user) for _ in range(concurrency)]
+        for thread in users:
+            thread.start()
+        for thread in users:
+            thread.join()
+        return summarise_stage(concurrency, samples, time.perf_counter() - start)
+
+
+def summarise_stage(concurrency: int, samples: list, elapsed: float) -> dict:
+    endpoints = dict()
+    for endpoint in ENDPOINTS:
+        latencies = [latency * 1000 for name, ok, latency, _ in samples if name == endpoint and ok]
+        errors = sum(1 for name, ok, _, _ in samples if name == endpoint and not ok)
+        queries = [count for name, ok, _, count in samples if name == endpoint and count is not None]
+        endpoints[endpoint] = {
+            'requests': len(latencies) + errors,
+            'errors': errors,
+            'throughput_rps': len(latencies) / elapsed if elapsed else 0.0,
+            'p50_ms': percentile(latencies, 50),
+            'p90_ms': percentile(latencies, 90),
+            'p99_ms': percentile(latencies, 99),
+            'max_ms': max(latencies, default=0.0),
+            'db_queries_mean': sum(queries) / len(queries) if queries else None,
+        }
+    return {'concurrency': concurrency, 'elapsed_s': elapsed, 'endpoints': endpoints}
+
+
+def saturation_point(stages: list, endpoint: str, slo_ms: float):
+    """
+    Highest concurrency at which the endpoint kept its p99 within the SLO without errors.
+    """
+    within = [stage['concurrency'] for stage in stages
+              if stage['endpoints'][endpoint]['requests'] and not stage['endpoints'][endpoint]['errors']
+              and stage['endpoints'][endpoint]['p99_ms'] <= slo_ms]
+    return max(within, default=None)
+
+
+def format_report(report: dict) -> str:
+    lines = [f"{report['label']} ({report['server']})"]
+    lines.append(f"{'users':>6} {'endpoint':<15} {'req/s':>8} {'p50 ms':>8} {'p90 ms':>8} {'p99 ms':>8} "
+                 f"{'errors':>7} {'queries':>8}")
+    for stage in report['stages']:
+        for endpoint, stats in stage['endpoints'].items():
+            queries = f"{stats['db_queries_mean']:.1f}" if stats['db_queries_mean'] is not None else '-'
+            lines.append(f"{stage['concurrency']:>6} {endpoint:<15} {stats['throughput_rps']:>8.1f} "
+                         f"{stats['p50_ms']:>8.1f} {stats['p90_ms']:>8.1f} {stats['p99_ms']:>8.1f} "
+                         f"{stats['errors']:>7} {queries:>8}")
+    for endpoint, users in report['saturation'].items():
+        lines.append(f"{endpoint}: p99 within {report['slo_ms']:.0f}ms up to {users if users else 'no'} users")
+    return '\n'.join(lines)
+
+
+def format_comparison(reports: list) -> str:
+    """
+    Throughput and p99 of several reports side by side, per endpoint and concurrency.
+    """
+    lines = [f"{'users':>6} {'endpoint':<15} " + ' '.join(f"{report['label'][:22]:>22}" for report in reports),
+             f"{'':>6} {'':<15} " + ' '.join(f"{'req/s | p99 ms':>22}" for _ in reports)]
+    concurrencies = sorted({stage['concurrency'] for report in reports for stage in report['stages']})
+    for concurrency in concurrencies:
+        for endpoint in ENDPOINTS:
+            cells = []
+            for report in reports:
+                stage = next((stage for stage in report['stages'] if stage['concurrency'] == concurrency), None)
+                if stage is None:
+                    cells.append(f"{'-':>22}")
+                    continue
+                stats = stage['endpoints'][endpoint]
+                cells.append(f"{stats['throughput_rps']:>11.1f} | {stats['p99_ms']:>8.1f}")
+            lines.append(f"{concurrency:>6} {endpoint:<15} " + ' '.join(cells))
+    return '\n'.join(lines)
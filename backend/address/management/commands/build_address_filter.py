@@ -0,0 +1,26 @@
+import os
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from address.bloom import build_risk_filter
+
+
+class Command(BaseCommand):
+    help = ("Build the Bloom filter of high-density and flagged addresses consulted by search-address "
+            "and check-address. Running workers reload it within 30 seconds.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', default=settings.ADDRESS_FILTER_PATH, help='Filter file to replace')
+        parser.add_argument('--fp-rate', type=float, default=settings.ADDRESS_FILTER_FP_RATE,
+                            help='Target false positive rate')
+        parser.add_argument('--min-companies', type=int, default=settings.ADDRESS_FILTER_MIN_COMPANIES,
+                            help='Companies at one address or postcode unit for it to count as high-density')
+
+    def handle(self, *args, **options):
+        output = options['output']
+        os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+        bloom = build_risk_filter(options['min_companies'], options['fp_rate'])
+        bloom.save(output)
+        self.stdout.write(f"Added {len(bloom)} addresses and postcodes to {output} "
+                          f"({bloom.size / 1024:.1f} kB, expected false positive rate {bloom.fp_rate:.4f})")
@@ -0,0 +1,101 @@
+import multiprocessing
+import os
+import queue
+import random
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from address.address_index import AddressIndex, build_index, company_entries
+
+
+def read_rss() -> dict:
+    """
+    Resident memory of this process in kB, split into private (anonymous) and shared file-backed pages.
+    """
+    rss = dict()
+    with open('/proc/self/status') as status_file:
+        for line in status_file:
+            name, _, value = line.partition(':')
+            if name in ('VmRSS', 'RssAnon', 'RssFile'):
+                rss[name] = int(value.split()[0])
+    return rss
+
+
+def benchmark_worker(index_fp: str, mode: str, keys: list, results) -> None:
+    """
+    Cold start one worker: load the index, look up every sampled key and report time and memory.
+    """
+    start = time.perf_counter()
+    before = read_rss()
+    if mode == 'mmap':
+        index = AddressIndex(index_fp)
+        lookup = index.get
+    else:
+        # What each worker would do with an in-memory index: copy every entry onto its own heap
+        index = AddressIndex(index_fp)
+        entries = {index.key(i).decode('utf-8'): index.companies(i) for i in range(len(index))}
+        index.close()
+        lookup = entries.get
+    loaded = time.perf_counter()
+    for key in keys:
+        lookup(key)
+    finished = time.perf_counter()
+    after = read_rss()
+    results.put({
+        'load_ms': (loaded - start) * 1000,
+        'lookup_us': (finished - loaded) * 1e6 / max(len(keys), 1),
+        'private_kb': after.get('RssAnon', 0) - before.get('RssAnon', 0),
+        'shared_kb': after.get('RssFile', 0) - before.get('RssFile', 0),
+    })
+
+
+class Command(BaseCommand):
+    help = ("Build the memory-mapped address -> company index from the stored companies and atomically "
+            "replace the served index. Running workers switch to the new file within a few seconds.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', default=settings.ADDRESS_INDEX_PATH, help='Index file to replace')
+        parser.add_argument('--benchmark', type=int, default=0, metavar='WORKERS',
+                            help='Compare cold start and memory of this many worker processes '
+                                 'mapping the index against loading it into a dict')
+        parser.add_argument('--lookups', type=int, default=10000, help='Lookups per benchmark worker')
+
+    def handle(self, *args, **options):
+        output = options['output']
+        os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+        start = time.perf_counter()
+        entries = company_entries()
+        build_index(entries, output)
+        self.stdout.write(f"Indexed {len(entries)} addresses and postcodes into {output} "
+                          f"({os.path.getsize(output) / 1024:.0f} kB) in {time.perf_counter() - start:.2f}s")
+
+        if options['benchmark'] and entries:
+            keys = random.choices(list(entries), k=options['lookups'])
+            for mode in ('mmap', 'dict'):
+                self.benchmark(output, mode, keys, options['benchmark'])
+
+    def benchmark(self, index_fp: str, mode: str, keys: list, workers: int) -> None:
+        context = multiprocessing.get_context('spawn')
+        results = context.Queue()
+        processes = [context.Process(target=benchmark_worker, args=(index_fp, mode, keys, results))
+                     for _ in range(workers)]
+        for process in processes:
+            process.start()
+        try:
+            stats = [results.get(timeout=300) for _ in processes]
+        except queue.Empty:
+            raise CommandError(f"{mode} benchmark workers did not report back")
+        finally:
+            for process in processes:
+                process.join(timeout=5)
+                if process.is_alive():
+                    process.terminate()
+
+        def mean(name):
+            return sum(stat[name] for stat in stats) / len(stats)
+
+        self.stdout.write(f"{mode}: {workers} workers, cold start {mean('load_ms'):.1f}ms, "
+                          f"lookup {mean('lookup_us'):.1f}us, private RSS {mean('private_kb'):.0f}kB per worker, "
+                          f"file-backed RSS {mean('shared_kb'):.0f}kB per worker")
@@ -0,0 +1,190 @@
+import bisect
+import gc
+import multiprocessing
+import os
+import queue
+import random
+import string
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from address.autocomplete import KINDS, Autocomplete, build_autocomplete, query_prefixes, stored_vocabularies, \
+    vocabularies
+from address.management.commands.build_address_index import read_rss
+
+STREET_SUFFIXES = ['ROAD', 'STREET', 'LANE', 'AVENUE', 'CLOSE', 'DRIVE', 'WAY', 'GARDENS', 'COURT', 'PLACE']
+SYLLABLES = ['AL', 'BER', 'CAS', 'DEN', 'EL', 'FAR', 'GLEN', 'HAM', 'ING', 'KIR', 'LEY', 'MOR', 'NOR', 'OAK',
+             'PEN', 'RID', 'STAN', 'TON', 'WEL', 'WICK', 'BROOK', 'FIELD', 'HILL', 'WOOD']
+
+
+def synthetic_rows(count: int, seed: int = 0):
+    """
+    count made up (normalised address, postcode, companies) rows in roughly national proportions:
+    about 15 addresses per postcode and 30 per street name.
+    """
+    rng = random.Random(seed)
+    postcodes = [f"{''.join(rng.choices(string.ascii_uppercase, k=rng.choice((1, 2))))}{rng.randint(1, 99)} "
+                 f"{rng.randint(0, 9)}{''.join(rng.choices(string.ascii_uppercase, k=2))}"
+                 for _ in range(max(count // 15, 1))]
+    streets = [f"{''.join(rng.choices(SYLLABLES, k=rng.randint(2, 3)))} {rng.choice(STREET_SUFFIXES)}"
+               for _ in range(max(count // 30, 1))]
+    for _ in range(count):
+        postcode = rng.choice(postcodes)
+        yield f"{rng.randint(1, 300)} {rng.choice(streets)}, {postcode}", postcode, rng.randint(1, 5)
+
+
+def keystrokes(count: int, sessions: int, seed: int = 1) -> list:
+    """
+    Every prefix of sessions addresses as they are typed, one query per keystroke.
+    """
+    queries = []
+    for address, _, _ in random.Random(seed).sample(list(synthetic_rows(count)), sessions):
+        typed = address.replace(',', '').lower()
+        queries += [typed[:length] for length in range(1, len(typed) + 1)]
+    return queries
+
+
+class SortedListIndex():
+    """
+    The same vocabularies as sorted lists of Python strings, for comparison.
+    """
+
+    def __init__(self, entries: dict) -> None:
+        self._keys = {kind: sorted(entries[kind]) for kind in KINDS}
+
+    def suggest(self, query: str, limit: int = 10) -> list:
+        suggestions = []
+        for kind, prefixes in query_prefixes(query).items():
+            keys = self._keys[kind]
+            for prefix in prefixes:
+                position = bisect.bisect_left(keys, prefix)
+                while position < len(keys) and len(suggestions) < limit and keys[position].startswith(prefix):
+                    suggestions.append(keys[position])
+                    position += 1
+        return suggestions
+
+
+class TrieIndex():
+    """
+    The same vocabularies as a character trie of nested dicts, for comparison.
+    """
+
+    def __init__(self, entries: dict) -> None:
+        self._roots = {kind: dict() for kind in KINDS}
+        for kind in KINDS:
+            for key in entries[kind]:
+                node = self._roots[kind]
+                for character in key:
+                    node = node.setdefault(character, {})
+                node[''] = key
+
+    def suggest(self, query: str, limit: int = 10) -> list:
+        suggestions = []
+        for kind, prefixes in query_prefixes(query).items():
+            for prefix in prefixes:
+                node = self._roots[kind]
+                for character in prefix:
+                    node = node.get(character)
+                    if node is None:
+                        break
+                if node is None:
+                    continue
+                pending = [node]
+                while pending and len(suggestions) < limit:
+                    node = pending.pop()
+                    if '' in node:
+                        suggestions.append(node[''])
+                    pending.extend(child for character, child in sorted(node.items(), reverse=True) if character)
+        return suggestions
+
+
+def benchmark_worker(structure: str, autocomplete_fp: str, count: int, queries: list, results) -> None:
+    """
+    Load one structure in a fresh process, answer every keystroke and report memory and latency.
+    """
+    before = read_rss()
+    entries = vocabularies(synthetic_rows(count)) if structure != 'sorted_array' else None
+    start = time.perf_counter()
+    if structure == 'sorted_array':
+        index = Autocomplete(autocomplete_fp)
+    elif structure == 'sorted_list':
+        index = SortedListIndex(entries)
+    else:
+        index = TrieIndex(entries)
+    loaded = time.perf_counter()
+    del entries
+    gc.collect()
+    latencies = []
+    for query in queries:
+        query_start = time.perf_counter()
+        index.suggest(query, 10)
+        latencies.append(time.perf_counter() - query_start)
+    after = read_rss()
+    latencies.sort()
+    results.put({
+        'structure': structure,
+        'load_ms': (loaded - start) * 1000,
+        'p50_us': latencies[len(latencies) // 2] * 1e6,
+        'p99_us': latencies[int(len(latencies) * 0.99)] * 1e6,
+        'private_kb': after.get('RssAnon', 0) - before.get('RssAnon', 0),
+        'shared_kb': after.get('RssFile', 0) - before.get('RssFile', 0),
+    })
+
+
+class Command(BaseCommand):
+    help = ("Build the postcode, street and address vocabularies served by /address/autocomplete/ from the "
+            "stored address risk summaries and atomically replace the served file.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', default=settings.ADDRESS_AUTOCOMPLETE_PATH, help='File to replace')
+        parser.add_argument('--benchmark', type=int, default=0, metavar='ADDRESSES',
+                            help='Instead of building, compare memory and keystroke latency of the sorted arrays, '
+                                 'sorted Python lists and a dict trie over this many made up addresses')
+        parser.add_argument('--structures', default='sorted_array,sorted_list,trie',
+                            help='Structures to benchmark, comma separated')
+        parser.add_argument('--sessions', type=int, default=200, help='Addresses typed per benchmark')
+
+    def handle(self, *args, **options):
+        if options['benchmark']:
+            self.benchmark(options['benchmark'], options['structures'].split(','), options['sessions'])
+            return
+        output = options['output']
+        os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+        start = time.perf_counter()
+        entries = stored_vocabularies()
+        build_autocomplete(entries, output)
+        counts = ', '.join(f"{kind} {len(entries[kind])}" for kind in KINDS)
+        self.stdout.write(f"Wrote {counts} keys to {output} ({os.path.getsize(output) / 1024:.0f} kB) "
+                          f"in {time.perf_counter() - start:.2f}s")
+
+    def benchmark(self, count: int, structures: list, sessions: int) -> None:
+        autocomplete_fp = os.path.join(settings.BASE_DIR, 'data', f'autocomplete_benchmark_{os.getpid()}.bin')
+        os.makedirs(os.path.dirname(autocomplete_fp), exist_ok=True)
+        entries = vocabularies(synthetic_rows(count))
+        build_autocomplete(entries, autocomplete_fp)
+        self.stdout.write(f"{count} addresses, keys: " + ', '.join(f"{kind} {len(entries[kind])}" for kind in KINDS) +
+                          f", file {os.path.getsize(autocomplete_fp) / 1024 / 1024:.1f} MB")
+        del entries
+        queries = keystrokes(count, sessions)
+        context = multiprocessing.get_context('spawn')
+        try:
+            for structure in structures:
+                results = context.Queue()
+                process = context.Process(target=benchmark_worker,
+                                          args=(structure, autocomplete_fp, count, queries, results))
+                process.start()
+                try:
+                    stats = results.get(timeout=1800)
+                except queue.Empty:
+                    raise CommandError(f"{structure} benchmark worker did not report back")
+                finally:
+                    process.join(timeout=5)
+                    if process.is_alive():
+                        process.terminate()
+                self.stdout.write(f"{structure}: load {stats['load_ms']:.0f}ms, keystroke p50 {stats['p50_us']:.1f}us "
+                                  f"p99 {stats['p99_us']:.1f}us, private RSS {stats['private_kb'] / 1024:.1f}MB, "
+                                  f"file-backed RSS {stats['shared_kb'] / 1024:.1f}MB")
+        finally:
+            os.remove(autocomplete_fp)
@@ -0,0 +1,21 @@
+import glob
+
+from django.core.management.base import BaseCommand, CommandError
+
+from address.ingest import ingest_companies, read_csv_rows
+
+
+class Command(BaseCommand):
+    help = "Load companies CSV files exported by companies_house into the database and refresh the aggregates."
+
+    def add_arguments(self, parser):
+        parser.add_argument('paths', nargs='+', help="companies CSV files or glob patterns, e.g. data/*_companies_*.csv")
+
+    def handle(self, *args, **options):
+        csv_fps = sorted({fp for pattern in options['paths'] for fp in glob.glob(pattern)})
+        if not csv_fps:
+            raise CommandError("No companies CSV files found.")
+        for csv_fp in csv_fps:
+            counts = ingest_companies(read_csv_rows(csv_fp))
+            self.stdout.write(f"{csv_fp}: {counts['created']} created, {counts['updated']} updated, "
+                              f"{counts['unchanged']} unchanged")
@@ -0,0 +1,23 @@
+import glob
+
+from django.core.management.base import BaseCommand, CommandError
+
+from address.ingest import ingest_officers, read_csv_rows
+
+
+class Command(BaseCommand):
+    help = ("Load company officers CSV files exported by companies_house into the database and refresh "
+            "the address risk summaries. Load the matching companies files first.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('paths', nargs='+',
+                            help="company officers CSV files or glob patterns, e.g. data/*_company_officers_*.csv")
+
+    def handle(self, *args, **options):
+        csv_fps = sorted({fp for pattern in options['paths'] for fp in glob.glob(pattern)})
+        if not csv_fps:
+            raise CommandError("No company officers CSV files found.")
+        for csv_fp in csv_fps:
+            counts = ingest_officers(read_csv_rows(csv_fp))
+            self.stdout.write(f"{csv_fp}: officers of {counts['updated']} companies loaded, "
+                              f"{counts['skipped']} companies not found")
@@ -0,0 +1,146 @@
+import json
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+import requests
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from address.loadtest import LoadGenerator, StubCompaniesHouse, format_comparison, format_report, saturation_point
+
+# Commands serving the project on {port}; gunicorn and uvicorn are not in requirements.txt
+SERVERS = {
+    'runserver': [sys.executable, 'manage.py', 'runserver', '--noreload', '127.0.0.1:{port}'],
+    'wsgi': ['gunicorn', 'backend.wsgi:application', '--bind', '127.0.0.1:{port}', '--workers', '{workers}',
+             '--threads', '{threads}'],
+    'asgi': ['uvicorn', 'backend.asgi:application', '--host', '127.0.0.1', '--port', '{port}',
+             '--workers', '{workers}', '--no-access-log'],
+}
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+class Command(BaseCommand):
+    help = ("Load test search-address and add-user-data: start the app against a stub Companies House server, "
+            "ramp up concurrent users and report throughput, latency percentiles and database queries per endpoint.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--server', choices=sorted(SERVERS), default='runserver',
+                            help='How to serve the app: Django runserver, gunicorn (wsgi) or uvicorn (asgi)')
+        parser.add_argument('--workers', type=int, default=4, help='Worker processes for wsgi and asgi')
+        parser.add_argument('--threads', type=int, default=4, help='Threads per gunicorn worker')
+        parser.add_argument('--url', help='Load test an already running server instead of starting one')
+        parser.add_argument('--concurrency', default='1,2,4,8,16,32',
+                            help='Comma separated numbers of concurrent users, one stage each')
+        parser.add_argument('--duration', type=float, default=10.0, help='Seconds per stage')
+        parser.add_argument('--add-ratio', type=float, default=0.2, help='Share of requests that add user data')
+        parser.add_argument('--distinct-queries', type=int, default=50,
+                            help='Number of different addresses searched, fewer means more coalescing')
+        parser.add_argument('--size', type=int, default=100, help='Companies per search result')
+        parser.add_argument('--upstream-latency', type=float, default=0.05, help='Stub response time in seconds')
+        parser.add_argument('--upstream-limit', type=int,
+                            help='Stub requests allowed per 5 minutes before 429s, like the real api (600)')
+        parser.add_argument('--sqlite', action='store_true',
+                            help='Use a throwaway SQLite database instead of the configured one')
+        parser.add_argument('--env', action='append', default=[], metavar='NAME=VALUE',
+                            help='Extra environment for the server, e.g. a cache setting to compare')
+        parser.add_argument('--slo', type=float, default=1000.0, help='p99 latency target in ms')
+        parser.add_argument('--label', help='Name of this configuration in reports')
+        parser.add_argument('--report', help='Write the report to this JSON file')
+        parser.add_argument('--compare', nargs='+', metavar='REPORT',
+                            help='Print saved JSON reports side by side instead of running')
+
+    def handle(self, *args, **options):
+        if options['compare']:
+            reports = []
+            for report_fp in options['compare']:
+                with open(report_fp, 'r') as report_file:
+                    reports.append(json.load(report_file))
+            self.stdout.write(format_comparison(reports))
+            return
+
+        try:
+            concurrencies = [int(users) for users in options['concurrency'].split(',')]
+        except ValueError:
+            raise CommandError("--concurrency must be comma separated integers.")
+        extra_env = dict(item.split('=', 1) for item in options['env'] if '=' in item)
+
+        stub = StubCompaniesHouse(latency=options['upstream_latency'], limit=options['upstream_limit']).start()
+        server, tmp_dir = None, tempfile.mkdtemp(prefix='loadtest_')
+        try:
+            base_url = options['url']
+            if base_url is None:
+                server, base_url = self.start_server(options, stub.url, extra_env, tmp_dir)
+            generator = LoadGenerator(base_url, add_ratio=options['add_ratio'],
+                                      distinct_queries=options['distinct_queries'], size=options['size'])
+            stages = []
+            for concurrency in concurrencies:
+                stages.append(generator.run_stage(concurrency, options['duration']))
+                self.stdout.write(f"{concurrency} users done, {stub.requests} upstream requests so far")
+        finally:
+            if server is not None:
+                server.terminate()
+                server.wait(timeout=10)
+            stub.stop()
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+        label = options['label'] or ' '.join([options['server']] + [f'{name}={value}'
+                                                                    for name, value in extra_env.items()])
+        report = {
+            'label': label,
+            'server': options['url'] or options['server'],
+            'workers': options['workers'],
+            'env': extra_env,
+            'upstream_latency_s': options['upstream_latency'],
+            'upstream_requests': stub.requests,
+            'slo_ms': options['slo'],
+            'stages': stages,
+            'saturation': {endpoint: saturation_point(stages, endpoint, options['slo'])
+                           for endpoint in stages[0]['endpoints']} if stages else {},
+        }
+        self.stdout.write(format_report(report))
+        if options['report']:
+            with open(options['report'], 'w') as report_file:
+                json.dump(report, report_file, indent=2)
+
+    def start_server(self, options: dict, stub_url: str, extra_env: dict, tmp_dir: str) -> tuple:
+        command = [part.format(port='{port}', workers=options['workers'], threads=options['threads'])
+                   for part in SERVERS[options['server']]]
+        if shutil.which(command[0]) is None:
+            raise CommandError(f"{command[0]} is not installed, pip install it to load test with --server "
+                               f"{options['server']}.")
+        port = free_port()
+        command = [part.format(port=port) for part in command]
+        # The stub applies its own --upstream-limit, so the app's rate limiter is off unless --env sets it
+        env = dict(os.environ, CH_API_URL=stub_url, CH_API_KEYS='loadtest', QUERY_COUNT_HEADER='1', CH_RATE_LIMIT='0')
+        env.update(extra_env)
+        if options['sqlite']:
+            env['DB_SQLITE_PATH'] = os.path.join(tmp_dir, 'loadtest.sqlite3')
+            subprocess.run([sys.executable, 'manage.py', 'migrate', '--run-syncdb', '--verbosity', '0'],
+                           cwd=settings.BASE_DIR, env=env, check=True)
+            subprocess.run([sys.executable, 'manage.py', 'createcachetable'],
+                           cwd=settings.BASE_DIR, env=env, check=True)
+
+        server = subprocess.Popen(command, cwd=settings.BASE_DIR, env=env,
+                                  stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        base_url = f"http://127.0.0.1:{port}"
+        deadline = time.time() + 30
+        while time.time() < deadline:
+            if server.poll() is not None:
+                raise CommandError(f"{' '.join(command)} exited with {server.returncode}.")
+            try:
+                requests.get(f"{base_url}/metrics", timeout=1)
+                return server, base_url
+            except requests.RequestException:
+                time.sleep(0.2)
+        server.terminate()
+        raise CommandError(f"{' '.join(command)} did not start within 30 seconds.")
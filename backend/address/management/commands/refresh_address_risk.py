@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from address.risk import rebuild_summaries
+
+
+class Command(BaseCommand):
+    help = ("Rebuild the address risk summaries from the stored companies and officers. They are kept up to "
+            "date incrementally by ingest_companies and ingest_officers, so this is only needed to repair them.")
+
+    def handle(self, *args, **options):
+        addresses = rebuild_summaries()
+        self.stdout.write(f"Rebuilt {addresses} address risk summaries")
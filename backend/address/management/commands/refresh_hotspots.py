@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from address.hotspots import rebuild_aggregates
+
+
+class Command(BaseCommand):
+    help = ("Rebuild the postcode unit, sector and district aggregates from the stored companies. "
+            "They are kept up to date incrementally by ingest_companies, so this is only needed to repair them.")
+
+    def handle(self, *args, **options):
+        areas = rebuild_aggregates()
+        self.stdout.write(f"Rebuilt {areas} area aggregates")
@@ -0,0 +1,48 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from address.startup import TARGETS, measure_startup
+
+
+class Command(BaseCommand):
+    help = ("Measure how long web workers and batch scripts take to become ready from a cold interpreter start "
+            "and which packages their imports spend it on.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--targets', default=','.join(TARGETS), help='Comma separated, among web and batch')
+        parser.add_argument('--runs', type=int, default=10, help='Cold starts timed per target')
+        parser.add_argument('--top', type=int, default=10, help='Packages listed per target')
+        parser.add_argument('--budget', action='append', default=[], metavar='TARGET=MS',
+                            help='Fail if the median ready time of a target exceeds this, e.g. web=800')
+        parser.add_argument('--report', help='Write the results to this JSON file, to track them over time')
+
+    def handle(self, *args, **options):
+        targets = [target for target in options['targets'].split(',') if target]
+        unknown = [target for target in targets if target not in TARGETS]
+        if unknown:
+            raise CommandError(f"Unknown targets: {', '.join(unknown)}")
+        try:
+            budgets = {target: float(ms) for target, ms in (item.split('=', 1) for item in options['budget'])}
+        except ValueError:
+            raise CommandError('Budgets are given as TARGET=MS')
+
+        results = []
+        for target in targets:
+            result = measure_startup(target, options['runs'])
+            results.append(result)
+            self.stdout.write(f"{target}: ready in {result['median_ms']:.0f}ms median "
+                              f"({result['min_ms']:.0f}-{result['max_ms']:.0f}ms over {result['runs']} runs), "
+                              f"{result['import_ms']:.0f}ms importing")
+            for package, ms in list(result['packages_ms'].items())[:options['top']]:
+                self.stdout.write(f"  {package:<24} {ms:8.1f}ms")
+            if result['heavy_packages']:
+                self.stdout.write(f"  loaded at startup: {', '.join(result['heavy_packages'])}")
+
+        if options['report']:
+            with open(options['report'], 'w') as f:
+                json.dump(results, f, indent=2)
+        over = [f"{result['target']} {result['median_ms']:.0f}ms > {budgets[result['target']]:.0f}ms"
+                for result in results if result['target'] in budgets and result['median_ms'] > budgets[result['target']]]
+        if over:
+            raise CommandError(f"Startup over budget: {'; '.join(over)}")
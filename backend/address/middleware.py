@@ -0,0 +1,40 @@
+from django.db import connection
+from django.middleware.gzip import GZipMiddleware
+
+
+class QueryCountMiddleware():
+    """
+    Report the number of database queries made for a request in an X-DB-Queries header.
+
+    Only installed when QUERY_COUNT_HEADER is set, e.g. by the loadtest command.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        queries = 0
+
+        def count(execute, sql, params, many, context):
+            nonlocal queries
+            queries += 1
+            return execute(sql, params, many, context)
+
+        with connection.execute_wrapper(count):
+            response = self.get_response(request)
+        response['X-DB-Queries'] = str(queries)
+        return response
+
+
+class CompressionMiddleware(GZipMiddleware):
+    """
+    GZipMiddleware that leaves already compressed responses, such as zip exports, as they are:
+    compressing them again costs CPU on both ends without making them smaller.
+    """
+
+    COMPRESSED_TYPES = ('application/zip', 'application/gzip', 'application/x-gzip')
+
+    def process_response(self, request, response):
+        if response.get('Content-Type', '').split(';')[0].strip() in self.COMPRESSED_TYPES:
+            return response
+        return super().process_response(request, response)
@@ -16,4 +16,79 @@ class UserAttribute(models.Model):
     date_created = models.DateTimeField(auto_now_add=True, null=True)
 
     def __str__(self):
-        return f"{self.email.email} - {self.streetName}"
\ No newline at end of file
+        return f"{self.email.email} - {self.streetName}"
+
+class Company(models.Model):
+    company_number = models.CharField(max_length=10, unique=True)
+    company_name = models.CharField(max_length=200, blank=True)
+    company_status = models.CharField(max_length=50, blank=True)
+    company_type = models.CharField(max_length=50, blank=True)
+    date_of_creation = models.DateField(null=True)
+    address_line_1 = models.CharField(max_length=200, blank=True)
+    locality = models.CharField(max_length=200, blank=True)
+    postal_code = models.CharField(max_length=10, blank=True, db_index=True)
+    normalised_address = models.CharField(max_length=300, blank=True, db_index=True)
+    accounts_overdue = models.BooleanField(default=False)
+    undeliverable_registered_office_address = models.BooleanField(default=False)
+    registered_office_is_in_dispute = models.BooleanField(default=False)
+    etag = models.CharField(max_length=100, blank=True)
+    date_updated = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.company_number} - {self.company_name}"
+
+
+class AreaAggregate(models.Model):
+    LEVEL_CHOICES = [('unit', 'Postcode unit'), ('sector', 'Postcode sector'), ('district', 'Postcode district')]
+
+    level = models.CharField(max_length=10, choices=LEVEL_CHOICES)
+    area = models.CharField(max_length=10)
+    company_count = models.IntegerField(default=0)
+    dissolved_count = models.IntegerField(default=0)
+    overdue_count = models.IntegerField(default=0)
+    dissolved_ratio = models.FloatField(default=0)
+    overdue_ratio = models.FloatField(default=0)
+    # Incorporations per month, e.g. {"2023-09": 12}
+    incorporations = models.JSONField(default=dict)
+    date_updated = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [models.UniqueConstraint(fields=['level', 'area'], name='unique_area')]
+        indexes = [
+            models.Index(fields=['level', '-company_count']),
+            models.Index(fields=['level', '-dissolved_ratio']),
+            models.Index(fields=['level', '-overdue_ratio']),
+        ]
+
+    def __str__(self):
+        return f"{self.level} {self.area} - {self.company_count}"
+
+
+class CompanyOfficer(models.Model):
+    company = models.ForeignKey(Company, to_field='company_number', on_delete=models.CASCADE, related_name='officers')
+    officer_id = models.CharField(max_length=100)
+
+    class Meta:
+        constraints = [models.UniqueConstraint(fields=['company', 'officer_id'], name='unique_company_officer')]
+
+    def __str__(self):
+        return f"{self.company_id} - {self.officer_id}"
+
+
+class AddressRiskSummary(models.Model):
+    normalised_address = models.CharField(max_length=300, unique=True)
+    postal_code = models.CharField(max_length=10, blank=True)
+    company_count = models.IntegerField(default=0)
+    active_count = models.IntegerField(default=0)
+    dissolved_count = models.IntegerField(default=0)
+    officer_count = models.IntegerField(default=0)
+    newest_incorporation = models.DateField(null=True)
+    undeliverable_count = models.IntegerField(default=0)
+    dispute_count = models.IntegerField(default=0)
+    undeliverable_share = models.FloatField(default=0)
+    dispute_share = models.FloatField(default=0)
+    date_updated = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.normalised_address} - {self.company_count}"
+
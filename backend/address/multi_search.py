@@ -0,0 +1,151 @@
+import contextvars
+import json
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from django.db import connection
+
+from companies_house.circuit_breaker import UpstreamError
+
+try:
+    import orjson
+except ImportError:  # orjson is optional, fall back to the json module
+    orjson = None
+
+logger = logging.getLogger(__name__)
+
+
+def search_key(address: str) -> str:
+    # Normalised like the single address search key, so repeats differing in case or spacing are searched once
+    return address.strip().lower()
+
+
+def dump_line(data: dict) -> bytes:
+    return (orjson.dumps(data) if orjson is not None else json.dumps(data).encode('utf-8')) + b'\n'
+
+
+class MultiAddressSearch():
+    """
+    Search many addresses at once: scatter the upstream searches over a thread pool, gather the
+    results as they complete.
+
+    Addresses repeated in the request are searched once. A company found under several addresses
+    is returned in full the first time only; later results list its number, and the summary names
+    the companies shared between addresses. search(address) returns (data, fetched_at) like
+    views.search_companies, with fetched_at set for a stale result.
+    """
+
+    def __init__(self, addresses: list, search, workers: int = 8, project=None, flagged=None) -> None:
+        self._addresses = addresses
+        self._search = search
+        self._workers = workers
+        self._project = project
+        self._flagged = flagged
+        # search key -> indexes of the addresses sharing it
+        self._queries = dict()
+        for index, address in enumerate(addresses):
+            self._queries.setdefault(search_key(address), []).append(index)
+        self._companies = dict()
+        self._found_under = dict()
+        self._statuses = dict()
+        self._company_hits = 0
+        self._elapsed = 0.0
+
+    def _run(self, address: str) -> dict:
+        try:
+            data, fetched_at = self._search(address)
+        except UpstreamError as e:
+            return {'status': 'unavailable', 'error': str(e)}
+        except Exception as e:
+            logger.error(f'Search for {address!r} failed: {e}')
+            return {'status': 'error', 'error': str(e)}
+        finally:
+            # The search reaches the database cache from this pool thread, which Django will not clean up
+            connection.close()
+        result = {'status': 'ok' if fetched_at is None else 'stale', 'data': data}
+        if fetched_at is not None:
+            result['fetched_at'] = fetched_at.isoformat()
+        return result
+
+    def results(self):
+        """
+        Yield one result per address, in the order the searches complete.
+        """
+        start = time.perf_counter()
+        executor = ThreadPoolExecutor(max_workers=max(1, min(self._workers, len(self._queries))))
+        try:
+            # Copy the context per search so that upstream calls are traced and counted with the request;
+            # when streaming, instrumentView runs this generator in the request's context
+            pending = {executor.submit(contextvars.copy_context().run, self._run, self._addresses[indexes[0]]): key
+                       for key, indexes in self._queries.items()}
+            for future in as_completed(pending):
+                key = pending[future]
+                outcome = future.result()
+                for index in self._queries[key]:
+                    yield self._result(index, outcome)
+        finally:
+            # A client that stops reading should not keep the remaining searches queued
+            executor.shutdown(wait=False, cancel_futures=True)
+            self._elapsed = time.perf_counter() - start
+
+    def _result(self, index: int, outcome: dict) -> dict:
+        address = self._addresses[index]
+        result = {'index': index, 'address': address, 'status': outcome['status']}
+        self._statuses[outcome['status']] = self._statuses.get(outcome['status'], 0) + 1
+        flagged = self._flagged(address) if self._flagged is not None else None
+        if flagged is not None:
+            result['flagged'] = flagged
+        if 'data' not in outcome:
+            result['error'] = outcome['error']
+            return result
+        if 'fetched_at' in outcome:
+            result['fetched_at'] = outcome['fetched_at']
+        data = outcome['data']
+        items = [item for item in data.get('items', []) if item.get('company_number')]
+        result['total_results'] = data.get('hits', len(items))
+        result['company_numbers'] = [item['company_number'] for item in items]
+        result['companies'] = []
+        self._company_hits += len(items)
+        for item in items:
+            number = item['company_number']
+            self._found_under.setdefault(number, set()).add(search_key(address))
+            if number not in self._companies:
+                self._companies[number] = self._project(item) if self._project is not None else item
+                result['companies'].append(self._companies[number])
+        return result
+
+    def summary(self) -> dict:
+        """
+        Combined statistics of the results yielded so far.
+        """
+        shared = sorted(((number, queries) for number, queries in self._found_under.items() if len(queries) > 1),
+                        key=lambda shared: (-len(shared[1]), shared[0]))
+        return {
+            'addresses': len(self._addresses),
+            'searches': len(self._queries),
+            'statuses': self._statuses,
+            'company_hits': self._company_hits,
+            'unique_companies': len(self._companies),
+            'shared_companies': [{'company_number': number,
+                                  'addresses': sorted(index for query in queries for index in self._queries[query])}
+                                 for number, queries in shared],
+            'elapsed_ms': round(self._elapsed * 1000, 1),
+        }
+
+    def stream(self):
+        """
+        Newline delimited JSON: an 'address' line per address as it completes, then a 'summary' line.
+        """
+        for result in self.results():
+            yield dump_line(dict(result, type='address'))
+        yield dump_line(dict(self.summary(), type='summary'))
+
+    def collect(self) -> dict:
+        """
+        Every result in request order, the distinct companies found and the summary.
+        """
+        results = sorted(self.results(), key=lambda result: result['index'])
+        for result in results:
+            result.pop('companies', None)
+        return {'results': results, 'companies': self._companies, 'summary': self.summary()}
@@ -0,0 +1,78 @@
+import re
+
+# Outward code, optional space, inward code, e.g. SS9 1AA
+POSTCODE_PATTERN = re.compile(r'^([A-Z]{1,2}[0-9][A-Z0-9]?)\s*([0-9][A-Z]{2})$')
+TRAILING_POSTCODE_PATTERN = re.compile(r'\b[A-Z]{1,2}[0-9][A-Z0-9]?\s*[0-9][A-Z]{2}$')
+
+# Common street suffix abbreviations in registered office addresses
+STREET_ABBREVIATIONS = {
+    'RD': 'ROAD',
+    'ST': 'STREET',
+    'AVE': 'AVENUE',
+    'AV': 'AVENUE',
+    'LN': 'LANE',
+    'DR': 'DRIVE',
+    'CRES': 'CRESCENT',
+    'CL': 'CLOSE',
+    'CT': 'COURT',
+    'PL': 'PLACE',
+    'SQ': 'SQUARE',
+    'GDNS': 'GARDENS',
+    'TER': 'TERRACE',
+    'HSE': 'HOUSE',
+}
+
+
+def normalise_postcode(postcode: str) -> str:
+    """
+    Upper case a postcode with a single space before the inward code, e.g. 'ss91aa' -> 'SS9 1AA'.
+    Strings that are not UK postcodes are only upper cased and stripped.
+    """
+    postcode = re.sub(r'\s+', ' ', (postcode or '').strip().upper())
+    match = POSTCODE_PATTERN.match(postcode)
+    if match is None:
+        return postcode
+    return f"{match.group(1)} {match.group(2)}"
+
+
+def postcode_sector(postcode: str) -> str:
+    """
+    'SS9 1AA' -> 'SS9 1', or '' if the postcode is not valid.
+    """
+    match = POSTCODE_PATTERN.match(normalise_postcode(postcode))
+    return f"{match.group(1)} {match.group(2)[0]}" if match else ''
+
+
+def postcode_district(postcode: str) -> str:
+    """
+    'SS9 1AA' -> 'SS9', or '' if the postcode is not valid.
+    """
+    match = POSTCODE_PATTERN.match(normalise_postcode(postcode))
+    return match.group(1) if match else ''
+
+
+def normalise_street(street: str) -> str:
+    """
+    Upper case, drop punctuation and expand common abbreviations, e.g. '12, Example Rd.' -> '12 EXAMPLE ROAD'.
+    """
+    words = re.sub(r'[^A-Z0-9 ]', ' ', (street or '').upper()).split()
+    return ' '.join(STREET_ABBREVIATIONS.get(word, word) for word in words)
+
+
+def normalise_address(street: str, postcode: str) -> str:
+    """
+    Key identifying an address across spellings, e.g. '12 EXAMPLE ROAD, SS9 1AA'.
+    """
+    return ', '.join(part for part in (normalise_street(street), normalise_postcode(postcode)) if part)
+
+
+def split_postcode(address: str) -> tuple:
+    """
+    Split a free text address into the text before a trailing postcode and the normalised postcode,
+    e.g. '12 Example Rd, ss9 1aa' -> ('12 Example Rd, ', 'SS9 1AA'). The postcode is '' if there is none.
+    """
+    address = (address or '').strip()
+    match = TRAILING_POSTCODE_PATTERN.search(address.upper())
+    if match is None:
+        return address, ''
+    return address[:match.start()], normalise_postcode(match.group(0))
@@ -0,0 +1,44 @@
+import time
+
+from rest_framework.renderers import JSONRenderer
+
+from companies_house import metrics as ch_metrics
+
+try:
+    import orjson
+except ImportError:  # orjson is optional, fall back to DRF's encoder
+    orjson = None
+
+
+RENDER_DURATION = ch_metrics.REGISTRY.histogram(
+    'address_render_duration_seconds', 'Time spent serialising JSON responses by view.', ('view',),
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25))
+RENDER_BYTES = ch_metrics.REGISTRY.histogram(
+    'address_response_bytes', 'Size of serialised JSON responses before compression by view.', ('view',),
+    buckets=(1e3, 1e4, 5e4, 1e5, 2.5e5, 5e5, 1e6, 2.5e6, 5e6))
+
+
+class FastJSONRenderer(JSONRenderer):
+    """
+    JSON renderer that serialises with orjson when it is installed and records
+    serialisation time and payload size per view.
+    """
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        start = time.perf_counter()
+        renderer_context = renderer_context or {}
+        content = None
+        if orjson is not None and data is not None and not self.get_indent(accepted_media_type, renderer_context):
+            try:
+                content = orjson.dumps(data)
+            except TypeError:
+                # Types only DRF's encoder knows about, e.g. lazy translation strings
+                content = None
+        if content is None:
+            content = super().render(data, accepted_media_type, renderer_context)
+
+        view = renderer_context.get('view')
+        view_name = view.__class__.__name__ if view is not None else ''
+        RENDER_DURATION.observe(view_name, value=time.perf_counter() - start)
+        RENDER_BYTES.observe(view_name, value=len(content))
+        return content
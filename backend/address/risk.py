@@ -0,0 +1,96 @@
+from django.db import transaction
+from django.db.models import Count, Max, Q
+
+from .models import AddressRiskSummary, Company, CompanyOfficer
+
+SUMMARY_FIELDS = ['postal_code', 'company_count', 'active_count', 'dissolved_count', 'officer_count',
+                  'newest_incorporation', 'undeliverable_count', 'dispute_count', 'undeliverable_share',
+                  'dispute_share', 'date_updated']
+
+
+def summary_counts() -> dict:
+    """
+    Aggregates of a group of companies behind a risk summary, for annotate() or aggregate().
+    """
+    return dict(
+        companies=Count('id'),
+        active=Count('id', filter=Q(company_status='active')),
+        dissolved=Count('id', filter=Q(company_status='dissolved')),
+        newest_incorporation=Max('date_of_creation'),
+        undeliverable=Count('id', filter=Q(undeliverable_registered_office_address=True)),
+        dispute=Count('id', filter=Q(registered_office_is_in_dispute=True)),
+    )
+
+
+def summary_from_row(address: str, postcode: str, row: dict) -> AddressRiskSummary:
+    return AddressRiskSummary(
+        normalised_address=address, postal_code=postcode,
+        company_count=row['companies'], active_count=row['active'], dissolved_count=row['dissolved'],
+        newest_incorporation=row['newest_incorporation'], undeliverable_count=row['undeliverable'],
+        dispute_count=row['dispute'], undeliverable_share=row['undeliverable'] / row['companies'],
+        dispute_share=row['dispute'] / row['companies'])
+
+
+def summarise(addresses: list) -> dict:
+    """
+    Risk summaries of the given normalised addresses computed from the stored companies and officers.
+    """
+    summaries = dict()
+    rows = Company.objects.filter(normalised_address__in=addresses).values('normalised_address').annotate(
+        postcode=Max('postal_code'), **summary_counts())
+    for row in rows:
+        summaries[row['normalised_address']] = summary_from_row(row['normalised_address'], row['postcode'], row)
+
+    officers = CompanyOfficer.objects.filter(company__normalised_address__in=addresses) \
+        .values('company__normalised_address').annotate(officers=Count('officer_id', distinct=True))
+    for row in officers:
+        summary = summaries.get(row['company__normalised_address'])
+        if summary is not None:
+            summary.officer_count = row['officers']
+    return summaries
+
+
+def summarise_postcode(postcode: str):
+    """
+    Risk summary of every company stored in a normalised postcode, or None if there are none.
+    Computed on request rather than stored, for searches by postcode alone.
+    """
+    row = Company.objects.filter(postal_code=postcode).aggregate(**summary_counts())
+    if not row['companies']:
+        return None
+    summary = summary_from_row(postcode, postcode, row)
+    summary.officer_count = CompanyOfficer.objects.filter(company__postal_code=postcode) \
+        .values('officer_id').distinct().count()
+    return summary
+
+
+def refresh_summaries(addresses, chunk_size: int = 500) -> None:
+    """
+    Recompute the risk summaries of addresses whose companies or officers changed.
+
+    Distinct officer counts cannot be adjusted by deltas, so each touched address is
+    recomputed with one grouped query over its own companies.
+    """
+    addresses = sorted({address for address in addresses if address})
+    for start in range(0, len(addresses), chunk_size):
+        chunk = addresses[start:start + chunk_size]
+        with transaction.atomic():
+            summaries = summarise(chunk)
+            AddressRiskSummary.objects.filter(normalised_address__in=chunk) \
+                .exclude(normalised_address__in=list(summaries)).delete()
+            AddressRiskSummary.objects.bulk_create(summaries.values(), update_conflicts=True,
+                                                   unique_fields=['normalised_address'], update_fields=SUMMARY_FIELDS)
+
+
+def rebuild_summaries() -> int:
+    """
+    Recompute every address risk summary from the stored companies.
+
+    Returns:
+        int: number of addresses
+    """
+    addresses = set(Company.objects.exclude(normalised_address='').values_list('normalised_address', flat=True))
+    with transaction.atomic():
+        AddressRiskSummary.objects.all().delete()
+        refresh_summaries(addresses)
+    return len(addresses)
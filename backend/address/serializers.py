@@ -11,4 +11,14 @@ class UserDataSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = models.UserData
-        fields = '__all__'
\ No newline at end of file
+        fields = '__all__'
+
+class AreaAggregateSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = models.AreaAggregate
+        exclude = ['id']
+
+class AddressRiskSummarySerializer(serializers.ModelSerializer):
+    class Meta:
+        model = models.AddressRiskSummary
+        exclude = ['id']
@@ -0,0 +1,75 @@
+import hashlib
+import logging
+import threading
+import time
+
+from django.core.cache import cache
+from django.db import DatabaseError, connection
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+
+class StaleCache():
+    """
+    Last good upstream result per key, kept to answer from while Companies House is unavailable.
+
+    Results are stored in the Django cache, shared by every worker, with when they were fetched. Serving one should go
+    with revalidate(), which refetches it in the background once the upstream may be back. At most
+    max_revalidations refetches run at once; stale results served meanwhile are revalidated on a
+    later hit.
+    """
+
+    def __init__(self, prefix: str, ttl: int, max_revalidations: int = 4) -> None:
+        self._prefix = prefix
+        self._ttl = ttl
+        self._max_revalidations = max_revalidations
+        self._revalidating = set()
+        self._lock = threading.Lock()
+
+    def cache_key(self, key: str) -> str:
+        # Memcached style keys: short and without spaces
+        return f"{self._prefix}:{hashlib.sha1(key.encode('utf-8')).hexdigest()}"
+
+    def get(self, key: str):
+        """
+        (result, fetched at) for key, or None.
+        """
+        try:
+            return cache.get(self.cache_key(key))
+        except DatabaseError as e:
+            logger.warning(f'Reading stale {self._prefix} result failed: {e}')
+            return None
+
+    def set(self, key: str, result) -> None:
+        try:
+            cache.set(self.cache_key(key), (result, timezone.now()), self._ttl)
+        except DatabaseError as e:
+            logger.warning(f'Storing {self._prefix} result failed: {e}')
+
+    def revalidate(self, key: str, fetch, delay: float = 0.0) -> bool:
+        """
+        Call fetch() in a background thread after delay seconds, unless key is already being revalidated
+        or max_revalidations are running. fetch is expected to store its result with set().
+
+        Returns:
+            bool: whether a revalidation was started
+        """
+        with self._lock:
+            if key in self._revalidating or len(self._revalidating) >= self._max_revalidations:
+                return False
+            self._revalidating.add(key)
+
+        def run():
+            try:
+                time.sleep(delay)
+                fetch()
+            except Exception as e:
+                logger.warning(f'Revalidating {self._prefix} result failed: {e}')
+            finally:
+                with self._lock:
+                    self._revalidating.discard(key)
+                connection.close()
+
+        threading.Thread(target=run, daemon=True).start()
+        return True
@@ -0,0 +1,73 @@
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+from django.conf import settings
+
+# What each kind of process imports before it can do its work
+TARGETS = {
+    # A WSGI worker with its middleware and every view of the URLconf loaded
+    'web': (settings.BASE_DIR, "import os\n"
+                               "os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'backend.settings')\n"
+                               "from django.core.wsgi import get_wsgi_application\n"
+                               "from django.urls import get_resolver\n"
+                               "get_wsgi_application()\n"
+                               "get_resolver().url_patterns\n"),
+    # The companies_house scripts run by batch jobs
+    'batch': (os.path.join(settings.BASE_DIR, 'companies_house'), "import company_search\n"
+                                                                  "import batch_search\n"),
+}
+# Packages a process should only load when it uses them
+HEAVY_PACKAGES = ('pandas', 'numpy', 'debug_toolbar', 'IPython')
+
+
+def parse_importtime(stderr: str) -> dict:
+    """
+    Microseconds spent importing each top-level package, from the output of python -X importtime.
+    """
+    packages = dict()
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, _, name = line[len('import time:'):].split('|')
+        package = name.strip().split('.')[0]
+        packages[package] = packages.get(package, 0) + int(self_us)
+    return packages
+
+
+def run_target(target: str, importtime: bool = False) -> tuple:
+    """
+    Start a fresh interpreter for a target and wait until it is ready.
+
+    Returns:
+        tuple: (seconds from start to exit, stderr)
+    """
+    cwd, script = TARGETS[target]
+    command = [sys.executable] + (['-X', 'importtime'] if importtime else []) + ['-c', script]
+    start = time.perf_counter()
+    process = subprocess.run(command, cwd=cwd, capture_output=True, text=True, env=os.environ.copy())
+    elapsed = time.perf_counter() - start
+    if process.returncode != 0:
+        raise RuntimeError(f"The {target} process failed to start:\n{process.stderr[-2000:]}")
+    return elapsed, process.stderr
+
+
+def measure_startup(target: str, runs: int = 10) -> dict:
+    """
+    Ready time of a target over runs cold starts, plus an import profile by package from one more.
+    """
+    times = sorted(run_target(target)[0] for _ in range(runs))
+    packages = parse_importtime(run_target(target, importtime=True)[1])
+    return {
+        'target': target,
+        'runs': runs,
+        'median_ms': statistics.median(times) * 1000,
+        'min_ms': times[0] * 1000,
+        'max_ms': times[-1] * 1000,
+        'import_ms': sum(packages.values()) / 1000,
+        'packages_ms': {package: self_us / 1000 for package, self_us in
+                        sorted(packages.items(), key=lambda item: item[1], reverse=True)},
+        'heavy_packages': sorted(package for package in HEAVY_PACKAGES if package in packages),
+    }
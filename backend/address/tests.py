@@ -1,8 +1,60 @@
-from django.test import TestCase, Client
+from django.apps import apps
+from django.test import TestCase, TransactionTestCase, Client, override_settings
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection
 from django.urls import reverse
-from unittest.mock import patch
+from unittest.mock import patch, MagicMock
 from rest_framework import status
-from address.models import UserData, UserAttribute
+from address.models import UserData, UserAttribute, Company, AreaAggregate, AddressRiskSummary
+from address.ingest import ingest_companies, ingest_officers
+from address.risk import rebuild_summaries
+from address.hotspots import rebuild_aggregates
+from address.address_index import AddressIndex, SharedAddressIndex, build_index, company_entries
+from address.autocomplete import Autocomplete, build_autocomplete, query_prefixes, stored_vocabularies
+from address.bloom import BloomFilter, SharedBloomFilter, build_risk_filter, query_keys
+from address.loadtest import StubCompaniesHouse, saturation_point, summarise_stage
+from address.multi_search import MultiAddressSearch
+from address.startup import measure_startup, parse_importtime
+from address.stale_cache import StaleCache
+from address import views
+from django.contrib.auth.models import User
+import csv
+import io
+import json
+import zipfile
+from companies_house.companies_house_api import ChAPI
+from companies_house import metrics
+from companies_house.batch_search import BatchSearch, CheckpointStore
+from companies_house.circuit_breaker import CircuitBreaker, CircuitOpenError, UpstreamError
+from companies_house.code_tables import CodeTable, CodeTables
+from companies_house.company_info import CompanyInfo
+from companies_house.company_search import CompanySearch
+from companies_house.concurrency_limit import AdaptiveConcurrencyLimiter, CONCURRENCY_LIMIT
+from companies_house.credentials import CredentialPool, MissingCredentialsError
+from companies_house.filing_history import FilingHistoryStore, getFilingFeatures
+from companies_house.manifest import EtagManifest
+from companies_house.officer_resolution import OfficerResolver, connectedComponents
+from companies_house.paginator import Paginator
+from companies_house.rate_limit import RateLimiter
+from companies_house.response_cache import DjangoResponseCache, SqliteResponseCache
+from companies_house.single_flight import SingleFlight, COALESCED_REQUESTS
+from companies_house.snapshot_store import SnapshotStore, csvSetPath, readCsvSet
+from companies_house import tracing
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+import pandas as pd
+
+
+def setUpModule():
+    # The app installs a rate limiter and may install a response cache shared by every process on the host,
+    # tests must neither wait for nor use them
+    ChAPI.setRateLimiter(None)
+    ChAPI.setResponseCache(None)
+
 
 class ViewsTestCase(TestCase):
     def setUp(self):
@@ -31,6 +83,35 @@ class ViewsTestCase(TestCase):
         self.assertEqual(response.status_code, status.HTTP_500_INTERNAL_SERVER_ERROR)
         self.assertEqual(response.json(), {'error': 'API error'})
 
+    @patch('companies_house.companies_house_api.ChAPI.getChData')
+    def test_get_company_data_default_projection(self, mock_getChData):
+        mock_getChData.return_value = {'hits': 1, 'items': [{
+            'company_number': '01234567', 'company_name': 'SHAM LTD', 'company_status': 'active',
+            'company_type': 'ltd', 'date_of_creation': '2023-01-01', 'sic_codes': ['99999'],
+            'registered_office_address': {'postal_code': 'SS9 1AA'}, 'kind': 'search-results#company'}]}
+        response = self.client.get(self.get_company_data_url, {'query': 'Leigh-on-Sea'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json()['hits'], 1)
+        self.assertEqual(set(response.json()['items'][0]), {
+            'company_number', 'company_name', 'company_status', 'company_type',
+            'date_of_creation', 'registered_office_address'})
+
+    @patch('companies_house.companies_house_api.ChAPI.getChData')
+    def test_get_company_data_fields(self, mock_getChData):
+        item = {'company_number': '01234567', 'company_name': 'SHAM LTD', 'sic_codes': ['99999']}
+        mock_getChData.return_value = {'items': [item]}
+        response = self.client.get(self.get_company_data_url, {'query': 'Leigh', 'fields': 'company_number,sic_codes'})
+        self.assertEqual(response.json()['items'], [{'company_number': '01234567', 'sic_codes': ['99999']}])
+        response = self.client.get(self.get_company_data_url, {'query': 'Leigh', 'fields': 'all'})
+        self.assertEqual(response.json()['items'], [item])
+
+    @patch('companies_house.companies_house_api.ChAPI.getChData')
+    def test_get_company_data_compressed(self, mock_getChData):
+        mock_getChData.return_value = {'items': [{'company_number': str(n), 'company_name': 'SHAM LTD'} for n in range(100)]}
+        response = self.client.get(self.get_company_data_url, {'query': 'Leigh'}, HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+
     def test_add_user_data_create_new_user(self):
         data = {
             'email': 'test@example.com',
@@ -91,3 +172,1577 @@ class ViewsTestCase(TestCase):
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertTemplateUsed(response, 'hello.html')
         self.assertContains(response, 'Kevin')
+
+
+class MetricsTestCase(TestCase):
+    def setUp(self):
+        self.client = Client()
+        self.metrics_url = reverse('metrics')
+
+    def test_get_endpoint_type(self):
+        base = 'https://api.company-information.service.gov.uk'
+        self.assertEqual(metrics.getEndpointType(base + '/advanced-search/companies'), 'search')
+        self.assertEqual(metrics.getEndpointType(base + '/company/00000006'), 'profile')
+        self.assertEqual(metrics.getEndpointType(base + '/company/00000006/officers'), 'officers')
+        self.assertEqual(metrics.getEndpointType(base + '/officers/abc123/appointments'), 'appointments')
+        self.assertEqual(metrics.getEndpointType(base + '/company/00000006/persons-with-significant-control'), 'psc')
+        self.assertEqual(metrics.getEndpointType(base + '/company/00000006/charges'), 'charges')
+
+    @patch('companies_house.companies_house_api.requests.get')
+    def test_get_ch_data_records_call(self, mock_get):
+        mock_get.return_value.status_code = 200
+        mock_get.return_value.json.return_value = {'items': []}
+        mock_get.return_value.headers = {'X-Ratelimit-Remain': '598', 'X-Ratelimit-Limit': '600'}
+        mock_get.return_value.content = b'{"items": []}'
+        before = metrics.UPSTREAM_REQUESTS.value('profile', '200')
+        ChAPI.getChData('https://api.company-information.service.gov.uk/company/00000006', 'key')
+        self.assertEqual(metrics.UPSTREAM_REQUESTS.value('profile', '200'), before + 1)
+        self.assertEqual(metrics.UPSTREAM_RATELIMIT_REMAINING.value(), 598)
+
+    @patch('companies_house.companies_house_api.ChAPI.getChData')
+    def test_metrics_endpoint(self, mock_getChData):
+        mock_getChData.return_value = {'items': []}
+        self.client.get(reverse('get_company_data'), {'query': 'London'})
+        response = self.client.get(self.metrics_url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response['Content-Type'].startswith('text/plain'))
+        self.assertContains(response, 'address_view_requests_total{view="get_company_data",status="200"}')
+        self.assertContains(response, 'address_view_duration_seconds_bucket{view="get_company_data",le="+Inf"}')
+
+
+class SingleFlightTestCase(TestCase):
+    def run_concurrently(self, flight, key, fn, n=5):
+        results = []
+
+        def call():
+            try:
+                results.append(flight.do(key, fn))
+            except Exception as e:
+                results.append(e)
+
+        threads = [threading.Thread(target=call) for _ in range(n)]
+        for thread in threads:
+            thread.start()
+        return threads, results
+
+    def wait_for_followers(self, group, n, timeout=5.0):
+        # Until n followers are parked on the leader's call
+        deadline = time.monotonic() + timeout
+        while COALESCED_REQUESTS.value(group, 'process') < n:
+            if time.monotonic() > deadline:
+                self.fail(f'{n} followers were not coalesced within {timeout}s')
+            time.sleep(0.01)
+
+    def test_concurrent_identical_calls_share_one_fetch(self):
+        flight = SingleFlight('test')
+        release = threading.Event()
+        calls = []
+
+        def fetch():
+            calls.append(1)
+            release.wait(5)
+            return {'items': ['company']}
+
+        threads, results = self.run_concurrently(flight, 'london|1000', fetch)
+        try:
+            self.wait_for_followers('test', 4)
+        finally:
+            release.set()
+            for thread in threads:
+                thread.join(5)
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, [{'items': ['company']}] * 5)
+
+    def test_errors_propagate_to_waiters(self):
+        flight = SingleFlight('test_errors')
+        release = threading.Event()
+        calls = []
+
+        def fetch():
+            calls.append(1)
+            release.wait(5)
+            raise RuntimeError('upstream down')
+
+        threads, results = self.run_concurrently(flight, 'london|1000', fetch)
+        try:
+            self.wait_for_followers('test_errors', 4)
+        finally:
+            release.set()
+            for thread in threads:
+                thread.join(5)
+        self.assertEqual(len(calls), 1)
+        # The leader and every follower get the leader's exception
+        self.assertEqual(len(results), 5)
+        for result in results:
+            self.assertIsInstance(result, RuntimeError)
+            self.assertEqual(str(result), 'upstream down')
+        # A failed call is not remembered
+        self.assertEqual(flight.do('london|1000', lambda: {'items': []}), {'items': []})
+
+    def test_shared_result_reused_across_workers(self):
+        with tempfile.TemporaryDirectory() as lock_dir:
+            worker_a = SingleFlight('test_shared', lock_dir=lock_dir)
+            worker_b = SingleFlight('test_shared', lock_dir=lock_dir)
+            self.assertEqual(worker_a.do('london|1000', lambda: {'items': ['a']}), {'items': ['a']})
+            self.assertEqual(worker_b.do('london|1000', lambda: {'items': ['b']}), {'items': ['a']})
+
+    def test_expired_results_are_swept(self):
+        with tempfile.TemporaryDirectory() as lock_dir:
+            flight = SingleFlight('test_sweep', lock_dir=lock_dir, result_ttl=0.05)
+            flight.do('london|1000', lambda: {'items': ['a']})
+            self.assertEqual(len(os.listdir(lock_dir)), 2)
+            time.sleep(0.1)
+            flight.do('leeds|1000', lambda: {'items': ['b']})
+            # Only the files of the key just fetched are left
+            self.assertEqual(len(os.listdir(lock_dir)), 2)
+            self.assertEqual(flight.do('london|1000', lambda: {'items': ['c']}), {'items': ['c']})
+
+
+class UserDataViewSetTestCase(TestCase):
+    def setUp(self):
+        self.client = Client()
+        self.user_data_url = reverse('user-data-list')
+        for n in range(6):
+            user = UserData.objects.create(email=f'user{n}@example.com')
+            for street in range(3):
+                UserAttribute.objects.create(email=user, streetNo=str(street), streetName='Test Street',
+                                             postcode='SS9 1AA' if n % 2 else 'AB1 2CD')
+
+    def test_cursor_pagination_constant_queries(self):
+        # One query for the page of users and one for their prefetched attributes
+        with self.assertNumQueries(2):
+            response = self.client.get(self.user_data_url, {'page_size': 2})
+        page = response.json()
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(page['results']), 2)
+        self.assertEqual(len(page['results'][0]['attributes']), 3)
+        with self.assertNumQueries(2):
+            response = self.client.get(page['next'])
+        self.assertEqual([user['email'] for user in response.json()['results']],
+                         ['user2@example.com', 'user3@example.com'])
+
+    def test_filter_by_postcode(self):
+        response = self.client.get(self.user_data_url, {'postcode': 'ss9 1aa'})
+        emails = [user['email'] for user in response.json()['results']]
+        self.assertEqual(emails, ['user1@example.com', 'user3@example.com', 'user5@example.com'])
+
+
+class EtagManifestTestCase(TestCase):
+    def test_round_trip(self):
+        with tempfile.TemporaryDirectory() as data_dir:
+            manifest_fp = os.path.join(data_dir, 'etag_manifest.json')
+            manifest = EtagManifest(manifest_fp)
+            self.assertEqual(manifest.getChange('01234567', 'e1'), EtagManifest.NEW)
+            manifest.updateCompany('01234567', 'e1', '1700000000.0')
+            manifest.updateResource('01234567', 'officers', 'o1')
+            manifest.updateAppointments('01234567', 'abc', 'a1')
+            manifest.save()
+
+            manifest = EtagManifest(manifest_fp)
+            self.assertEqual(manifest.getChange('01234567', 'e1'), EtagManifest.UNCHANGED)
+            self.assertEqual(manifest.getChange('01234567', 'e2'), EtagManifest.CHANGED)
+            self.assertTrue(manifest.isResourceUnchanged('01234567', 'officers', 'o1'))
+            self.assertFalse(manifest.isResourceUnchanged('01234567', 'charges', ''))
+            self.assertTrue(manifest.isAppointmentsUnchanged('01234567', 'abc', 'a1'))
+
+
+class CompanyInfoTestCase(TestCase):
+    PROFILE = {'company_number': '00000001', 'company_name': 'SHAM LTD', 'etag': 'p1',
+               'links': {'officers': '/company/00000001/officers', 'charges': '/company/00000001/charges',
+                         'filing_history': '/company/00000001/filing-history'}}
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp_dir.cleanup)
+        self.manifest = EtagManifest(os.path.join(self.tmp_dir.name, 'etag_manifest.json'))
+        self.failing = set()
+        self.calls = []
+        for target, kwargs in (
+                ('getChData', {'side_effect': self.get_ch_data}),
+                ('getCredentialPool', {'return_value': CredentialPool(['key'])}),
+                ('getDataFolderLocation', {'side_effect': lambda name: os.path.join(self.tmp_dir.name, name)})):
+            patcher = patch.object(ChAPI, target, **kwargs)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def get_ch_data(self, url, api_key=None, params=None, credentials=None, raise_errors=False, **kwargs):
+        endpoint = metrics.getEndpointType(url)
+        start = (params or {}).get('start_index', 0)
+        self.calls.append((endpoint, start))
+        if (endpoint, start) in self.failing:
+            if raise_errors:
+                raise UpstreamError('timed out')
+            return {}
+        if endpoint == 'profile':
+            return self.PROFILE
+        if endpoint == 'officers':
+            return {'etag': 'o1', 'total_results': 1,
+                    'items': [{'name': 'DOE, Jane', 'links': {'officer': {'appointments': '/officers/abc/appointments'}}}]}
+        if endpoint == 'appointments':
+            return {'etag': 'a1', 'total_results': 1, 'items': [{'appointed_to': {'company_number': '00000001'}}]}
+        if endpoint == 'filing_history':
+            return {'total_results': 1, 'items': [{'transaction_id': 't1', 'date': '2024-05-01'}]}
+        # Two pages of one charge each
+        return {'etag': 'c1', 'total_results': 2, 'items': [{'charge_number': start + 1}]}
+
+    def export(self, run: str) -> bool:
+        self.calls.clear()
+        return CompanyInfo('00000001', run, prefix='Test', manifest=self.manifest).exportCompanyInfo()
+
+    def read_rows(self, table: str, run: str) -> list:
+        try:
+            with open(os.path.join(self.tmp_dir.name, f'Test_{table}_{run}.csv'), newline='') as f:
+                return list(csv.reader(f))
+        except FileNotFoundError:
+            return []
+
+    def test_failed_resources_are_fetched_again(self):
+        # Officers fail outright, the second page of charges fails after the first arrived
+        self.failing = {('officers', 0), ('charges', 1)}
+        self.assertFalse(self.export('run1'))
+        self.assertEqual(self.read_rows('change_log', 'run1'), [['00000001', 'failed', 'officers charges']])
+        self.assertEqual(self.read_rows('company_officers', 'run1'), [])
+        self.assertEqual(self.read_rows('company_charges', 'run1'), [])
+        self.assertNotEqual(self.manifest.getChange('00000001', 'p1'), EtagManifest.UNCHANGED)
+
+        self.failing = set()
+        self.assertTrue(self.export('run2'))
+        self.assertEqual(self.read_rows('change_log', 'run2'), [['00000001', 'new', 'officers charges']])
+        self.assertEqual(len(self.read_rows('company_officers', 'run2')), 1)
+        self.assertEqual(len(self.read_rows('officer_appointments', 'run2')), 1)
+        self.assertEqual(len(self.read_rows('company_charges', 'run2')), 2)
+
+        # Complete now, so the next run skips the company after fetching its profile
+        self.assertTrue(self.export('run3'))
+        self.assertEqual(self.read_rows('change_log', 'run3'), [['00000001', 'unchanged', '']])
+        self.assertEqual(self.calls, [('profile', 0)])
+
+    def test_rows_are_written_in_batches(self):
+        with patch.object(CompanyInfo, 'BATCH_ROWS', 1), \
+                patch.object(CompanyInfo, 'writeRows', autospec=True, side_effect=CompanyInfo.writeRows) as write_rows:
+            self.assertTrue(self.export('run1'))
+        # One append per page of charges rather than one for the whole list
+        charges = [call.args[2] for call in write_rows.call_args_list if call.args[1] == 'company_charges']
+        self.assertEqual([len(rows) for rows in charges], [1, 1])
+        self.assertEqual(len(self.read_rows('company_charges', 'run1')), 2)
+
+    def test_failed_appointments_fail_the_officers(self):
+        self.failing = {('appointments', 0)}
+        self.assertFalse(self.export('run1'))
+        self.assertEqual(self.read_rows('change_log', 'run1'), [['00000001', 'failed', 'officers']])
+        self.assertFalse(self.manifest.isResourceUnchanged('00000001', 'officers', 'o1'))
+        self.assertFalse(self.manifest.isAppointmentsUnchanged('00000001', 'abc', 'a1'))
+        # Charges were exported, so they are not fetched past their first page again
+        self.failing = set()
+        self.assertTrue(self.export('run2'))
+        self.assertEqual(self.read_rows('change_log', 'run2'), [['00000001', 'changed', 'officers']])
+        self.assertNotIn(('charges', 1), self.calls)
+
+    def test_failed_profile(self):
+        self.failing = {('profile', 0)}
+        self.assertFalse(self.export('run1'))
+        self.assertEqual(self.read_rows('change_log', 'run1'), [['00000001', 'failed', 'profile']])
+        self.assertEqual(self.read_rows('companies', 'run1'), [])
+        self.assertEqual(self.calls, [('profile', 0)])
+
+
+    def test_companies_are_exported_concurrently(self):
+        # Each company's officers are only answered once all three are being fetched at once
+        officers_barrier = threading.Barrier(3, timeout=5)
+        get_ch_data = self.get_ch_data
+
+        def fetch(url, *args, **kwargs):
+            if metrics.getEndpointType(url) == 'officers':
+                officers_barrier.wait()
+            return get_ch_data(url, *args, **kwargs)
+
+        ChAPI.getChData.side_effect = fetch
+        self.addCleanup(ChAPI.setConcurrencyLimiter, ChAPI.getConcurrencyLimiter())
+        CompanySearch(workers=3).exportCompanies(['00000001', '00000002', '00000003'], 'run1', 'Test')
+        self.assertEqual(len(self.read_rows('company_officers', 'run1')), 3)
+
+    def test_filing_history_stores_are_closed(self):
+        opened = []
+        open_store = FilingHistoryStore.__init__
+
+        def track(store, store_fp):
+            open_store(store, store_fp)
+            opened.append(store)
+
+        with patch.object(FilingHistoryStore, '__init__', track):
+            self.assertEqual(CompanyInfo('00000001', 'run1', prefix='Test').getFilingHistory(), 1)
+            self.assertEqual(len(opened), 1)
+            # A search shares one store between its companies
+            CompanySearch(filing_history=True).exportCompanies(['00000001', '00000002', '00000003'], 'run2', 'Test')
+            self.assertEqual(len(opened), 2)
+        for store in opened:
+            with self.assertRaises(sqlite3.ProgrammingError):
+                store.knownTransactionIds('00000001')
+
+
+class RateLimiterTestCase(TestCase):
+    def test_burst_then_spaced(self):
+        limiter = RateLimiter(rate=10, period=10.0, burst=3)
+        self.assertEqual([limiter.tryAcquire() for _ in range(3)], [0.0, 0.0, 0.0])
+        wait = limiter.tryAcquire()
+        self.assertGreater(wait, 0.9)
+        self.assertLessEqual(wait, 1.0)
+
+    def test_shared_limiter(self):
+        limiter = RateLimiter(rate=10, period=10.0, burst=1, shared=True)
+        self.assertEqual(limiter.tryAcquire(), 0.0)
+        self.assertGreater(limiter.tryAcquire(), 0.9)
+
+    def test_state_file_shared_between_limiters(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            state_fp = os.path.join(tmp_dir, 'rate_limit')
+            first = RateLimiter(rate=10, period=10.0, burst=1, state_fp=state_fp)
+            second = RateLimiter(rate=10, period=10.0, burst=1, state_fp=state_fp)
+            self.assertEqual(first.tryAcquire(), 0.0)
+            self.assertGreater(second.tryAcquire(), 0.9)
+
+
+class FakeCompanyInfo():
+    # Writes one companies row per export, in place of the upstream calls of CompanyInfo
+    failing = set()
+
+    def __init__(self, company_number, timestamp, authentication_fp=None, prefix=None):
+        self.company_number = company_number
+        self.fp = ChAPI.getDataFolderLocation(f'{prefix}_companies_{timestamp}.csv')
+
+    def exportCompanyInfo(self):
+        with open(self.fp, 'a', newline='') as f:
+            csv.writer(f).writerow([self.company_number, f'COMPANY {self.company_number}'])
+        # Like a company whose officers could not be fetched after its profile was written
+        return self.company_number not in self.failing
+
+
+class BatchSearchTestCase(TestCase):
+    RESULTS = {'1 A Road': ['00000001', '00000002'], '2 B Road': ['00000002', '00000003'], '3 C Road': ['00000004']}
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp_dir.cleanup)
+        self.searches_fp = os.path.join(self.tmp_dir.name, 'searches.txt')
+        for target, kwargs in (
+                ('getChData', {'side_effect': self.get_ch_data}),
+                ('getCredentialPool', {'return_value': CredentialPool(['key'])}),
+                ('getDataFolderLocation', {'side_effect': lambda name: os.path.join(self.tmp_dir.name, name)})):
+            patcher = patch.object(ChAPI, target, **kwargs)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        patcher = patch('companies_house.batch_search.CompanyInfo', FakeCompanyInfo)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def get_ch_data(self, url, params=None, **kwargs):
+        # Runs in the worker processes, so searches are counted in a file
+        with open(self.searches_fp, 'a') as f:
+            f.write(params['location'] + '\n')
+        return {'items': [{'company_number': number} for number in self.RESULTS[params['location']]]}
+
+    def test_interrupted_run_resumes(self):
+        batch = BatchSearch(output='batch', workers=1, rate=600)
+        complete_company = CheckpointStore.completeCompany
+
+        def crash(store, company_number):
+            # Its rows are already appended to the output when the worker dies
+            if company_number == '00000003':
+                raise RuntimeError('worker crashed')
+            complete_company(store, company_number)
+
+        with patch.object(CheckpointStore, 'completeCompany', crash):
+            with self.assertRaises(RuntimeError):
+                batch.run(list(self.RESULTS))
+        store = CheckpointStore(batch.checkpoint_fp)
+        run_id, _ = store.getRunId()
+        # The pool may also have been stopped while appending the next company
+        self.assertIsNotNone(store.firstInterrupted())
+        self.assertFalse(store.isCompanyDone('00000003'))
+        store.close()
+        with open(self.searches_fp) as f:
+            searched = f.read().splitlines()
+
+        batch.run(list(self.RESULTS))
+        with open(ChAPI.getDataFolderLocation(f'batch_companies_{run_id}.csv'), newline='') as f:
+            rows = list(csv.reader(f))
+        self.assertEqual(rows[0][0], 'company_number')
+        # The cut off append was rolled back and redone, nothing is exported twice or lost
+        self.assertEqual(sorted(row[0] for row in rows[1:]), ['00000001', '00000002', '00000003', '00000004'])
+        with open(self.searches_fp) as f:
+            resumed = f.read().splitlines()[len(searched):]
+        # Completed addresses are not searched again
+        self.assertNotIn('1 A Road', resumed)
+        self.assertEqual((searched + resumed).count('2 B Road'), 2)
+        self.assertEqual(sorted(set(searched + resumed)), sorted(self.RESULTS))
+        store = CheckpointStore(batch.checkpoint_fp)
+        self.assertEqual(store.pendingAddresses(), [])
+        self.assertIsNone(store.firstInterrupted())
+        store.close()
+
+    def test_failed_companies_are_retried(self):
+        batch = BatchSearch(output='batch', workers=1, rate=600)
+        with patch.object(FakeCompanyInfo, 'failing', {'00000003'}):
+            batch.run(list(self.RESULTS))
+        store = CheckpointStore(batch.checkpoint_fp)
+        run_id, _ = store.getRunId()
+        self.assertEqual(store.pendingAddresses(), ['2 B Road'])
+        self.assertFalse(store.isCompanyDone('00000003'))
+        store.close()
+        fp = ChAPI.getDataFolderLocation(f'batch_companies_{run_id}.csv')
+        with open(fp, newline='') as f:
+            self.assertNotIn('00000003', [row[0] for row in csv.reader(f)])
+
+        batch.run(list(self.RESULTS))
+        with open(fp, newline='') as f:
+            self.assertEqual(sorted(row[0] for row in list(csv.reader(f))[1:]),
+                             ['00000001', '00000002', '00000003', '00000004'])
+        store = CheckpointStore(batch.checkpoint_fp)
+        self.assertEqual(store.pendingAddresses(), [])
+        store.close()
+
+    def test_rollback_redoes_later_appends(self):
+        # Another worker appended a company after the one cut off by a crash
+        batch = BatchSearch(output='batch', workers=1, rate=600)
+        output_fp = ChAPI.getDataFolderLocation('batch_companies_run.csv')
+        store = CheckpointStore(batch.checkpoint_fp)
+        store.addAddresses(list(self.RESULTS))
+        with open(output_fp, 'w') as f:
+            f.write('company_number\n00000001\n')
+        store.beginCompany('00000001', '1 A Road', {'companies': 15})
+        store.completeCompany('00000001')
+        store.completeAddress('1 A Road', 1)
+        store.beginCompany('00000003', '2 B Road', {'companies': 24})
+        with open(output_fp, 'a') as f:
+            f.write('000\n00000004\n')
+        store.beginCompany('00000004', '3 C Road', {'companies': 28})
+        store.completeCompany('00000004')
+        store.completeAddress('3 C Road', 1)
+
+        batch.rollbackInterrupted(store, 'run')
+        with open(output_fp) as f:
+            self.assertEqual(f.read(), 'company_number\n00000001\n')
+        self.assertTrue(store.isCompanyDone('00000001'))
+        self.assertFalse(store.isCompanyDone('00000004'))
+        self.assertEqual(store.pendingAddresses(), ['2 B Road', '3 C Road'])
+        self.assertIsNone(store.firstInterrupted())
+        store.close()
+
+
+class PaginatorTestCase(TestCase):
+    @patch('companies_house.companies_house_api.ChAPI.getChData')
+    def test_fetches_every_page_at_max_size(self, mock_getChData):
+        def page(url, api_key, params=None, credentials=None, **kwargs):
+            start = params['start_index']
+            count = max(0, min(params['items_per_page'], 120 - start))
+            return {'etag': 'e', 'total_results': 120, 'items': list(range(start, start + count))}
+        mock_getChData.side_effect = page
+
+        appointments = Paginator('https://api.company-information.service.gov.uk/officers/abc/appointments', 'key')
+        self.assertEqual(appointments.first_page['etag'], 'e')
+        self.assertEqual(list(appointments), list(range(120)))
+        start_indexes = [call.kwargs['params']['start_index'] for call in mock_getChData.call_args_list]
+        self.assertEqual(sorted(start_indexes), [0, 50, 100])
+        self.assertTrue(all(call.kwargs['params']['items_per_page'] == 50 for call in mock_getChData.call_args_list))
+
+
+class FilingHistoryTestCase(TestCase):
+    def test_store_and_features(self):
+        with tempfile.TemporaryDirectory() as data_dir:
+            store = FilingHistoryStore(os.path.join(data_dir, 'filing_history.sqlite'))
+            store.addFilings('01234567', [
+                {'transaction_id': 't3', 'category': 'confirmation-statement', 'type': 'CS01', 'date': '2024-05-01'},
+                {'transaction_id': 't2', 'category': 'accounts', 'type': 'AA', 'date': '2023-12-01'},
+                {'transaction_id': 't1', 'category': 'incorporation', 'type': 'NEWINC', 'date': '2021-06-01'},
+            ])
+            store.addFilings('07654321', [{'transaction_id': 't9', 'category': 'officers', 'date': '2024-01-01'}])
+            store.addFilings('01234567', [{'transaction_id': 't3', 'category': 'accounts', 'date': '2024-05-01'}])
+            self.assertEqual(store.knownTransactionIds('01234567'), {'t1', 't2', 't3'})
+
+            filings = store.loadFrame()
+            self.assertEqual(len(filings), 4)
+            self.assertEqual(str(filings['date'].dtype), 'datetime64[ns]')
+
+            features = getFilingFeatures(filings, as_of=pd.Timestamp('2024-06-01'))
+            company = features.loc['01234567']
+            self.assertEqual(company['total_filings'], 3)
+            self.assertEqual(company['filings_last_12_months'], 2)
+            self.assertEqual(company['days_since_last_accounts'], 183)
+            self.assertTrue(pd.isna(features.loc['07654321', 'days_since_last_accounts']))
+            store.close()
+
+
+class CredentialPoolTestCase(TestCase):
+    def test_assigns_key_with_most_budget(self):
+        pool = CredentialPool(['key1', 'key2'], limit=3)
+        self.assertEqual(sorted(pool.acquire() for _ in range(4)), ['key1', 'key1', 'key2', 'key2'])
+        pool.report('key1', 200, {'X-Ratelimit-Remain': '0'})
+        self.assertEqual(pool.acquire(), 'key2')
+
+    def test_throttled_key_taken_out_of_rotation(self):
+        pool = CredentialPool(['key1', 'key2'])
+        pool.report('key1', 429, {'Retry-After': '60'})
+        self.assertTrue(pool.isThrottled('key1'))
+        self.assertEqual({pool.acquire() for _ in range(5)}, {'key2'})
+
+    @patch('companies_house.companies_house_api.requests.get')
+    def test_get_ch_data_retries_429_with_another_key(self, mock_get):
+        throttled = MagicMock(status_code=429, headers={'Retry-After': '60'}, content=b'')
+        ok = MagicMock(status_code=200, headers={}, content=b'{}')
+        ok.json.return_value = {'company_number': '01234567'}
+        mock_get.side_effect = [throttled, ok]
+        pool = CredentialPool(['key1', 'key2'])
+        data = ChAPI.getChData('https://api.company-information.service.gov.uk/company/01234567', credentials=pool)
+        self.assertEqual(data, {'company_number': '01234567'})
+        first_key = mock_get.call_args_list[0].kwargs['auth'].username
+        second_key = mock_get.call_args_list[1].kwargs['auth'].username
+        self.assertNotEqual(first_key, second_key)
+        self.assertTrue(pool.isThrottled(first_key))
+
+    def test_load_keys_from_environment(self):
+        with patch.dict(os.environ, {'CH_API_KEYS': 'key1, key2,'}):
+            self.assertEqual(CredentialPool.loadKeys(), ['key1', 'key2'])
+
+
+class CodeTablesTestCase(TestCase):
+    def test_codes_are_stable_and_compact(self):
+        with tempfile.TemporaryDirectory() as data_dir:
+            officers = pd.DataFrame({'company_number': ['1', '2', '3', '4'],
+                                     'officer_role': ['director', 'secretary', 'director', ''],
+                                     'nationality': ['British', 'British', 'Irish', 'British']})
+            columns = {'officer_role': 'officer_role', 'nationality': 'nationality'}
+            encoded = CodeTables(data_dir).encodeFrame(officers, columns)
+            self.assertEqual(encoded['officer_role'].tolist(), [0, 1, 0, -1])
+            self.assertEqual(encoded['officer_role'].dtype, 'int8')
+
+            # A later sweep reuses the saved codes and only appends new values
+            later = CodeTables(data_dir).encodeFrame(
+                pd.DataFrame({'officer_role': ['llp-member', 'director']}), columns)
+            self.assertEqual(later['officer_role'].tolist(), [2, 0])
+
+            decoded = CodeTables(data_dir).decodeFrame(encoded, columns)
+            self.assertEqual(decoded['nationality'].tolist(), ['British', 'British', 'Irish', 'British'])
+            self.assertEqual(encoded.groupby('officer_role').size().to_dict(), {-1: 1, 0: 2, 1: 1})
+
+    def test_shared_between_writers(self):
+        with tempfile.TemporaryDirectory() as data_dir:
+            table_fp = os.path.join(data_dir, 'officer_role.csv')
+            # As opened by two processes before either added anything
+            first, second = CodeTable(table_fp), CodeTable(table_fp)
+            first.extend(['director'])
+            second.extend(['secretary'])
+            self.assertEqual(second.values, ['director', 'secretary'])
+            self.assertEqual(first.encode(['secretary', 'director']).tolist(), [1, 0])
+            self.assertEqual(first.decode([1]).tolist(), ['secretary'])
+
+            writers = [CodeTable(table_fp) for _ in range(4)]
+            threads = [threading.Thread(target=lambda writer=writer, n=n: [writer.extend([f'role {n} {i}', f'role {i}'])
+                                                                          for i in range(20)])
+                       for n, writer in enumerate(writers)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            values = CodeTable(table_fp).values
+            self.assertEqual(len(values), len(set(values)))
+            self.assertEqual(len(values), 2 + 4 * 20 + 20)
+            for writer in writers:
+                self.assertEqual(writer.values, values[:len(writer)])
+            self.assertEqual([name for name in os.listdir(data_dir) if name.endswith('.tmp')], [])
+
+
+def company_row(company_number, postal_code='SS9 1AA', company_status='active', accounts_overdue='False',
+                date_of_creation='2023-09-01', address_line_1='12 Example Road', **fields):
+    row = {'company_number': company_number, 'company_name': f'COMPANY {company_number}',
+           'company_status': company_status, 'company_type': 'ltd', 'date_of_creation': date_of_creation,
+           'address_line_1': address_line_1, 'locality': 'Leigh-on-Sea', 'postal_code': postal_code,
+           'accounts_overdue': accounts_overdue, 'undeliverable_registered_office_address': 'False',
+           'registered_office_is_in_dispute': 'False', 'etag': 'e1'}
+    row.update(fields)
+    return row
+
+
+class HotspotsTestCase(TestCase):
+    def setUp(self):
+        self.client = Client()
+        ingest_companies([
+            company_row('00000001'),
+            company_row('00000002', company_status='dissolved'),
+            company_row('00000003', postal_code='ss91ab', accounts_overdue='True', date_of_creation='2023-10-02'),
+            company_row('00000004', postal_code='AB1 2CD'),
+        ])
+
+    def test_aggregates_by_level(self):
+        sector = AreaAggregate.objects.get(level='sector', area='SS9 1')
+        self.assertEqual((sector.company_count, sector.dissolved_count, sector.overdue_count), (3, 1, 1))
+        self.assertEqual(sector.incorporations, {'2023-09': 2, '2023-10': 1})
+        self.assertEqual(AreaAggregate.objects.get(level='unit', area='SS9 1AA').company_count, 2)
+        self.assertEqual(AreaAggregate.objects.get(level='district', area='AB1').company_count, 1)
+
+    def test_incremental_refresh_matches_rebuild(self):
+        counts = ingest_companies([company_row('00000001', company_status='dissolved'),
+                                   company_row('00000002', company_status='dissolved'),
+                                   company_row('00000004', postal_code='SS9 1AA')])
+        self.assertEqual(counts, {'created': 0, 'updated': 2, 'unchanged': 1})
+        self.assertFalse(AreaAggregate.objects.filter(level='district', area='AB1').exists())
+        incremental = {(a.level, a.area): (a.company_count, a.dissolved_count, a.overdue_count, a.incorporations)
+                       for a in AreaAggregate.objects.all()}
+        rebuild_aggregates()
+        rebuilt = {(a.level, a.area): (a.company_count, a.dissolved_count, a.overdue_count, a.incorporations)
+                   for a in AreaAggregate.objects.all()}
+        self.assertEqual(incremental, rebuilt)
+        self.assertEqual(incremental[('unit', 'SS9 1AA')][:2], (3, 2))
+
+    def test_top_n_endpoint(self):
+        with self.assertNumQueries(1):
+            response = self.client.get(reverse('hotspots'), {'level': 'sector', 'limit': 1})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([(a['area'], a['company_count']) for a in response.json()], [('SS9 1', 3)])
+        response = self.client.get(reverse('hotspots'), {'level': 'street'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_area_endpoint(self):
+        response = self.client.get(reverse('hotspot_area', args=['unit', 'ss9 1aa']))
+        self.assertEqual(response.json()['company_count'], 2)
+        response = self.client.get(reverse('hotspot_area', args=['unit', 'ZZ9 9ZZ']))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+class AddressIndexTestCase(TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.index_fp = os.path.join(self.tmp_dir.name, 'address_index.bin')
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_lookup_and_prefix(self):
+        build_index({'12 EXAMPLE ROAD, SS9 1AA': ['00000002', '00000001'], 'SS9 1AA': ['00000001'],
+                     'SS9 1AB': ['SC123456'], 'AB1 2CD': []}, self.index_fp)
+        index = AddressIndex(self.index_fp)
+        self.assertEqual(len(index), 4)
+        self.assertEqual(index.get('12 EXAMPLE ROAD, SS9 1AA'), ['00000001', '00000002'])
+        self.assertEqual(index.get('SS9 1AB'), ['SC123456'])
+        self.assertEqual(index.get('AB1 2CD'), [])
+        self.assertEqual(index.get('ZZ9 9ZZ'), [])
+        self.assertEqual(index.prefix('SS9'), ['SS9 1AA', 'SS9 1AB'])
+        index.close()
+
+    def test_hot_swap(self):
+        shared = SharedAddressIndex(self.index_fp, check_interval=0)
+        self.assertIsNone(shared.get())
+        build_index({'SS9 1AA': ['00000001']}, self.index_fp)
+        old = shared.get()
+        self.assertIs(shared.get(), old)
+        build_index({'SS9 1AA': ['00000003']}, self.index_fp)
+        self.assertEqual(shared.get().get('SS9 1AA'), ['00000003'])
+        # Readers of the replaced file keep a consistent view
+        self.assertEqual(old.get('SS9 1AA'), ['00000001'])
+
+    def test_endpoint(self):
+        ingest_companies([company_row('00000001'), company_row('00000002', postal_code='ss91aa')])
+        build_index(company_entries(), self.index_fp)
+        with patch.object(views, 'address_index', SharedAddressIndex(self.index_fp)):
+            response = self.client.get(reverse('address_companies'), {'street': '12 Example Rd', 'postcode': 'ss9 1aa'})
+            self.assertEqual(response.json(), {'address': '12 EXAMPLE ROAD, SS9 1AA',
+                                               'company_numbers': ['00000001', '00000002']})
+            response = self.client.get(reverse('address_companies'), {'postcode': 'SS91AA'})
+            self.assertEqual(response.json()['company_numbers'], ['00000001', '00000002'])
+
+
+class BloomFilterTestCase(TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.filter_fp = os.path.join(self.tmp_dir.name, 'address_filter.bin')
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_false_positive_rate(self):
+        bloom = BloomFilter.for_capacity(1000, 0.01)
+        for n in range(1000):
+            bloom.add(f'{n} EXAMPLE ROAD, SS9 1AA')
+        self.assertTrue(all(f'{n} EXAMPLE ROAD, SS9 1AA' in bloom for n in range(1000)))
+        false_positives = sum(f'{n} OTHER ROAD, SS9 1AA' in bloom for n in range(10000))
+        self.assertLess(false_positives, 300)
+        bloom.save(self.filter_fp)
+        loaded = BloomFilter.load(self.filter_fp)
+        self.assertEqual(len(loaded), 1000)
+        self.assertIn('999 EXAMPLE ROAD, SS9 1AA', loaded)
+
+    def test_query_keys(self):
+        self.assertEqual(query_keys('12 Example Rd, ss9 1aa'), ['SS9 1AA', '12 EXAMPLE ROAD, SS9 1AA'])
+        self.assertEqual(query_keys('SS91AA'), ['SS9 1AA'])
+        self.assertEqual(query_keys('Leigh-on-Sea'), [])
+
+    @patch('companies_house.companies_house_api.ChAPI.getChData')
+    def test_flagged_addresses(self, mock_getChData):
+        mock_getChData.return_value = {'items': []}
+        ingest_companies([company_row('00000001'), company_row('00000002'), company_row('00000005'),
+                          company_row('00000003', address_line_1='1 Other Road', postal_code='AB1 2CD',
+                                      registered_office_is_in_dispute='True'),
+                          company_row('00000004', address_line_1='2 Other Road', postal_code='AB1 2CD')])
+        build_risk_filter(min_companies=3, fp_rate=0.001).save(self.filter_fp)
+        with patch.object(views, 'risk_filter', SharedBloomFilter(self.filter_fp)):
+            response = self.client.get(reverse('check_address'), {'query': 'ss9 1aa'})
+            self.assertTrue(response.json()['flagged'])
+            response = self.client.get(reverse('check_address'), {'query': '1 Other Rd AB1 2CD'})
+            self.assertTrue(response.json()['flagged'])
+            response = self.client.get(reverse('check_address'), {'query': '2 Other Road, AB1 2CD'})
+            self.assertFalse(response.json()['flagged'])
+            response = self.client.get(reverse('get_company_data'), {'query': '12 Example Road SS9 1AA'})
+            self.assertEqual(response['X-Address-Flagged'], 'true')
+            # A street on its own, as the search box sends it, cannot be looked up
+            response = self.client.get(reverse('check_address'), {'query': '12 Example Road'})
+            self.assertIsNone(response.json()['flagged'])
+            response = self.client.get(reverse('get_company_data'), {'query': '12 Example Road'})
+            self.assertNotIn('X-Address-Flagged', response)
+            search = MultiAddressSearch(['12 Example Road', 'SS9 1AA'], lambda query: ({'items': []}, None),
+                                        flagged=views.is_flagged_address)
+            results = search.collect()['results']
+            self.assertNotIn('flagged', results[0])
+            self.assertTrue(results[1]['flagged'])
+
+
+class AddressRiskTestCase(TestCase):
+    def setUp(self):
+        ingest_companies([
+            company_row('00000001', date_of_creation='2021-05-01'),
+            company_row('00000002', company_status='dissolved', undeliverable_registered_office_address='True'),
+            company_row('00000003', address_line_1='12 Example Rd', registered_office_is_in_dispute='True',
+                        date_of_creation='2023-10-02'),
+            company_row('00000004', address_line_1='1 Other Road'),
+        ])
+        ingest_officers([
+            {'company_number': '00000001', 'officer_id': 'officer-a'},
+            {'company_number': '00000002', 'officer_id': 'officer-a'},
+            {'company_number': '00000002', 'officer_id': 'officer-b'},
+            {'company_number': '99999999', 'officer_id': 'officer-c'},
+        ])
+
+    def summary(self, address='12 EXAMPLE ROAD, SS9 1AA'):
+        return AddressRiskSummary.objects.get(normalised_address=address)
+
+    def test_summary(self):
+        summary = self.summary()
+        self.assertEqual((summary.company_count, summary.active_count, summary.dissolved_count, summary.officer_count),
+                         (3, 2, 1, 2))
+        self.assertEqual(str(summary.newest_incorporation), '2023-10-02')
+        self.assertAlmostEqual(summary.undeliverable_share, 1 / 3)
+        self.assertAlmostEqual(summary.dispute_share, 1 / 3)
+
+    def test_incremental_refresh_matches_rebuild(self):
+        ingest_companies([company_row('00000003', address_line_1='1 Other Road', date_of_creation='2023-10-02')])
+        ingest_officers([{'company_number': '00000002', 'officer_id': 'officer-a'}])
+        self.assertEqual((self.summary().company_count, self.summary().officer_count), (2, 1))
+        self.assertEqual(self.summary('1 OTHER ROAD, SS9 1AA').company_count, 2)
+        incremental = list(AddressRiskSummary.objects.order_by('normalised_address').values_list(
+            'normalised_address', 'company_count', 'officer_count', 'dispute_count', 'newest_incorporation'))
+        rebuild_summaries()
+        rebuilt = list(AddressRiskSummary.objects.order_by('normalised_address').values_list(
+            'normalised_address', 'company_count', 'officer_count', 'dispute_count', 'newest_incorporation'))
+        self.assertEqual(incremental, rebuilt)
+
+    @patch('companies_house.companies_house_api.ChAPI.getChData')
+    def test_risk_header(self, mock_getChData):
+        mock_getChData.return_value = {'items': []}
+        response = self.client.get(reverse('get_company_data'), {'query': '12 Example Road, SS9 1AA'})
+        self.assertEqual(response['X-Address-Risk'], 'companies=3; active=2; dissolved=1; officers=2; '
+                                                     'undeliverable=0.33; dispute=0.33; newest_incorporation=2023-10-02')
+        response = self.client.get(reverse('get_company_data'), {'query': 'Leigh-on-Sea'})
+        self.assertNotIn('X-Address-Risk', response)
+        response = self.client.get(reverse('address_risk'), {'query': '1 Other Road SS9 1AA'})
+        self.assertEqual(response.json()['company_count'], 1)
+
+    @patch('companies_house.companies_house_api.ChAPI.getChData')
+    def test_risk_header_for_separate_searches(self, mock_getChData):
+        # The frontend searches the street and the postcode as two queries
+        mock_getChData.return_value = {'items': []}
+        response = self.client.get(reverse('get_company_data'), {'query': '12 example road'})
+        self.assertNotIn('X-Address-Risk', response)
+        response = self.client.get(reverse('get_company_data'), {'query': 'SS9 1AA'})
+        self.assertEqual(response['X-Address-Risk'], 'companies=4; active=3; dissolved=1; officers=2; '
+                                                     'undeliverable=0.25; dispute=0.25; newest_incorporation=2023-10-02')
+        response = self.client.get(reverse('address_risk'), {'query': 'ss91aa'})
+        self.assertEqual(response.json()['normalised_address'], 'SS9 1AA')
+        response = self.client.get(reverse('get_company_data'), {'query': 'SS9 9ZZ'})
+        self.assertNotIn('X-Address-Risk', response)
+
+
+class LoadTestTestCase(TestCase):
+    def test_stub_companies_house(self):
+        stub = StubCompaniesHouse(latency=0, limit=2).start()
+        try:
+            url = f'{stub.url}/advanced-search/companies'
+            data = ChAPI.getChData(url, api_key='loadtest', params={'location': 'Leigh', 'size': 3})
+            self.assertEqual(len(data['items']), 3)
+            self.assertEqual(ChAPI.getChData(url, api_key='loadtest', params={'location': 'Leigh'})['hits'], 20)
+            self.assertEqual(ChAPI.getChData(url, api_key='loadtest', params={'location': 'Leigh'}), {})
+            self.assertEqual(stub.requests, 3)
+        finally:
+            stub.stop()
+
+    def test_summarise_stage(self):
+        samples = [('search-address', True, n / 1000, 1) for n in range(1, 101)] + [('add-user-data', False, 1.0, None)]
+        stage = summarise_stage(8, samples, elapsed=2.0)
+        search = stage['endpoints']['search-address']
+        self.assertEqual((search['requests'], search['throughput_rps'], search['p50_ms'], search['p99_ms']),
+                         (100, 50.0, 51.0, 99.0))
+        self.assertEqual(search['db_queries_mean'], 1.0)
+        self.assertEqual(stage['endpoints']['add-user-data']['errors'], 1)
+        self.assertEqual(saturation_point([stage], 'search-address', slo_ms=100), 8)
+        self.assertIsNone(saturation_point([stage], 'add-user-data', slo_ms=100))
+
+    @override_settings(MIDDLEWARE=settings.MIDDLEWARE + ['address.middleware.QueryCountMiddleware'])
+    def test_query_count_header(self):
+        response = self.client.get(reverse('hotspots'))
+        self.assertEqual(response['X-DB-Queries'], '1')
+
+
+class CircuitBreakerTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_opens_on_errors_and_closes_after_trial(self):
+        breaker = CircuitBreaker('test', window=4, min_calls=4, open_seconds=0.05)
+        for failed in (False, True, False, True):
+            breaker.beforeCall()
+            breaker.recordCall(failed, 0.01)
+        self.assertEqual(breaker.state, CircuitBreaker.OPEN)
+        with self.assertRaises(CircuitOpenError):
+            breaker.beforeCall()
+        time.sleep(0.06)
+        trial = breaker.beforeCall()
+        self.assertTrue(trial)
+        # Only one trial call at a time while half open
+        with self.assertRaises(CircuitOpenError):
+            breaker.beforeCall()
+        breaker.recordCall(False, 0.01, trial)
+        self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+
+    def test_only_the_trial_decides_half_open(self):
+        breaker = CircuitBreaker('test', window=2, min_calls=2, open_seconds=0.05)
+        # Started before the circuit opened
+        late = breaker.beforeCall()
+        for _ in range(2):
+            breaker.recordCall(True, 0.01, breaker.beforeCall())
+        time.sleep(0.06)
+        trial = breaker.beforeCall()
+        breaker.recordCall(False, 0.01, late)
+        self.assertEqual(breaker.state, CircuitBreaker.HALF_OPEN)
+        with self.assertRaises(CircuitOpenError):
+            breaker.beforeCall()
+        breaker.recordCall(True, 0.01, trial)
+        self.assertEqual(breaker.state, CircuitBreaker.OPEN)
+
+    @patch('companies_house.companies_house_api.requests.get')
+    def test_limiter_errors_free_the_trial(self, mock_get):
+        mock_get.return_value = MagicMock(status_code=200, headers={}, content=b'{}')
+        breaker = CircuitBreaker('test', window=2, min_calls=2, open_seconds=0.0)
+        for _ in range(2):
+            breaker.recordCall(True, 0.01, breaker.beforeCall())
+        limiter = AdaptiveConcurrencyLimiter('test', initial=1, max_limit=1)
+        rate_limiter = MagicMock()
+        rate_limiter.acquire.side_effect = [TimeoutError('lock'), None]
+        installed = ChAPI._circuit_breaker, ChAPI._concurrency_limiter
+        ChAPI.setCircuitBreaker(breaker)
+        ChAPI.setConcurrencyLimiter(limiter)
+        ChAPI.setRateLimiter(rate_limiter)
+        try:
+            with self.assertRaises(TimeoutError):
+                ChAPI.sendRequest('https://example.com/company/00000001', 'key')
+            self.assertEqual(limiter.in_flight, 0)
+            self.assertEqual(breaker.state, CircuitBreaker.HALF_OPEN)
+            # The next call is let through as the trial
+            ChAPI.sendRequest('https://example.com/company/00000001', 'key')
+            self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+        finally:
+            ChAPI.setCircuitBreaker(installed[0])
+            ChAPI.setConcurrencyLimiter(installed[1])
+            ChAPI.setRateLimiter(None)
+
+    def test_opens_on_slow_calls(self):
+        breaker = CircuitBreaker('test', slow_call_duration=1.0, window=4, min_calls=4)
+        for duration in (0.1, 2.0, 3.0, 0.1):
+            breaker.recordCall(False, duration)
+        self.assertEqual(breaker.state, CircuitBreaker.OPEN)
+
+    @patch('companies_house.companies_house_api.ChAPI.sendRequest')
+    def test_raise_errors(self, mock_sendRequest):
+        mock_sendRequest.return_value = None
+        self.assertEqual(ChAPI.getChData('https://example.com', api_key='key'), {})
+        with self.assertRaises(UpstreamError):
+            ChAPI.getChData('https://example.com', api_key='key', raise_errors=True)
+
+
+class StaleCacheTestCase(TransactionTestCase):
+    # Revalidations write to the database cache from their own thread, outside a test transaction
+    def setUp(self):
+        cache.clear()
+
+    @patch('companies_house.companies_house_api.ChAPI.getChData')
+    def test_stale_while_revalidate(self, mock_getChData):
+        url = reverse('get_company_data')
+        mock_getChData.side_effect = [{'items': [{'company_number': '00000001'}]}, CircuitOpenError('test', 0),
+                                      {'items': [{'company_number': '00000002'}]}]
+        self.client.get(url, {'query': 'Stale Road'})
+        response = self.client.get(url, {'query': 'Stale Road'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.json()['stale'])
+        self.assertEqual(response.json()['items'], [{'company_number': '00000001'}])
+        self.assertIn('fetched_at', response.json())
+        self.assertIn('Stale', response['Warning'])
+        # Revalidated in the background
+        for _ in range(100):
+            if views.search_cache.get('stale road|1000')[0]['items'][0]['company_number'] == '00000002':
+                break
+            time.sleep(0.01)
+        self.assertEqual(views.search_cache.get('stale road|1000')[0]['items'], [{'company_number': '00000002'}])
+
+    def test_stale_results_are_shared(self):
+        # Kept in the database, so every worker can answer from them
+        self.assertEqual(settings.CACHES['default']['BACKEND'], 'django.core.cache.backends.db.DatabaseCache')
+        StaleCache('test_shared', ttl=60).set('key', {'items': []})
+        self.assertEqual(StaleCache('test_shared', ttl=60).get('key')[0], {'items': []})
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT COUNT(*) FROM django_cache")
+            self.assertEqual(cursor.fetchone()[0], 1)
+
+    def test_revalidations_are_bounded(self):
+        stale_cache = StaleCache('test_bounded', ttl=60, max_revalidations=2)
+        release = threading.Event()
+        started = [stale_cache.revalidate(f'key{i}', release.wait) for i in range(5)]
+        release.set()
+        self.assertEqual(started, [True, True, False, False, False])
+
+    @patch('companies_house.companies_house_api.ChAPI.getChData')
+    def test_outage_without_cached_result(self, mock_getChData):
+        mock_getChData.side_effect = UpstreamError('timed out')
+        response = self.client.get(reverse('get_company_data'), {'query': 'Uncached Road'})
+        self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+        self.assertNotIn('items', response.json())
+
+
+class SearchAddressesTestCase(TestCase):
+    RESULTS = {
+        'leigh road': [{'company_number': '00000001', 'company_name': 'A', 'sic_codes': ['1']},
+                       {'company_number': '00000002', 'company_name': 'B'}],
+        'broadway': [{'company_number': '00000002', 'company_name': 'B'},
+                     {'company_number': '00000003', 'company_name': 'C'}],
+    }
+
+    def setUp(self):
+        self.client.force_login(User.objects.create_user('council', password='secret'))
+        self.url = reverse('search_addresses')
+        # As configured on a deployed server
+        for patcher in (patch.dict(os.environ, {'CH_API_KEY': 'key'}), patch.dict(ChAPI._credential_pools, clear=True)):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def get_ch_data(self, url, params=None, **kwargs):
+        location = params['location'].strip().lower()
+        if location == 'down street':
+            raise UpstreamError('timed out')
+        return {'hits': len(self.RESULTS.get(location, [])), 'items': self.RESULTS.get(location, [])}
+
+    @patch('companies_house.companies_house_api.ChAPI.getChData')
+    def test_stream(self, mock_getChData):
+        mock_getChData.side_effect = self.get_ch_data
+        response = self.client.post(self.url, {'addresses': ['Leigh Road', 'Broadway', 'leigh road ', 'Down Street']},
+                                    content_type='application/json')
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        lines = [json.loads(line) for line in b''.join(response.streaming_content).splitlines()]
+        # Repeated addresses are searched once
+        self.assertEqual(mock_getChData.call_count, 3)
+        results = {line['index']: line for line in lines if line['type'] == 'address'}
+        self.assertEqual(sorted(results), [0, 1, 2, 3])
+        self.assertEqual(results[3]['status'], 'unavailable')
+        self.assertEqual(results[1]['company_numbers'], ['00000002', '00000003'])
+        # Each company is sent in full once, with the default fields only
+        sent = [company for line in results.values() for company in line.get('companies', [])]
+        self.assertEqual(sorted(company['company_number'] for company in sent), ['00000001', '00000002', '00000003'])
+        self.assertNotIn('sic_codes', sent[0])
+        summary = lines[-1]
+        self.assertEqual(summary['type'], 'summary')
+        self.assertEqual(summary['searches'], 3)
+        self.assertEqual(summary['statuses'], {'ok': 3, 'unavailable': 1})
+        self.assertEqual(summary['unique_companies'], 3)
+        self.assertEqual(summary['company_hits'], 6)
+        self.assertEqual(summary['shared_companies'], [{'company_number': '00000002', 'addresses': [0, 1, 2]}])
+
+    @patch('companies_house.companies_house_api.ChAPI.getChData')
+    def test_collect(self, mock_getChData):
+        mock_getChData.side_effect = self.get_ch_data
+        response = self.client.post(self.url, {'addresses': ['Broadway', 'Leigh Road'], 'stream': False,
+                                               'fields': 'all'}, content_type='application/json')
+        data = response.json()
+        self.assertEqual([result['address'] for result in data['results']], ['Broadway', 'Leigh Road'])
+        self.assertEqual(sorted(data['companies']), ['00000001', '00000002', '00000003'])
+        self.assertEqual(data['companies']['00000001']['sic_codes'], ['1'])
+
+    @patch('companies_house.companies_house_api.requests.get')
+    def test_searches_share_the_rate_limit(self, mock_get):
+        mock_get.return_value = MagicMock(status_code=200, headers={}, content=b'{}')
+        mock_get.return_value.json.return_value = {'hits': 0, 'items': []}
+        addresses = ['1 Rate Road', '2 Rate Road', '3 Rate Road']
+        with tempfile.TemporaryDirectory() as tmp_dir, \
+                override_settings(CH_RATE_LIMIT=600, CH_RATE_LIMIT_FILE=os.path.join(tmp_dir, 'rate_limit')), \
+                patch.object(ChAPI, 'getCredentialPool', return_value=CredentialPool(['key'])):
+            # As installed when the app starts
+            apps.get_app_config('address').ready()
+            limiter = ChAPI._rate_limiter
+            try:
+                with patch.object(limiter, 'acquire', wraps=limiter.acquire) as acquire:
+                    response = self.client.post(self.url, {'addresses': addresses, 'stream': False},
+                                                content_type='application/json')
+            finally:
+                ChAPI.setRateLimiter(None)
+        self.assertIsInstance(limiter, RateLimiter)
+        self.assertEqual(response.json()['summary']['statuses'], {'ok': 3})
+        self.assertEqual(acquire.call_count, 3)
+
+    @patch('companies_house.companies_house_api.requests.get')
+    def test_stream_is_instrumented(self, mock_get):
+        mock_get.return_value = MagicMock(status_code=200, headers={}, content=b'{}')
+        mock_get.return_value.json.return_value = {'hits': 0, 'items': []}
+        requests = metrics.VIEW_REQUESTS.value('search_addresses', '200')
+        with patch.object(ChAPI, 'getCredentialPool', return_value=CredentialPool(['key'])), \
+                patch.object(metrics.VIEW_UPSTREAM_CALLS, 'observe') as observe, \
+                patch('address.multi_search.connection') as mock_connection:
+            response = self.client.post(self.url, {'addresses': ['1 Metric Road', '2 Metric Road']},
+                                        content_type='application/json')
+            # Nothing is searched or recorded until the stream is read
+            self.assertEqual(metrics.VIEW_REQUESTS.value('search_addresses', '200'), requests)
+            b''.join(response.streaming_content)
+        self.assertEqual(metrics.VIEW_REQUESTS.value('search_addresses', '200'), requests + 1)
+        observe.assert_called_once_with('search_addresses', value=2)
+        # Each pool thread gives back its database connection
+        self.assertEqual(mock_connection.close.call_count, 2)
+
+    def test_missing_api_key(self):
+        with patch.dict(os.environ, {'CH_API_KEY': '', 'CH_API_KEYS': ''}), \
+                patch.dict(ChAPI._credential_pools, clear=True):
+            self.assertRaises(MissingCredentialsError, ChAPI.getCredentialPool)
+            response = self.client.post(self.url, {'addresses': ['Broadway']}, content_type='application/json')
+            self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+            self.assertIn('CH_API_KEY', response.json()['error'])
+            response = self.client.get(reverse('get_company_data'), {'query': 'Broadway, SS9 1AB'})
+            self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+            self.assertIn('CH_API_KEY', response.json()['error'])
+
+    def test_rate_limit_scales_with_keys(self):
+        with tempfile.TemporaryDirectory() as tmp_dir, \
+                override_settings(CH_RATE_LIMIT=600, CH_RATE_LIMIT_FILE=os.path.join(tmp_dir, 'rate_limit')):
+            try:
+                with patch.object(ChAPI, 'getCredentialPool', return_value=CredentialPool(['key1', 'key2', 'key3'])):
+                    apps.get_app_config('address').ready()
+                self.assertEqual(ChAPI._rate_limiter._rate, 1800)
+                # A missing key is reported by the searches, not at startup
+                with patch.object(ChAPI, 'getCredentialPool', side_effect=MissingCredentialsError('No key')):
+                    apps.get_app_config('address').ready()
+                self.assertEqual(ChAPI._rate_limiter._rate, 600)
+            finally:
+                ChAPI.setRateLimiter(None)
+
+    def test_validation(self):
+        for body in ({}, {'addresses': 'Broadway'}, {'addresses': ['Broadway', '']},
+                     {'addresses': ['Broadway'] * (settings.ADDRESS_SEARCH_MAX_ADDRESSES + 1)}):
+            response = self.client.post(self.url, body, content_type='application/json')
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.client.logout()
+        response = self.client.post(self.url, {'addresses': ['Broadway']}, content_type='application/json')
+        self.assertIn(response.status_code, (status.HTTP_401_UNAUTHORIZED, status.HTTP_403_FORBIDDEN))
+
+
+class ExportTestCase(TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.companies = 'company_number,company_name\n' + ''.join(f'{n:08d},COMPANY {n}\n' for n in range(20000))
+        self.officers = 'company_number,officer_id\n00000001,officer-a\n'
+        for file_name, content in (('Leigh_companies_1718000000.5.csv', self.companies),
+                                   ('Leigh_company_officers_1718000000.5.csv', self.officers),
+                                   ('Leigh_change_log_1718000000.5.csv', 'company_number\n')):
+            with open(os.path.join(self.tmp_dir.name, file_name), 'w') as f:
+                f.write(content)
+        self.settings_override = override_settings(CH_DATA_DIR=self.tmp_dir.name)
+        self.settings_override.enable()
+        self.client.force_login(User.objects.create_user('analyst', password='secret'))
+
+    def tearDown(self):
+        self.settings_override.disable()
+        self.tmp_dir.cleanup()
+
+    def test_requires_authentication(self):
+        self.client.logout()
+        response = self.client.get(reverse('export_search', args=['Leigh_1718000000.5']))
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_list(self):
+        response = self.client.get(reverse('exports'))
+        self.assertEqual(response.json(), [{'id': 'Leigh_1718000000.5', 'tables': {
+            'companies': len(self.companies), 'company_officers': len(self.officers)}}])
+
+    def test_zip(self):
+        response = self.client.get(reverse('export_search', args=['Leigh_1718000000.5']))
+        self.assertEqual(response['Content-Type'], 'application/zip')
+        chunks = list(response.streaming_content)
+        self.assertGreater(len(chunks), 2)
+        with zipfile.ZipFile(io.BytesIO(b''.join(chunks))) as archive:
+            self.assertEqual(archive.namelist(), ['Leigh_1718000000.5/companies.csv',
+                                                  'Leigh_1718000000.5/company_officers.csv'])
+            self.assertEqual(archive.read('Leigh_1718000000.5/companies.csv').decode(), self.companies)
+
+    def test_zip_is_not_gzipped_again(self):
+        response = self.client.get(reverse('export_search', args=['Leigh_1718000000.5']), HTTP_ACCEPT_ENCODING='gzip')
+        self.assertNotIn('Content-Encoding', response)
+        with zipfile.ZipFile(io.BytesIO(b''.join(response.streaming_content))) as archive:
+            self.assertEqual(archive.read('Leigh_1718000000.5/companies.csv').decode(), self.companies)
+        # Plain CSV is still compressed
+        response = self.client.get(reverse('export_search', args=['Leigh_1718000000.5']), {'type': 'csv'},
+                                   HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+
+    def test_multipart_csv(self):
+        response = self.client.get(reverse('export_search', args=['Leigh_1718000000.5']),
+                                   {'type': 'csv', 'tables': 'company_officers'})
+        boundary = response['Content-Type'].split('boundary=')[1]
+        body = b''.join(response.streaming_content).decode()
+        self.assertTrue(body.endswith(f'--{boundary}--\r\n'))
+        self.assertIn('filename="Leigh_1718000000.5_company_officers.csv"\r\n\r\n' + self.officers, body)
+        self.assertNotIn('COMPANY 1', body)
+        response = self.client.get(reverse('export_search', args=['Leigh_1718000000.5']), {'tables': 'charges'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.get(reverse('export_search', args=['Other_1']))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+class OfficerResolutionTestCase(TestCase):
+    def setUp(self):
+        def officer(company_number, officer_id, surname, forename, other_forenames, postal_code, year='1970'):
+            return {'company_number': company_number, 'officer_id': officer_id, 'officer_surname': surname,
+                    'officer_forename': forename, 'officer_other_forenames': other_forenames,
+                    'officer_name': f'{surname}, {forename} {other_forenames}'.strip(), 'dob_month': '3',
+                    'dob_year': year, 'postal_code': postal_code}
+
+        self.officers = pd.DataFrame([
+            officer('1', 'a1', 'SMITH', 'John', 'Paul', 'SS9 1AA'),
+            officer('2', 'b2', 'SMYTH', 'John', 'Paul', 'SS91AA'),
+            officer('3', 'c3', 'SMITH', 'Jane', '', 'SS9 1AA'),
+            officer('4', 'd4', 'SMITH', 'Jon', 'Paul', 'E1 6AN'),
+            officer('5', 'a1', 'SMITH', 'John', 'Paul', 'E1 6AN', year=''),
+            officer('6', 'e5', 'SMITH', 'John', 'Paul', 'SS9 1AA', year='1985'),
+        ])
+
+    def test_resolve(self):
+        resolved = OfficerResolver().resolve(self.officers)
+        self.assertEqual(resolved['person_id'].tolist(), ['a1', 'a1', 'c3', 'a1', 'a1', 'e5'])
+        self.assertEqual(resolved['cluster_size'].tolist(), [4, 4, 1, 4, 4, 1])
+
+    def test_oversized_blocks_are_skipped(self):
+        resolved = OfficerResolver(max_block_size=2).resolve(self.officers)
+        self.assertEqual(resolved['person_id'].nunique(), 5)
+
+    def test_connected_components(self):
+        labels = connectedComponents(6, pd.Series([4, 3, 1]).to_numpy(), pd.Series([5, 4, 2]).to_numpy())
+        self.assertEqual(labels.tolist(), [0, 1, 1, 3, 3, 3])
+
+
+class ResponseCacheTestCase(TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.cache_fp = os.path.join(self.tmp_dir.name, 'responses.sqlite3')
+        self.response_cache = SqliteResponseCache(self.cache_fp)
+        self.search_url = 'https://api.company-information.service.gov.uk/advanced-search/companies'
+        self.profile_url = 'https://api.company-information.service.gov.uk/company/00000006'
+
+    def tearDown(self):
+        ChAPI.setResponseCache(None)
+        self.response_cache.close()
+        self.tmp_dir.cleanup()
+
+    def test_opt_in(self):
+        cache_fp = os.path.join(self.tmp_dir.name, 'data', 'ch_responses.sqlite3')
+        with override_settings(CH_RATE_LIMIT=0, CH_RESPONSE_CACHE_PATH=cache_fp):
+            # As installed when the app starts, e.g. for a management command
+            apps.get_app_config('address').ready()
+            self.assertIsNone(ChAPI._response_cache)
+            self.assertFalse(os.path.exists(os.path.dirname(cache_fp)))
+            with override_settings(CH_RESPONSE_CACHE='sqlite'):
+                apps.get_app_config('address').ready()
+        self.assertIsInstance(ChAPI._response_cache, SqliteResponseCache)
+        self.assertEqual(ChAPI._response_cache.cache_fp, cache_fp)
+        self.assertTrue(os.path.isdir(os.path.dirname(cache_fp)))
+
+    def test_round_trip_by_params(self):
+        data = {'items': [{'company_name': f'LEIGH TRADING {n} LTD'} for n in range(100)]}
+        self.response_cache.set(self.search_url, {'location': 'Leigh', 'size': 100}, data)
+        self.assertEqual(self.response_cache.get(self.search_url, {'size': '100', 'location': 'Leigh'}), data)
+        self.assertIsNone(self.response_cache.get(self.search_url, {'location': 'Leigh', 'size': 50}))
+        # Shared with other processes opening the same file
+        self.assertEqual(SqliteResponseCache(self.cache_fp).get(self.search_url, {'location': 'Leigh', 'size': 100}),
+                         data)
+        entries, size = self.response_cache.stats()['search']
+        self.assertEqual(entries, 1)
+        self.assertLess(size, len(json.dumps(data)) / 5)
+
+    def test_ttl_by_resource(self):
+        self.response_cache.set('https://api.company-information.service.gov.uk/disqualified-officers/natural/1', None, {'items': []})
+        self.assertEqual(self.response_cache.stats(), {})
+        self.response_cache.set(self.search_url, {'location': 'Leigh'}, {'items': []})
+        self.response_cache.set(self.profile_url, None, {'company_number': '00000006'})
+        with patch('companies_house.response_cache.time.time', return_value=time.time() + 3600):
+            self.assertIsNone(self.response_cache.get(self.search_url, {'location': 'Leigh'}))
+            self.assertEqual(self.response_cache.get(self.profile_url), {'company_number': '00000006'})
+
+    def test_evicts_least_recently_used(self):
+        response_cache = SqliteResponseCache(self.cache_fp, max_bytes=3000, evict_every=1)
+        for n in range(10):
+            response_cache.set(f'{self.profile_url[:-1]}{n}', None, {'data': os.urandom(400).hex()})
+            time.sleep(0.01)
+        self.assertLessEqual(response_cache.stats()['profile'][1], 3000)
+        self.assertIsNone(response_cache.get(f'{self.profile_url[:-1]}0'))
+        self.assertIsNotNone(response_cache.get(f'{self.profile_url[:-1]}9'))
+        response_cache.close()
+
+    def test_django_backend(self):
+        response_cache = DjangoResponseCache(cache)
+        response_cache.set(self.profile_url, None, {'company_number': '00000006'})
+        self.assertEqual(response_cache.get(self.profile_url), {'company_number': '00000006'})
+
+    @patch('companies_house.companies_house_api.ChAPI.sendRequest')
+    def test_get_ch_data_uses_cache(self, mock_sendRequest):
+        mock_sendRequest.return_value = MagicMock(status_code=200, headers={}, json=lambda: {'items': ['a']})
+        ChAPI.setResponseCache(self.response_cache)
+        hits = metrics.CACHE_REQUESTS.value('upstream_search', 'hit')
+        for _ in range(3):
+            data = ChAPI.getChData(self.search_url, api_key='key', params={'location': 'Leigh'})
+        self.assertEqual(data, {'items': ['a']})
+        self.assertEqual(mock_sendRequest.call_count, 1)
+        self.assertEqual(metrics.CACHE_REQUESTS.value('upstream_search', 'hit'), hits + 2)
+
+
+class AdaptiveConcurrencyLimiterTestCase(TestCase):
+    def test_grows_by_one_per_round_trip(self):
+        limiter = AdaptiveConcurrencyLimiter('test_grow', initial=4, max_limit=6)
+        for _ in range(5):
+            limiter.acquire()
+            limiter.release(200, 0.1)
+        self.assertEqual(limiter.limit, 5)
+        for _ in range(20):
+            limiter.acquire()
+            limiter.release(200, 0.1)
+        self.assertEqual(limiter.limit, 6)
+        self.assertEqual([reason for _, _, reason in limiter.history], ['initial', 'increase', 'increase'])
+        self.assertEqual(CONCURRENCY_LIMIT.value('test_grow'), 6)
+
+    def test_backs_off_once_per_round_trip(self):
+        limiter = AdaptiveConcurrencyLimiter('test_backoff', initial=16)
+        for _ in range(3):
+            limiter.acquire()
+        for _ in range(3):
+            limiter.release(503, 0.01)
+        self.assertEqual(limiter.limit, 8)
+        limiter.acquire()
+        limiter.release(200, 0.01)
+        # Sent after the cut and three times as slow as the baseline, until the average is over twice it
+        time.sleep(0.05)
+        for _ in range(4):
+            limiter.acquire()
+            limiter.release(200, 0.03)
+        self.assertEqual(limiter.limit, 4)
+        self.assertEqual(limiter.history[-1][1:], (4, 'latency'))
+
+    def test_latency_judged_per_endpoint(self):
+        clock = [0.0]
+        with patch('companies_house.concurrency_limit.time.monotonic', side_effect=lambda: clock[0]):
+            limiter = AdaptiveConcurrencyLimiter('test_mixed_latency', initial=4, max_limit=32)
+            # A healthy upstream: fast searches among officer pages six times slower, with some jitter
+            for i in range(900):
+                endpoint, duration = ('search', 0.04) if i % 3 == 0 else ('officers', 0.25 * (1 + (i % 7) / 10))
+                clock[0] += duration
+                limiter.acquire()
+                limiter.release(200, duration, endpoint=endpoint)
+            self.assertEqual(limiter.limit, 32)
+            self.assertNotIn('latency', [reason for _, _, reason in limiter.history])
+            # Officer pages slowing down for good still cut the limit
+            for _ in range(10):
+                clock[0] += 1.0
+                limiter.acquire()
+                limiter.release(200, 1.0, endpoint='officers')
+            self.assertIn('latency', [reason for _, _, reason in limiter.history])
+            self.assertLess(limiter.limit, 32)
+
+    def test_honours_retry_after(self):
+        limiter = AdaptiveConcurrencyLimiter('test_retry_after', initial=2)
+        limiter.acquire()
+        limiter.release(429, 0.1, {'Retry-After': '1'})
+        self.assertEqual(limiter.limit, 1)
+        start = time.monotonic()
+        limiter.acquire()
+        self.assertGreaterEqual(time.monotonic() - start, 0.9)
+        self.assertEqual(limiter.in_flight, 1)
+
+    def test_blocks_at_limit(self):
+        limiter = AdaptiveConcurrencyLimiter('test_block', initial=1)
+        limiter.acquire()
+        acquired = threading.Event()
+        thread = threading.Thread(target=lambda: (limiter.acquire(), acquired.set()))
+        thread.start()
+        self.assertFalse(acquired.wait(0.1))
+        limiter.release(200, 0.1)
+        self.assertTrue(acquired.wait(1))
+        thread.join()
+
+    @patch('companies_house.companies_house_api.requests.get')
+    def test_ch_api_reports_responses(self, mock_get):
+        mock_get.return_value = MagicMock(status_code=429, headers={}, content=b'')
+        limiter = AdaptiveConcurrencyLimiter('test_ch_api', initial=4)
+        ChAPI.setConcurrencyLimiter(limiter)
+        try:
+            ChAPI.sendRequest('https://api.company-information.service.gov.uk/company/00000006', 'key')
+        finally:
+            ChAPI.setConcurrencyLimiter(None)
+        self.assertEqual((limiter.limit, limiter.in_flight), (2, 0))
+
+
+class TracingTestCase(TestCase):
+    def setUp(self):
+        self.tracer = tracing.TRACER
+        self.tracer.clear()
+        self.tracer.setSampleRate(1.0)
+        self.url = 'https://api.company-information.service.gov.uk/company/00000006/officers'
+
+    def tearDown(self):
+        self.tracer.setSampleRate(0.0)
+        self.tracer.clear()
+
+    @patch('companies_house.companies_house_api.requests.get')
+    def test_span_tree_of_paged_upstream_calls(self, mock_get):
+        def page(url, params=None, **kwargs):
+            items = list(range(params['start_index'], min(params['start_index'] + 100, 250)))
+            body = {'total_results': 250, 'items': items}
+            return MagicMock(status_code=200, headers={}, content=json.dumps(body).encode(), json=lambda: body)
+        mock_get.side_effect = page
+
+        with self.tracer.trace('search', query='Leigh'):
+            with self.tracer.span('company', company_number='00000006'):
+                self.assertEqual(len(list(Paginator(self.url, 'key'))), 250)
+        trace, = self.tracer.traces()
+        company, = trace.children
+        calls = company.children
+        self.assertEqual([span.name for span in calls], ['getChData'] * 3)
+        # Pages fetched by worker threads still belong to the company span
+        self.assertEqual({span.attributes['endpoint'] for span in calls}, {'officers'})
+        request, = calls[1].children
+        self.assertEqual(request.attributes['status'], 200)
+        self.assertGreater(request.attributes['bytes'], 0)
+        self.assertEqual(calls[0].attributes['cache'], 'off')
+        self.assertTrue(all(span.duration is not None for span in calls))
+
+        trace_fp = os.path.join(tempfile.mkdtemp(), 'trace.json')
+        tracing.exportChromeTrace(self.tracer.traces(), trace_fp)
+        with open(trace_fp) as f:
+            events = json.load(f)['traceEvents']
+        self.assertEqual(len(events), 1 + 1 + 3 + 3)
+        self.assertEqual(events[0]['name'], 'search')
+        tracing.exportJson(self.tracer.traces(), trace_fp)
+        with open(trace_fp) as f:
+            self.assertEqual(json.load(f)[0]['children'][0]['attributes'], {'company_number': '00000006'})
+
+    def test_unsampled_traces_record_nothing(self):
+        self.tracer.setSampleRate(0.0)
+
+        @tracing.traced('child', attributes=lambda: self.fail('attributes of unsampled span'))
+        def child():
+            tracing.annotate(status=200)
+            return 1
+
+        with self.tracer.trace('search') as span:
+            self.assertIsNone(span)
+            self.assertEqual(child(), 1)
+        self.assertEqual(self.tracer.traces(), [])
+
+    def test_errors_are_recorded(self):
+        with self.assertRaises(ValueError):
+            with self.tracer.trace('search'):
+                raise ValueError('bad')
+        self.assertEqual(self.tracer.traces()[0].attributes['error'], 'ValueError: bad')
+
+
+class AutocompleteTestCase(TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.autocomplete_fp = os.path.join(self.tmp_dir.name, 'autocomplete.bin')
+        ingest_companies([
+            company_row('00000001'),
+            company_row('00000002', postal_code='ss91aa'),
+            company_row('00000003', postal_code='SS9 1AB', address_line_1='3 Station Rd'),
+            company_row('00000004', postal_code='SS9 2XY', address_line_1='14 Example Road'),
+            company_row('00000005', postal_code='E1 6AN', address_line_1='1 Stanley St'),
+        ])
+        build_autocomplete(stored_vocabularies(), self.autocomplete_fp)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_query_prefixes(self):
+        self.assertEqual(query_prefixes('12 example rd '),
+                         {'address': ['12 EXAMPLE ROAD '], 'street': ['EXAMPLE ROAD ']})
+        # The word being typed may be the start of STATION as well as an abbreviation of STREET
+        self.assertEqual(query_prefixes('st'),
+                         {'address': ['ST', 'STREET'], 'street': ['ST', 'STREET'], 'postcode': ['ST']})
+        self.assertEqual(query_prefixes('ss9 1')['postcode'], ['SS91'])
+        self.assertEqual(query_prefixes('  '), {})
+
+    def test_suggest(self):
+        autocomplete = Autocomplete(self.autocomplete_fp)
+        self.assertEqual(autocomplete.suggest('ss9 1'), [
+            {'kind': 'postcode', 'value': 'SS9 1AA', 'companies': 2},
+            {'kind': 'postcode', 'value': 'SS9 1AB', 'companies': 1},
+        ])
+        self.assertEqual([s['value'] for s in autocomplete.suggest('example r', kinds=('street',))], ['EXAMPLE ROAD'])
+        self.assertEqual(autocomplete.suggest('example r', kinds=('street',))[0]['companies'], 3)
+        self.assertEqual([s['value'] for s in autocomplete.suggest('12 Example Rd')],
+                         ['EXAMPLE ROAD', '12 EXAMPLE ROAD SS9 1AA'])
+        self.assertEqual([s['value'] for s in autocomplete.suggest('st')], ['STANLEY STREET', 'STATION ROAD'])
+        self.assertEqual(len(autocomplete.suggest('s', limit=3)), 3)
+        self.assertEqual(autocomplete.suggest('zz'), [])
+        autocomplete.close()
+
+    def test_endpoint(self):
+        url = reverse('autocomplete')
+        with patch.object(views, 'address_autocomplete', SharedAddressIndex(
+                os.path.join(self.tmp_dir.name, 'missing.bin'), opener=Autocomplete)):
+            self.assertEqual(self.client.get(url, {'q': 'ss9'}).status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+        with patch.object(views, 'address_autocomplete', SharedAddressIndex(self.autocomplete_fp, opener=Autocomplete)):
+            response = self.client.get(url, {'q': 'e1', 'kind': 'postcode'})
+            self.assertEqual(response.json(), {'query': 'e1', 'suggestions': [
+                {'kind': 'postcode', 'value': 'E1 6AN', 'companies': 1}]})
+            response = self.client.get(url, {'q': 'ss9', 'limit': 1})
+            self.assertEqual(len(response.json()['suggestions']), 1)
+            response = self.client.get(url, {'q': 'ss9', 'kind': 'town'})
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class SnapshotStoreTestCase(TestCase):
+    COMPANY_COLUMNS = ['company_number', 'company_name', 'postal_code']
+    OFFICER_COLUMNS = ['company_number', 'officer_name', 'officer_id']
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.store = SnapshotStore(os.path.join(self.tmp_dir.name, 'snapshots.sqlite'))
+
+    def tearDown(self):
+        self.store.close()
+        self.tmp_dir.cleanup()
+
+    def write_set(self, timestamp, companies, officers, change_log=None, prefix='SS9__'):
+        tables = {'companies': (self.COMPANY_COLUMNS, companies), 'company_officers': (self.OFFICER_COLUMNS, officers)}
+        if change_log is not None:
+            tables['change_log'] = (['company_number', 'change', 'resources'], change_log)
+        for table, (columns, rows) in tables.items():
+            pd.DataFrame(rows, columns=columns).to_csv(csvSetPath(prefix, table, timestamp, self.tmp_dir.name),
+                                                       index=False)
+        return self.store.recordCsvSet(prefix, timestamp, self.tmp_dir.name, remove=True)
+
+    def test_history(self):
+        first = self.write_set('100.0', [['001', 'A LTD', 'SS9 1AA'], ['002', 'B LTD', 'SS9 1AA']],
+                               [['001', 'SMITH, Ann', 'o1'], ['002', 'JONES, Bob', 'o2']])
+        second = self.write_set('200.0', [['001', 'A LTD', 'SS9 1AA'], ['002', 'B LIMITED', 'SS9 1AA']],
+                                [['001', 'SMITH, Ann', 'o1'], ['002', 'JONES, Bob', 'o2']])
+        # 003 is new, 002 has left the search and 001 lost an officer
+        third = self.write_set('300.0', [['001', 'A LTD', 'SS9 1AA'], ['003', 'C LTD', 'SS9 1AB']], [])
+        self.assertFalse([name for name in os.listdir(self.tmp_dir.name) if name.endswith('.csv')])
+        # 6 rows in the base (companies, officers and search results), then only what changed
+        self.assertEqual(self.store.stats()['changes'], 6 + 2 + 4)
+
+        self.assertEqual(list(self.store.asOf('companies', second)['company_name']), ['A LTD', 'B LIMITED'])
+        self.assertEqual(self.store.searchResults('SS9__', third), ['001', '003'])
+        self.assertEqual(self.store.runAt(250.0), second)
+        self.assertEqual(list(self.store.asOf('company_officers', third)['officer_id']), ['o2'])
+        diff = self.store.diff('companies', first, second)
+        self.assertEqual(diff[['company_name', 'change']].values.tolist(), [['B LTD', 'removed'],
+                                                                           ['B LIMITED', 'added']])
+        self.assertEqual(self.store.diff('company_officers', second)['change'].tolist(), ['removed'])
+
+        timestamp = self.store.exportCsvSet('SS9__', second, self.tmp_dir.name)
+        tables, exported = readCsvSet('SS9__', timestamp, self.tmp_dir.name)
+        self.assertEqual(tables['company_officers'][1], [['001', 'SMITH, Ann', 'o1'], ['002', 'JONES, Bob', 'o2']])
+        self.assertEqual(list(exported), ['001', '002'])
+
+        self.store.rebase(second)
+        self.assertEqual(list(self.store.runs()['run_id']), [second, third])
+        self.assertEqual(list(self.store.asOf('companies', second)['company_name']), ['A LTD', 'B LIMITED'])
+        self.assertEqual(len(self.store.diff('companies', second, third)), 1)
+        with self.assertRaises(LookupError):
+            self.store.diff('companies', first)
+        with self.assertRaises(ValueError):
+            self.write_set('150.0', [], [])
+
+    def test_rebase_keeps_other_prefixes_exportable(self):
+        self.write_set('100.0', [['001', 'A LTD', 'SS9 1AA']], [['001', 'SMITH, Ann', 'o1']])
+        base = self.write_set('200.0', [['002', 'B LTD', 'SS0 1AA']], [], prefix='SS0__')
+        later = self.write_set('300.0', [['003', 'C LTD', 'SS0 1AB']], [], prefix='SS0__')
+        self.store.rebase(base)
+        # SS9__ only ran before the base, so it is read from there
+        self.assertEqual(self.store.runAt(prefix='SS9__'), base)
+        self.assertEqual(self.store.runAt(prefix='SS0__'), later)
+        with self.assertRaises(LookupError):
+            self.store.runAt(prefix='SS1__')
+        timestamp = self.store.exportCsvSet('SS9__', folder=self.tmp_dir.name)
+        tables, exported = readCsvSet('SS9__', timestamp, self.tmp_dir.name)
+        self.assertEqual(timestamp, '200.0')
+        self.assertEqual(list(exported), ['001'])
+        self.assertEqual(tables['company_officers'][1], [['001', 'SMITH, Ann', 'o1']])
+
+    def test_incremental_run(self):
+        self.write_set('100.0', [['001', 'A LTD', 'SS9 1AA'], ['002', 'B LTD', 'SS9 1AA']],
+                       [['001', 'SMITH, Ann', 'o1'], ['002', 'JONES, Bob', 'o2']])
+        # 001 was unchanged so nothing was exported for it, 002 changed its profile only
+        run = self.write_set('200.0', [['002', 'B LIMITED', 'SS9 1AA']], [],
+                             [['001', 'unchanged', ''], ['002', 'changed', '']])
+        self.assertEqual(list(self.store.asOf('companies', run)['company_name']), ['A LTD', 'B LIMITED'])
+        self.assertEqual(list(self.store.asOf('company_officers', run)['officer_id']), ['o1', 'o2'])
+        self.assertEqual(self.store.searchResults('SS9__', run), ['001', '002'])
+
+    def test_categorical_columns_are_coded(self):
+        columns = ['company_number', 'officer_name', 'officer_id', 'officer_role', 'nationality']
+        officers = [['001', 'SMITH, Ann', 'o1', 'director', 'British'], ['002', 'JONES, Bob', 'o2', 'secretary', '']]
+        pd.DataFrame([['001', 'A LTD', 'SS9 1AA'], ['002', 'B LTD', 'SS9 1AA']], columns=self.COMPANY_COLUMNS).to_csv(
+            csvSetPath('SS9__', 'companies', '100.0', self.tmp_dir.name), index=False)
+        pd.DataFrame(officers, columns=columns).to_csv(
+            csvSetPath('SS9__', 'company_officers', '100.0', self.tmp_dir.name), index=False)
+        run = self.store.recordCsvSet('SS9__', '100.0', self.tmp_dir.name, remove=True)
+
+        stored = [json.loads(row[0]) for row in self.store._conn.execute("SELECT value FROM rows")]
+        self.assertIn(['001', 'SMITH, Ann', 'o1', 0, 0], stored)
+        self.assertIn(['002', 'JONES, Bob', 'o2', 1, -1], stored)
+        self.assertEqual(CodeTables(os.path.join(self.tmp_dir.name, 'code_tables')).getTable('officer_role').values,
+                         ['director', 'secretary'])
+        frame = self.store.asOf('company_officers', run)
+        self.assertEqual(frame['officer_role'].dtype, 'category')
+        self.assertEqual(frame['officer_role'].tolist(), ['director', 'secretary'])
+
+        timestamp = self.store.exportCsvSet('SS9__', run, self.tmp_dir.name)
+        tables, _ = readCsvSet('SS9__', timestamp, self.tmp_dir.name)
+        self.assertEqual(tables['company_officers'], (columns, officers))
+
+
+class StartupTestCase(TestCase):
+    def test_parse_importtime(self):
+        stderr = ("import time: self [us] | cumulative | imported package\n"
+                  "import time:       120 |        120 |     pandas._libs\n"
+                  "import time:      2000 |       2120 |   pandas\n"
+                  "import time:        30 |         30 | json\n"
+                  "unrelated warning\n")
+        self.assertEqual(parse_importtime(stderr), {'pandas': 2120, 'json': 30})
+
+    def test_heavy_packages_load_lazily(self):
+        # Neither web workers nor batch scripts should pay for pandas or the debug toolbar at startup
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            environ = {'DB_SQLITE_PATH': os.path.join(tmp_dir, 'db.sqlite3'), 'DEBUG_TOOLBAR': '0'}
+            with patch.dict(os.environ, environ):
+                for target in ('web', 'batch'):
+                    result = measure_startup(target, runs=1)
+                    self.assertEqual(result['heavy_packages'], [], target)
+                    self.assertGreater(result['import_ms'], 0)
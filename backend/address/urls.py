@@ -1,7 +1,9 @@
 
 from rest_framework import routers
 from django.urls import path, include
-from .views import  UserDataViewSet, get_company_data, add_user_data, say_hello
+from .views import  UserDataViewSet, get_company_data, add_user_data, say_hello, hotspots, hotspot_area, \
+    address_companies, check_address, address_risk_summary, exports, export_search, autocomplete, \
+    search_addresses
 
 router = routers.DefaultRouter()
 router.register(r"all-user-data", UserDataViewSet, basename="user-data")
@@ -9,7 +11,16 @@ router.register(r"all-user-data", UserDataViewSet, basename="user-data")
 
 urlpatterns = [
     path('search-address/', get_company_data, name='get_company_data'),
+    path('search-addresses/', search_addresses, name='search_addresses'),
     path('add-user-data/', add_user_data, name='add_user_data'),
+    path('address-companies/', address_companies, name='address_companies'),
+    path('check-address/', check_address, name='check_address'),
+    path('autocomplete/', autocomplete, name='autocomplete'),
+    path('address-risk/', address_risk_summary, name='address_risk'),
+    path('exports/', exports, name='exports'),
+    path('exports/<str:export_id>/', export_search, name='export_search'),
     path('say-hello/', say_hello, name="say_hello"),
+    path('hotspots/', hotspots, name='hotspots'),
+    path('hotspots/<str:level>/<str:area>/', hotspot_area, name='hotspot_area'),
     path('', include(router.urls)),
 ]
@@ -1,47 +1,252 @@
-from rest_framework.decorators import api_view
+from rest_framework.decorators import api_view, permission_classes
+from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 from rest_framework import viewsets, status
+from rest_framework.pagination import CursorPagination
+from django_filters.rest_framework import DjangoFilterBackend
+import django_filters
 
-from django.shortcuts import render
+from django.shortcuts import render, get_object_or_404
+from django.conf import settings
+from django.http import HttpResponse, StreamingHttpResponse
 
 import logging
+import os
 
 from . import models, serializers
 from . import models
-from .models import  UserData, UserAttribute
+from .models import  UserData, UserAttribute, AreaAggregate, AddressRiskSummary
+from .hotspots import LEVELS, ORDERINGS
+from .address_index import SharedAddressIndex
+from .autocomplete import KINDS, Autocomplete
+from .bloom import SharedBloomFilter, query_keys
+from .stale_cache import StaleCache
+from .multi_search import MultiAddressSearch
+from .exports import EXPORT_TABLES, export_files, list_exports, multipart_boundary, stream_multipart, stream_zip
+from .normalise import normalise_address, normalise_postcode, split_postcode
+from .risk import summarise_postcode
 from companies_house.companies_house_api import ChAPI
+from companies_house.circuit_breaker import CircuitOpenError, UpstreamError
+from companies_house.credentials import MissingCredentialsError
+from companies_house import metrics as ch_metrics
+from companies_house.single_flight import SingleFlight
+
+class UserDataCursorPagination(CursorPagination):
+  page_size = 100
+  page_size_query_param = 'page_size'
+  max_page_size = 1000
+  ordering = 'id'
+
+
+class UserDataFilter(django_filters.FilterSet):
+  postcode = django_filters.CharFilter(method='filter_postcode')
+
+  class Meta:
+    model = models.UserData
+    fields = ['postcode']
+
+  def filter_postcode(self, queryset, name, value):
+    # Users with several addresses would otherwise appear once per matching attribute
+    matching = models.UserAttribute.objects.filter(postcode__iexact=value.strip()).values('email_id')
+    return queryset.filter(id__in=matching)
+
 
 class UserDataViewSet(viewsets.ModelViewSet):
-  queryset = models.UserData.objects.all()
+  queryset = models.UserData.objects.prefetch_related('attributes')
   serializer_class = serializers.UserDataSerializer
+  pagination_class = UserDataCursorPagination
+  filter_backends = [DjangoFilterBackend]
+  filterset_class = UserDataFilter
 
 
 # Get an instance of a logger
 logger = logging.getLogger(__name__)
 
+# Company fields rendered by the frontend's CompanyTable
+DEFAULT_COMPANY_FIELDS = ('company_number', 'company_name', 'company_status', 'company_type',
+                          'date_of_creation', 'registered_office_address')
 
-@api_view(['GET'])
-def get_company_data(request):
-    query = request.GET.get('query') 
-    size = request.GET.get('size', 1000)
-    url = 'https://api.company-information.service.gov.uk/advanced-search/companies'
-    api_key = ChAPI.getApiKey()
+# Concurrent identical address searches share one upstream call
+search_flight = SingleFlight('search_address', lock_dir=settings.CH_SINGLE_FLIGHT_DIR)
+
+# Last good search results, served marked as stale while Companies House is unavailable
+search_cache = StaleCache('search_address', ttl=settings.CH_STALE_TTL,
+                          max_revalidations=settings.CH_STALE_MAX_REVALIDATIONS)
+
+# Mapped once per worker, the pages themselves are shared by every worker on the host
+address_index = SharedAddressIndex(settings.ADDRESS_INDEX_PATH)
+risk_filter = SharedBloomFilter(settings.ADDRESS_FILTER_PATH)
+address_autocomplete = SharedAddressIndex(settings.ADDRESS_AUTOCOMPLETE_PATH, opener=Autocomplete)
+
+# Most suggestions returned per keystroke
+MAX_SUGGESTIONS = 50
+
+
+def project_items(data: dict, fields: tuple) -> dict:
+    """
+    Keep only the given fields of each company in an advanced-search response.
+    """
+    projected = {key: value for key, value in data.items() if key != 'items'}
+    if 'items' in data:
+        projected['items'] = [{field: item[field] for field in fields if field in item} for item in data['items']]
+    return projected
+
+
+def is_flagged_address(query: str):
+    """
+    True if the address may be high-density or flagged, False if it definitely is not
+    and None if that is unknown: the filter has not been built or the query has no postcode.
+    """
+    keys = query_keys(query)
+    bloom = risk_filter.get()
+    if bloom is None or not keys:
+        return None
+    return any(key in bloom for key in keys)
+
+
+def address_risk(query: str):
+    """
+    Risk summary of a free text address ending in a postcode, of the whole postcode if the query
+    is only a postcode (the frontend searches the street and the postcode separately), or None.
+    """
+    street, postcode = split_postcode(query)
+    if not postcode:
+        return None
+    if not street.strip(' ,'):
+        return summarise_postcode(postcode)
+    return AddressRiskSummary.objects.filter(normalised_address=normalise_address(street, postcode)).first()
+
+
+def risk_header(summary: AddressRiskSummary) -> str:
+    newest = summary.newest_incorporation.isoformat() if summary.newest_incorporation else ''
+    return (f"companies={summary.company_count}; active={summary.active_count}; "
+            f"dissolved={summary.dissolved_count}; officers={summary.officer_count}; "
+            f"undeliverable={summary.undeliverable_share:.2f}; dispute={summary.dispute_share:.2f}; "
+            f"newest_incorporation={newest}")
+
+
+def fetch_search(key: str, url: str, params: dict) -> dict:
+    data = ChAPI.getChData(url=url, params=params, raise_errors=True)
+    search_cache.set(key, data)
+    return data
+
+
+def search_companies(query: str, size) -> tuple:
+    """
+    Advanced search results for an address, shared with identical concurrent searches.
+
+    Returns:
+        tuple: (data, fetched_at), where fetched_at is None unless Companies House is unavailable
+        and the last good result is served instead. Raises UpstreamError if there is none.
+    """
+    url = f'{settings.CH_API_URL}/advanced-search/companies'
     params = {
         "location": query,
         "size": size
     }
+    key = f"{query.strip().lower()}|{size}"
+    try:
+        return search_flight.do(key, lambda: fetch_search(key, url, params)), None
+    except UpstreamError as e:
+        # Never answer an outage with an empty result, it would look like a clean address
+        retry_after = e.retry_after if isinstance(e, CircuitOpenError) else 0.0
+        cached = search_cache.get(key)
+        ch_metrics.recordCacheLookup('search_stale', cached is not None)
+        if cached is None:
+            raise
+        search_cache.revalidate(key, lambda: search_flight.do(key, lambda: fetch_search(key, url, params)),
+                                delay=retry_after)
+        return cached
+
+
+def missing_credentials_response(e: MissingCredentialsError) -> Response:
+    # A deployment problem rather than an outage, so no Retry-After
+    logger.error(f'Companies House searches are not configured: {e}')
+    return Response({'error': 'Companies House searches are not configured on this server: '
+                              'set CH_API_KEY or CH_API_KEYS'},
+                    status=status.HTTP_503_SERVICE_UNAVAILABLE)
+
+
+def company_fields(fields: str):
+    """
+    Fields kept per company for a fields parameter, or None for 'all'.
+    """
+    if fields == 'all':
+        return None
+    return tuple(fields.split(',')) if fields else DEFAULT_COMPANY_FIELDS
+
+
+@ch_metrics.instrumentView('get_company_data')
+@api_view(['GET'])
+def get_company_data(request):
+    query = request.GET.get('query') 
+    size = request.GET.get('size', 1000)
+    fields = company_fields(request.GET.get('fields'))
 
     if not query:
         logger.error('Address is not provided')
         return Response({'error': 'Address is not provided'}, status=status.HTTP_400_BAD_REQUEST)
     try:
-        data = ChAPI.getChData(url=url, api_key=api_key, params=params)
-        return Response(data, content_type='application/json')
+        try:
+            data, fetched_at = search_companies(query, size)
+        except UpstreamError as e:
+            retry_after = e.retry_after if isinstance(e, CircuitOpenError) else 0.0
+            logger.error(f'Companies House is unavailable: {e}')
+            return Response({'error': 'Companies House is unavailable, please try again later'},
+                            status=status.HTTP_503_SERVICE_UNAVAILABLE,
+                            headers={'Retry-After': str(max(int(retry_after), 1))})
+        except MissingCredentialsError as e:
+            return missing_credentials_response(e)
+        if fields is not None:
+            data = project_items(data, fields)
+        if fetched_at is not None:
+            data = dict(data, stale=True, fetched_at=fetched_at.isoformat())
+        response = Response(data, content_type='application/json')
+        if fetched_at is not None:
+            response['Warning'] = '110 - "Response is Stale"'
+        flagged = is_flagged_address(query)
+        if flagged is not None:
+            response['X-Address-Flagged'] = 'true' if flagged else 'false'
+        summary = address_risk(query)
+        if summary is not None:
+            response['X-Address-Risk'] = risk_header(summary)
+        return response
     except Exception as e:
         logger.error(str(e))
         return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
     
 
+@ch_metrics.instrumentView('search_addresses')
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def search_addresses(request):
+    # Every address costs an upstream search, so the list is capped and only open to signed in users
+    addresses = request.data.get('addresses')
+    if not isinstance(addresses, list) or not addresses or \
+            not all(isinstance(address, str) and address.strip() for address in addresses):
+        return Response({'error': 'addresses must be a non-empty list of addresses'},
+                        status=status.HTTP_400_BAD_REQUEST)
+    if len(addresses) > settings.ADDRESS_SEARCH_MAX_ADDRESSES:
+        return Response({'error': f'At most {settings.ADDRESS_SEARCH_MAX_ADDRESSES} addresses can be searched at once'},
+                        status=status.HTTP_400_BAD_REQUEST)
+    try:
+        ChAPI.getCredentialPool()
+    except MissingCredentialsError as e:
+        # Refused up front rather than failing every address of the stream
+        return missing_credentials_response(e)
+    size = request.data.get('size', 1000)
+    fields = company_fields(request.data.get('fields'))
+    search = MultiAddressSearch(
+        addresses, lambda query: search_companies(query, size), workers=settings.ADDRESS_SEARCH_WORKERS,
+        project=(lambda item: {field: item[field] for field in fields if field in item}) if fields else None,
+        flagged=is_flagged_address)
+    if request.data.get('stream', True):
+        # One line per address as its search completes, then the combined statistics
+        return StreamingHttpResponse(search.stream(), content_type='application/x-ndjson')
+    return Response(search.collect())
+
+
+@ch_metrics.instrumentView('add_user_data')
 @api_view(['POST'])
 def add_user_data(request):
     if request.method == 'POST':
@@ -106,7 +311,126 @@ def add_user_data(request):
         return Response({'message': f'New user {email} has been created successfully!'}, status=status.HTTP_201_CREATED)
     
 
+@api_view(['GET'])
+def hotspots(request):
+    level = request.GET.get('level', 'sector')
+    order_by = request.GET.get('order_by', 'company_count')
+    if level not in LEVELS:
+        return Response({'error': f'level must be one of {", ".join(LEVELS)}'}, status=status.HTTP_400_BAD_REQUEST)
+    if order_by not in ORDERINGS:
+        return Response({'error': f'order_by must be one of {", ".join(ORDERINGS)}'},
+                        status=status.HTTP_400_BAD_REQUEST)
+    try:
+        limit = min(int(request.GET.get('limit', 20)), 500)
+        min_companies = int(request.GET.get('min_companies', 1))
+    except ValueError:
+        return Response({'error': 'limit and min_companies must be integers'}, status=status.HTTP_400_BAD_REQUEST)
+
+    # Served from the precomputed aggregates, one indexed query
+    areas = AreaAggregate.objects.filter(level=level, company_count__gte=min_companies).order_by(f'-{order_by}')[:limit]
+    return Response(serializers.AreaAggregateSerializer(areas, many=True).data)
+
+
+@api_view(['GET'])
+def hotspot_area(request, level, area):
+    aggregate = get_object_or_404(AreaAggregate, level=level, area=area.upper())
+    return Response(serializers.AreaAggregateSerializer(aggregate).data)
+
+
+@api_view(['GET'])
+def address_risk_summary(request):
+    query = request.GET.get('query')
+    if not query:
+        return Response({'error': 'Address is not provided'}, status=status.HTTP_400_BAD_REQUEST)
+    summary = address_risk(query)
+    if summary is None:
+        return Response({'error': 'No companies are stored at this address'}, status=status.HTTP_404_NOT_FOUND)
+    return Response(serializers.AddressRiskSummarySerializer(summary).data)
+
+
+@api_view(['GET'])
+def check_address(request):
+    # Answered from memory without touching Companies House, so the UI can warn before the search returns
+    query = request.GET.get('query')
+    if not query:
+        return Response({'error': 'Address is not provided'}, status=status.HTTP_400_BAD_REQUEST)
+    if risk_filter.get() is None:
+        return Response({'error': 'Address filter is not available'}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+    # null when the query has no postcode to look up, e.g. a street on its own
+    return Response({'query': query, 'flagged': is_flagged_address(query)})
+
+
+@api_view(['GET'])
+def address_companies(request):
+    street = request.GET.get('street', '')
+    postcode = request.GET.get('postcode', '')
+    if not postcode:
+        return Response({'error': 'Postcode is not provided'}, status=status.HTTP_400_BAD_REQUEST)
+    index = address_index.get()
+    if index is None:
+        logger.error(f'Address index {address_index.index_fp} has not been built')
+        return Response({'error': 'Address index is not available'}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+    key = normalise_address(street, postcode) if street else normalise_postcode(postcode)
+    return Response({'address': key, 'company_numbers': index.get(key)})
+
+
+@api_view(['GET'])
+def autocomplete(request):
+    query = request.GET.get('q', '')
+    kinds = tuple(kind for kind in request.GET.get('kind', ','.join(KINDS)).split(',') if kind)
+    if any(kind not in KINDS for kind in kinds):
+        return Response({'error': f"kind must be among {', '.join(KINDS)}"}, status=status.HTTP_400_BAD_REQUEST)
+    try:
+        limit = min(int(request.GET.get('limit', 10)), MAX_SUGGESTIONS)
+    except ValueError:
+        return Response({'error': 'limit must be an integer'}, status=status.HTTP_400_BAD_REQUEST)
+    index = address_autocomplete.get()
+    if index is None:
+        logger.error(f'Autocomplete file {address_autocomplete.index_fp} has not been built')
+        return Response({'error': 'Autocomplete is not available'}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+    return Response({'query': query, 'suggestions': index.suggest(query, max(limit, 0), kinds)})
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def exports(request):
+    stored = list_exports(settings.CH_DATA_DIR)
+    return Response([{'id': export_id, 'tables': {table: os.path.getsize(fp) for table, fp in files.items()}}
+                     for export_id, files in stored.items()])
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def export_search(request, export_id):
+    # 'format' selects a DRF renderer, so the archive type is given as 'type'
+    export_type = request.GET.get('type', 'zip')
+    tables = [table for table in request.GET.get('tables', '').split(',') if table]
+    if export_type not in ('zip', 'csv'):
+        return Response({'error': 'type must be zip or csv'}, status=status.HTTP_400_BAD_REQUEST)
+    unknown = [table for table in tables if table not in EXPORT_TABLES]
+    if unknown:
+        return Response({'error': f'Unknown tables: {", ".join(unknown)}'}, status=status.HTTP_400_BAD_REQUEST)
+    files = export_files(settings.CH_DATA_DIR, export_id, tables)
+    if not files:
+        return Response({'error': 'Export not found'}, status=status.HTTP_404_NOT_FOUND)
+
+    # Files are copied chunk by chunk as the client reads, so memory use does not grow with the export
+    if export_type == 'zip':
+        response = StreamingHttpResponse(stream_zip(files, export_id), content_type='application/zip')
+        response['Content-Disposition'] = f'attachment; filename="{export_id}.zip"'
+    else:
+        boundary = multipart_boundary()
+        response = StreamingHttpResponse(stream_multipart(files, export_id, boundary),
+                                         content_type=f'multipart/mixed; boundary={boundary}')
+    return response
+
+
 @api_view(['GET'])
 def say_hello(request):
     logger.debug('Kevin says hello!')
     return render(request, 'hello.html', {'name': 'Kevin'})
+
+
+def metrics(request):
+    # Plain Django view: Prometheus scrapes text, so skip DRF content negotiation
+    return HttpResponse(ch_metrics.REGISTRY.render(), content_type=ch_metrics.MetricsRegistry.CONTENT_TYPE)
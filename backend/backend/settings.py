@@ -13,6 +13,7 @@ https://docs.djangoproject.com/en/5.0/ref/settings/
 from pathlib import Path
 import os
 import sys
+import tempfile
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -116,12 +117,13 @@ INSTALLED_APPS = [
     "django.contrib.staticfiles",
     "address.apps.AddressConfig",
     'rest_framework',
+    "django_filters",
     "corsheaders",
-    "debug_toolbar",
 ]
 
 MIDDLEWARE = [
-    "debug_toolbar.middleware.DebugToolbarMiddleware",
+    # Gzip, except responses that are compressed already
+    "address.middleware.CompressionMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "corsheaders.middleware.CorsMiddleware",
@@ -132,6 +134,23 @@ MIDDLEWARE = [
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
 ]
 
+# The debug toolbar is opt-in (DEBUG_TOOLBAR=1) as it adds to every process start and request
+DEBUG_TOOLBAR = DEBUG and os.getenv('DEBUG_TOOLBAR', '0') == '1' and 'test' not in sys.argv
+if DEBUG_TOOLBAR:
+    INSTALLED_APPS.append("debug_toolbar")
+    MIDDLEWARE.insert(1, "debug_toolbar.middleware.DebugToolbarMiddleware")
+
+# Count database queries per request in an X-DB-Queries response header (used by the loadtest command)
+if os.getenv('QUERY_COUNT_HEADER'):
+    MIDDLEWARE.insert(1, "address.middleware.QueryCountMiddleware")
+
+REST_FRAMEWORK = {
+    "DEFAULT_RENDERER_CLASSES": [
+        "address.renderers.FastJSONRenderer",
+        "rest_framework.renderers.BrowsableAPIRenderer",
+    ],
+}
+
 INTERNAL_IPS = [
     "127.0.0.1",
     "172.17.0.1",  # Default Docker bridge IP
@@ -177,6 +196,13 @@ DATABASES = {
     }
 }
 
+# A SQLite file instead of PostgreSQL, e.g. for local load tests
+if os.getenv('DB_SQLITE_PATH'):
+    DATABASES['default'] = {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': os.getenv('DB_SQLITE_PATH'),
+    }
+
 # Optionally, you can use an in-memory SQLite database for faster tests
 if 'test' in sys.argv:
     DATABASES['default'] = {
@@ -184,6 +210,18 @@ if 'test' in sys.argv:
         'NAME': ':memory:',
     }
 
+# Shared by every worker, so the last good search results outlive a restart and are there for a
+# worker that never served the search. Create the table with `python manage.py createcachetable`.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+        'LOCATION': 'django_cache',
+        'OPTIONS': {
+            'MAX_ENTRIES': int(os.getenv('CACHE_MAX_ENTRIES', '10000')),
+        },
+    }
+}
+
 # Password validation
 # https://docs.djangoproject.com/en/5.0/ref/settings/#auth-password-validators
 
@@ -229,6 +267,69 @@ STATICFILES_DIRS = [
     os.path.join(BASE_DIR, 'address/static'),  # Static folder for the 'address' app
 ]
 
+# Companies House
+# Base url of the Companies House API, pointed at a stub server by the loadtest command
+CH_API_URL = os.getenv('CH_API_URL', 'https://api.company-information.service.gov.uk')
+
+# Upstream calls from the web app time out after CH_REQUEST_TIMEOUT seconds and go through a
+# circuit breaker: once half of the recent calls fail or take CH_SLOW_CALL_SECONDS or longer,
+# calls fail fast for CH_CIRCUIT_OPEN_SECONDS. Meanwhile searches are answered from the last
+# good result, marked stale, if it is less than CH_STALE_TTL seconds old.
+CH_REQUEST_TIMEOUT = float(os.getenv('CH_REQUEST_TIMEOUT', '10'))
+CH_SLOW_CALL_SECONDS = float(os.getenv('CH_SLOW_CALL_SECONDS', '5'))
+CH_CIRCUIT_OPEN_SECONDS = float(os.getenv('CH_CIRCUIT_OPEN_SECONDS', '30'))
+CH_STALE_TTL = int(os.getenv('CH_STALE_TTL', str(24 * 60 * 60)))
+
+# Companies House responses shared by all workers on this host and by the batch scripts.
+# 'sqlite' keeps them in CH_RESPONSE_CACHE_PATH (WAL mode, least recently used responses are
+# evicted beyond CH_RESPONSE_CACHE_MAX_MB) and 'django' in the default Django cache. Off unless set,
+# so management commands and tests neither create nor read it; docker-compose sets it for the server.
+CH_RESPONSE_CACHE = os.getenv('CH_RESPONSE_CACHE', '')
+CH_RESPONSE_CACHE_PATH = os.getenv('CH_RESPONSE_CACHE_PATH', os.path.join(BASE_DIR, 'data', 'ch_responses.sqlite3'))
+CH_RESPONSE_CACHE_MAX_MB = int(os.getenv('CH_RESPONSE_CACHE_MAX_MB', '256'))
+# Seconds responses are kept by resource type, e.g. CH_RESPONSE_CACHE_TTLS=search=300,profile=3600
+CH_RESPONSE_CACHE_TTLS = {resource: int(ttl) for resource, ttl in (
+    item.split('=', 1) for item in os.getenv('CH_RESPONSE_CACHE_TTLS', '').split(',') if '=' in item)}
+
+# Companies House requests allowed per CH_RATE_PERIOD seconds and per api key by every worker on this
+# host together (the api allows 600 per 5 minutes per key). Workers share the limiter state through
+# CH_RATE_LIMIT_FILE under a file lock. 0 disables it.
+CH_RATE_LIMIT = int(os.getenv('CH_RATE_LIMIT', '600'))
+CH_RATE_PERIOD = float(os.getenv('CH_RATE_PERIOD', '300'))
+CH_RATE_LIMIT_FILE = os.getenv('CH_RATE_LIMIT_FILE', os.path.join(tempfile.gettempdir(), 'ch_rate_limit'))
+
+# Background refetches of stale search results at once per worker, so that a multi-address search
+# during an outage does not start a thread per address
+CH_STALE_MAX_REVALIDATIONS = int(os.getenv('CH_STALE_MAX_REVALIDATIONS', '4'))
+
+# Cap on Companies House requests in flight from each worker, adjusted between 1 and this number
+# by an adaptive (AIMD) limiter that backs off on 429s, 5xx and slow responses. 0 disables it.
+CH_MAX_CONCURRENCY = int(os.getenv('CH_MAX_CONCURRENCY', '0'))
+
+# Addresses accepted by one search-addresses request and how many of them are searched at once.
+# The searches also go through the CH_RATE_LIMIT and CH_MAX_CONCURRENCY limiters shared with the rest of the worker.
+ADDRESS_SEARCH_MAX_ADDRESSES = int(os.getenv('ADDRESS_SEARCH_MAX_ADDRESSES', '500'))
+ADDRESS_SEARCH_WORKERS = int(os.getenv('ADDRESS_SEARCH_WORKERS', '8'))
+
+# Directory shared by all workers on this host, used to coalesce identical concurrent
+# address searches across processes. Leave unset to coalesce within each process only.
+CH_SINGLE_FLIGHT_DIR = os.getenv('CH_SINGLE_FLIGHT_DIR')
+
+# Folder the companies_house scripts export searches to, served by the exports endpoints
+CH_DATA_DIR = os.getenv('CH_DATA_DIR', os.path.join(BASE_DIR, 'data'))
+
+# Memory-mapped address -> company index built by the build_address_index command.
+# Every worker maps the same file and picks up a rebuild without restarting.
+ADDRESS_INDEX_PATH = os.getenv('ADDRESS_INDEX_PATH', os.path.join(BASE_DIR, 'data', 'address_index.bin'))
+
+# Bloom filter of high-density and flagged addresses built by the build_address_filter command
+ADDRESS_FILTER_PATH = os.getenv('ADDRESS_FILTER_PATH', os.path.join(BASE_DIR, 'data', 'address_filter.bin'))
+ADDRESS_FILTER_FP_RATE = float(os.getenv('ADDRESS_FILTER_FP_RATE', '0.01'))
+ADDRESS_FILTER_MIN_COMPANIES = int(os.getenv('ADDRESS_FILTER_MIN_COMPANIES', '10'))
+
+# Sorted postcode, street and address vocabularies for typeahead, built by the build_autocomplete command
+ADDRESS_AUTOCOMPLETE_PATH = os.getenv('ADDRESS_AUTOCOMPLETE_PATH', os.path.join(BASE_DIR, 'data', 'autocomplete.bin'))
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.0/ref/settings/#default-auto-field
 
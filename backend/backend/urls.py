@@ -14,12 +14,16 @@ Including another URLconf
     1. Import the include() function: from django.urls import include, path
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
+from django.conf import settings
 from django.contrib import admin
 from django.urls import path, include
-import debug_toolbar
+from address.views import metrics
 
 urlpatterns = [
     path("admin/", admin.site.urls),
     path("address/", include("address.urls")),
-    path('__debug__/', include(debug_toolbar.urls)),
+    path('metrics', metrics, name='metrics'),
 ]
+
+if settings.DEBUG_TOOLBAR:
+    urlpatterns.append(path('__debug__/', include('debug_toolbar.urls')))
@@ -0,0 +1,302 @@
+from datetime import datetime
+from filelock import FileLock
+import multiprocessing
+import argparse
+import sqlite3
+import shutil
+import time
+import os
+
+try:
+    from companies_house.companies_house_api import ChAPI
+    from companies_house.company_info import CompanyInfo
+    from companies_house.company_search import CompanySearch
+    from companies_house.rate_limit import RateLimiter
+    from companies_house.response_cache import SqliteResponseCache
+except ImportError:
+    from companies_house_api import ChAPI
+    from company_info import CompanyInfo
+    from company_search import CompanySearch
+    from rate_limit import RateLimiter
+    from response_cache import SqliteResponseCache
+
+
+class CheckpointStore():
+    """
+    SQLite record of which addresses and companies of a batch run are complete.
+    Each process opens its own connection; WAL mode lets workers write concurrently.
+    """
+
+    def __init__(self, checkpoint_fp: str) -> None:
+        self._checkpoint_fp = checkpoint_fp
+        self._conn = sqlite3.connect(checkpoint_fp, timeout=60, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS run (key TEXT PRIMARY KEY, value TEXT)")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS addresses (address TEXT PRIMARY KEY, status TEXT NOT NULL, "
+                           "companies INTEGER, completed_at REAL)")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS companies (company_number TEXT PRIMARY KEY, address TEXT, "
+                           "status TEXT NOT NULL, offsets TEXT, completed_at REAL)")
+
+    @property
+    def checkpoint_fp(self) -> str:
+        return self._checkpoint_fp
+
+    def getRunId(self) -> tuple:
+        """
+        Returns:
+            tuple: the timestamp identifying this run and whether the run is new
+        """
+        row = self._conn.execute("SELECT value FROM run WHERE key = 'run_id'").fetchone()
+        if row is not None:
+            return row[0], False
+        run_id = str(datetime.timestamp(datetime.now()))
+        self._conn.execute("INSERT INTO run (key, value) VALUES ('run_id', ?)", (run_id,))
+        return run_id, True
+
+    def addAddresses(self, addresses: list) -> None:
+        self._conn.executemany("INSERT OR IGNORE INTO addresses (address, status) VALUES (?, 'pending')",
+                               [(address,) for address in addresses])
+
+    def pendingAddresses(self) -> list:
+        rows = self._conn.execute("SELECT address FROM addresses WHERE status = 'pending' ORDER BY rowid")
+        return [row[0] for row in rows]
+
+    def completeAddress(self, address: str, companies: int) -> None:
+        self._conn.execute("UPDATE addresses SET status = 'done', companies = ?, completed_at = ? WHERE address = ?",
+                           (companies, time.time(), address))
+
+    def isCompanyDone(self, company_number: str) -> bool:
+        row = self._conn.execute("SELECT status FROM companies WHERE company_number = ?", (company_number,)).fetchone()
+        return row is not None and row[0] == 'done'
+
+    def beginCompany(self, company_number: str, address: str, offsets: dict) -> None:
+        """
+        Record the size of each output file before a company's rows are appended, so that
+        an append interrupted by a crash can be rolled back.
+        """
+        self._conn.execute("INSERT OR REPLACE INTO companies (company_number, address, status, offsets) "
+                           "VALUES (?, ?, 'appending', ?)",
+                           (company_number, address, ','.join(f"{table}:{size}" for table, size in offsets.items())))
+
+    def completeCompany(self, company_number: str) -> None:
+        self._conn.execute("UPDATE companies SET status = 'done', offsets = NULL, completed_at = ? "
+                           "WHERE company_number = ?", (time.time(), company_number))
+
+    def firstInterrupted(self):
+        """
+        Returns:
+            tuple: (append number, {table: file size}) of the earliest append that never completed, or None
+        """
+        row = self._conn.execute("SELECT rowid, offsets FROM companies WHERE status = 'appending' "
+                                 "ORDER BY rowid LIMIT 1").fetchone()
+        if row is None:
+            return None
+        pairs = (pair.rsplit(':', 1) for pair in row[1].split(',') if pair)
+        return row[0], {table: int(size) for table, size in pairs}
+
+    def forgetCompaniesFrom(self, append: int) -> None:
+        """
+        Forget the companies appended from the given append number on (appends are serialised, so
+        rowids follow their order) and mark their addresses pending again, so that they are redone.
+        """
+        with self._conn:
+            self._conn.execute("BEGIN IMMEDIATE")
+            self._conn.execute("UPDATE addresses SET status = 'pending', companies = NULL, completed_at = NULL "
+                               "WHERE address IN (SELECT address FROM companies WHERE rowid >= ?)", (append,))
+            self._conn.execute("DELETE FROM companies WHERE rowid >= ?", (append,))
+
+    def close(self) -> None:
+        self._conn.close()
+
+
+class BatchSearch():
+    """
+    Run address searches from a file with several worker processes sharing one rate limit.
+
+    Results for all addresses are written to one consolidated set of CSV files,
+    {output}_{table}_{run_id}.csv. Every company is first exported to a staging file and
+    only appended to the consolidated files once complete, and each completed address and
+    company is recorded in a checkpoint database, so a restarted run resumes where it stopped
+    and a company found under several addresses is exported once.
+    """
+
+    TABLES = ('companies', 'company_officers', 'officer_appointments', 'sic_codes', 'previous_company_names',
+              'persons_significant_control', 'natures_of_control', 'company_charges', 'charges_persons_entitled',
+              'charges_transactions')
+
+    def __init__(self, output: str = 'batch', workers: int = 4, size: str = '100', authentication_fp: str = None,
+                 checkpoint_fp: str = None, rate: int = None, period: float = 300.0,
+                 response_cache_fp: str = None) -> None:
+        self._output = output
+        self._workers = workers
+        self._size = size
+        self._authentication_fp = authentication_fp
+        if checkpoint_fp is None:
+            checkpoint_fp = ChAPI.getDataFolderLocation(output + '_checkpoint.sqlite')
+        self._checkpoint_fp = checkpoint_fp
+        if rate is None:
+            # Each api key allows 600 requests per 5 minutes
+            rate = 600 * len(ChAPI.getCredentialPool(authentication_fp))
+        self._rate_limiter = RateLimiter(rate=rate, period=period, shared=True)
+        # Responses shared with the web app and earlier runs, None to always ask Companies House
+        self._response_cache_fp = response_cache_fp
+
+    @property
+    def output(self) -> str:
+        return self._output
+
+    @property
+    def checkpoint_fp(self) -> str:
+        return self._checkpoint_fp
+
+    def run(self, addresses: list) -> None:
+        """
+        Search every address not yet completed by a previous run.
+        """
+        store = CheckpointStore(self._checkpoint_fp)
+        run_id, is_new_run = store.getRunId()
+        if is_new_run:
+            CompanySearch(self._authentication_fp).insertHeaders(self._output, run_id)
+        else:
+            self.rollbackInterrupted(store, run_id)
+        store.addAddresses(addresses)
+        pending = store.pendingAddresses()
+        store.close()
+
+        # Staging files left by a crash belong to unfinished companies, which are redone
+        staging_dir = ChAPI.getDataFolderLocation(self._output + '_staging')
+        shutil.rmtree(staging_dir, ignore_errors=True)
+        os.makedirs(staging_dir)
+
+        print(f"{len(pending)} of {len(addresses)} addresses to search (run {run_id})")
+        initargs = (self._rate_limiter, self._checkpoint_fp, self._output, run_id, self._size, self._authentication_fp,
+                    self._response_cache_fp)
+        with multiprocessing.Pool(self._workers, initializer=_initWorker, initargs=initargs) as pool:
+            for address, companies in pool.imap_unordered(_searchAddress, pending):
+                if companies is None:
+                    print(f"Search failed, will retry on the next run: {address}")
+                else:
+                    print(f"{address}: {companies} companies")
+        shutil.rmtree(staging_dir, ignore_errors=True)
+
+    def rollbackInterrupted(self, store: CheckpointStore, run_id: str) -> None:
+        """
+        Truncate output files back to their size before the first append that was cut off by a crash.
+        Other workers may have appended companies after it, which are truncated too and redone.
+        """
+        interrupted = store.firstInterrupted()
+        if interrupted is None:
+            return
+        append, offsets = interrupted
+        for table, size in offsets.items():
+            with open(ChAPI.getDataFolderLocation(f"{self._output}_{table}_{run_id}.csv"), 'r+b') as f:
+                f.truncate(size)
+        store.forgetCompaniesFrom(append)
+
+
+class BatchWorker():
+    """
+    State of one worker process of a BatchSearch run.
+    """
+
+    def __init__(self, checkpoint_fp: str, output: str, run_id: str, size: str, authentication_fp: str = None) -> None:
+        self._store = CheckpointStore(checkpoint_fp)
+        self._output = output
+        self._run_id = run_id
+        self._size = size
+        self._authentication_fp = authentication_fp
+        self._credentials = ChAPI.getCredentialPool(authentication_fp)
+        self._lock = FileLock(ChAPI.getDataFolderLocation(output + '.lock'))
+
+    def searchAddress(self, address: str) -> tuple:
+        """
+        Returns:
+            tuple: the address and its number of companies, or None if the search failed
+        """
+        url = r'https://api.company-information.service.gov.uk/advanced-search/companies'
+        search = ChAPI.getChData(url=url, credentials=self._credentials, params={"location": address, "size": self._size})
+        if 'items' not in search:
+            return address, None
+
+        company_numbers = [str(item['company_number']) for item in search['items'] if item.get('company_number')]
+        exported = True
+        for company_number in company_numbers:
+            if not self._store.isCompanyDone(company_number):
+                exported = self.exportCompany(company_number, address) and exported
+        if not exported:
+            # The address stays pending, so the companies that failed are retried by the next run
+            return address, None
+        self._store.completeAddress(address, len(company_numbers))
+        return address, len(company_numbers)
+
+    def exportCompany(self, company_number: str, address: str) -> bool:
+        """
+        Export a company to staging files, then append them to the consolidated output.
+
+        Returns:
+            bool: False if some of its resources could not be fetched, in which case nothing is appended
+        """
+        staging_prefix = os.path.join(self._output + '_staging', f"{os.getpid()}_{company_number}")
+        exported = CompanyInfo(company_number, self._run_id, self._authentication_fp,
+                               prefix=staging_prefix).exportCompanyInfo()
+        staging_fps = {table: ChAPI.getDataFolderLocation(f"{staging_prefix}_{table}_{self._run_id}.csv")
+                       for table in BatchSearch.TABLES}
+        output_fps = {table: ChAPI.getDataFolderLocation(f"{self._output}_{table}_{self._run_id}.csv")
+                      for table in BatchSearch.TABLES}
+
+        with self._lock:
+            # Another worker may have exported the same company for a different address
+            if exported and not self._store.isCompanyDone(company_number):
+                self._store.beginCompany(company_number, address,
+                                         {table: os.path.getsize(fp) for table, fp in output_fps.items()})
+                for table, staging_fp in staging_fps.items():
+                    if os.path.exists(staging_fp):
+                        with open(staging_fp, 'rb') as staging_file, open(output_fps[table], 'ab') as output_file:
+                            shutil.copyfileobj(staging_file, output_file)
+                self._store.completeCompany(company_number)
+        for staging_fp in staging_fps.values():
+            if os.path.exists(staging_fp):
+                os.remove(staging_fp)
+        return exported
+
+
+_worker = None
+
+
+def _initWorker(rate_limiter: RateLimiter, checkpoint_fp: str, output: str, run_id: str, size: str,
+                authentication_fp: str, response_cache_fp: str = None) -> None:
+    global _worker
+    ChAPI.setRateLimiter(rate_limiter)
+    if response_cache_fp is not None:
+        ChAPI.setResponseCache(SqliteResponseCache(response_cache_fp))
+    _worker = BatchWorker(checkpoint_fp, output, run_id, size, authentication_fp)
+
+
+def _searchAddress(address: str) -> tuple:
+    return _worker.searchAddress(address)
+
+
+def readAddresses(addresses_fp: str) -> list:
+    """
+    Read one address per line, skipping blank lines and # comments.
+    """
+    with open(addresses_fp, 'r') as f:
+        lines = (line.strip() for line in f)
+        return list(dict.fromkeys(line for line in lines if line and not line.startswith('#')))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Search Companies House for every address in a file.")
+    parser.add_argument('addresses', help="text file with one address per line")
+    parser.add_argument('--output', default='batch', help="prefix of the consolidated CSV files")
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--size', default='100', help="maximum companies per address search")
+    parser.add_argument('--auth', default=None, help="JSON file holding the api key")
+    parser.add_argument('--checkpoint', default=None, help="checkpoint database, defaults to data/{output}_checkpoint.sqlite")
+    parser.add_argument('--cache', default=ChAPI.getDataFolderLocation('ch_responses.sqlite3'),
+                        help="response cache shared with the web app, defaults to data/ch_responses.sqlite3")
+    parser.add_argument('--no-cache', action='store_true', help="always ask Companies House")
+    args = parser.parse_args()
+    BatchSearch(output=args.output, workers=args.workers, size=args.size, authentication_fp=args.auth,
+                checkpoint_fp=args.checkpoint,
+                response_cache_fp=None if args.no_cache else args.cache).run(readAddresses(args.addresses))
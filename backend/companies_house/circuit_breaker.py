@@ -0,0 +1,147 @@
+import threading
+import time
+from collections import deque
+
+try:
+    from companies_house import metrics
+except ImportError:
+    import metrics
+
+
+CIRCUIT_STATE = metrics.REGISTRY.gauge(
+    'ch_circuit_state', 'Circuit breaker state: 0 closed, 1 half open, 2 open.', ('circuit',))
+CIRCUIT_REJECTIONS = metrics.REGISTRY.counter(
+    'ch_circuit_rejected_total', 'Upstream calls refused without being sent because the circuit was open.',
+    ('circuit',))
+
+
+class UpstreamError(Exception):
+    """
+    Companies House could not be reached or answered with a server error.
+    """
+
+
+class CircuitOpenError(UpstreamError):
+    """
+    The call was refused because the circuit is open.
+    """
+
+    def __init__(self, name: str, retry_after: float) -> None:
+        super().__init__(f"Circuit '{name}' is open, retry in {retry_after:.0f}s.")
+        self.retry_after = retry_after
+
+
+class CircuitBreaker():
+    """
+    Stop calling an upstream that keeps failing or answering slowly.
+
+    Outcomes of the last window calls are kept. Once at least min_calls are known and
+    the share of errors (connection errors, timeouts and 5xx) or of calls slower than
+    slow_call_duration reaches its threshold, the circuit opens and calls fail fast for
+    open_seconds. After that a single trial call is let through (half open): its success
+    closes the circuit, its failure opens it again.
+    """
+
+    CLOSED = 'closed'
+    HALF_OPEN = 'half_open'
+    OPEN = 'open'
+    _STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+    def __init__(self, name: str, failure_ratio: float = 0.5, slow_call_ratio: float = 0.5,
+                 slow_call_duration: float = 5.0, window: int = 20, min_calls: int = 5,
+                 open_seconds: float = 30.0) -> None:
+        self._name = name
+        self._failure_ratio = failure_ratio
+        self._slow_call_ratio = slow_call_ratio
+        self._slow_call_duration = slow_call_duration
+        self._min_calls = min_calls
+        self._open_seconds = open_seconds
+        # (failed, slow) per call
+        self._outcomes = deque(maxlen=window)
+        self._state = self.CLOSED
+        self._opened_at = 0.0
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+        CIRCUIT_STATE.set(name, value=0)
+
+    @property
+    def name(self) -> str:
+        return self._name
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            if self._state == self.OPEN and time.monotonic() >= self._opened_at + self._open_seconds:
+                return self.HALF_OPEN
+            return self._state
+
+    @property
+    def retryAfter(self) -> float:
+        """
+        Seconds until the next trial call is allowed, 0 if calls are allowed now.
+        """
+        with self._lock:
+            if self._state != self.OPEN:
+                return 0.0
+            return max(self._opened_at + self._open_seconds - time.monotonic(), 0.0)
+
+    def _setState(self, state: str) -> None:
+        self._state = state
+        CIRCUIT_STATE.set(self._name, value=self._STATE_VALUES[state])
+
+    def beforeCall(self) -> bool:
+        """
+        Raise CircuitOpenError unless a call may be made now.
+
+        Returns:
+            bool: whether the call is the half open trial, to be passed on to recordCall or cancelCall
+        """
+        with self._lock:
+            now = time.monotonic()
+            if self._state == self.OPEN and now >= self._opened_at + self._open_seconds:
+                self._setState(self.HALF_OPEN)
+            if self._state == self.CLOSED:
+                return False
+            if self._state == self.HALF_OPEN and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return True
+            retry_after = max(self._opened_at + self._open_seconds - now, 0.0)
+        CIRCUIT_REJECTIONS.inc(self._name)
+        raise CircuitOpenError(self._name, retry_after)
+
+    def recordCall(self, failed: bool, duration: float, trial: bool = False) -> None:
+        """
+        Record the outcome of a call allowed by beforeCall. Only the trial decides a half open
+        circuit; calls started before the circuit opened and finishing later are ignored.
+        """
+        slow = duration >= self._slow_call_duration
+        with self._lock:
+            if trial:
+                self._trial_in_flight = False
+                self._outcomes.clear()
+                if failed or slow:
+                    self._open()
+                else:
+                    self._setState(self.CLOSED)
+                return
+            if self._state != self.CLOSED:
+                return
+            self._outcomes.append((failed, slow))
+            if len(self._outcomes) >= self._min_calls:
+                failures = sum(failed for failed, _ in self._outcomes) / len(self._outcomes)
+                slow_calls = sum(slow for _, slow in self._outcomes) / len(self._outcomes)
+                if failures >= self._failure_ratio or slow_calls >= self._slow_call_ratio:
+                    self._open()
+
+    def cancelCall(self, trial: bool) -> None:
+        """
+        A call allowed by beforeCall was not sent after all. A trial lets the next call try instead.
+        """
+        if trial:
+            with self._lock:
+                self._trial_in_flight = False
+
+    def _open(self) -> None:
+        self._opened_at = time.monotonic()
+        self._outcomes.clear()
+        self._setState(self.OPEN)
@@ -0,0 +1,185 @@
+import numpy as np
+import pandas as pd
+from filelock import FileLock
+import csv
+import os
+
+try:
+    from companies_house.companies_house_api import ChAPI
+except ImportError:
+    from companies_house_api import ChAPI
+
+
+class CodeTable():
+    """
+    Persistent vocabulary of one categorical column, e.g. officer roles.
+
+    Values are given integer codes in order of first appearance and codes never change,
+    so encoded columns written by different sweeps stay comparable. Missing values get -1.
+    Processes sharing a table add values under a file lock, after reading the values the
+    others added, so a code always means the same value.
+    """
+
+    MISSING = -1
+
+    def __init__(self, table_fp: str) -> None:
+        self._table_fp = table_fp
+        self._lock = FileLock(table_fp + '.lock')
+        self._values = []
+        self._codes = dict()
+        self.reload()
+
+    def reload(self) -> None:
+        """
+        Read the values added to the table file since it was last read.
+        """
+        if os.path.exists(self._table_fp):
+            with open(self._table_fp, 'r', newline='') as table_file:
+                reader = csv.reader(table_file)
+                next(reader, None)
+                self._values = [value for _, value in reader]
+        self._codes = {value: code for code, value in enumerate(self._values)}
+
+    @property
+    def table_fp(self) -> str:
+        return self._table_fp
+
+    @property
+    def values(self) -> list:
+        return list(self._values)
+
+    def __len__(self) -> int:
+        return len(self._values)
+
+    @property
+    def dtype(self) -> np.dtype:
+        """
+        Smallest signed integer type that holds every code.
+        """
+        return np.min_scalar_type(-max(len(self._values), 1))
+
+    def extend(self, values) -> None:
+        """
+        Add values not yet in the table and save it.
+        """
+        new_values = [value for value in pd.unique(pd.Series(values, dtype=object).dropna())
+                      if value != '' and value not in self._codes]
+        if not new_values:
+            return
+        with self._lock:
+            # Another process may have added some of them, or others, since the table was read
+            self.reload()
+            new_values = [value for value in new_values if value not in self._codes]
+            if not new_values:
+                return
+            for value in new_values:
+                self._codes[value] = len(self._values)
+                self._values.append(value)
+            self._save()
+
+    def _save(self) -> None:
+        tmp_fp = f"{self._table_fp}.{os.getpid()}.tmp"
+        with open(tmp_fp, 'w', newline='') as table_file:
+            writer = csv.writer(table_file)
+            writer.writerow(['code', 'value'])
+            writer.writerows(enumerate(self._values))
+        os.replace(tmp_fp, self._table_fp)
+
+    def encode(self, values) -> np.ndarray:
+        """
+        Vectorised value -> code lookup, extending the table with unseen values.
+        """
+        values = pd.Series(values, dtype=object)
+        values = values.mask(values == '')
+        self.extend(values)
+        codes = pd.Categorical(values, categories=self._values).codes
+        return codes.astype(self.dtype)
+
+    def decode(self, codes) -> pd.Series:
+        return pd.Series(self.toCategorical(codes)).astype(object)
+
+    def toCategorical(self, codes) -> pd.Categorical:
+        """
+        View integer codes as a pandas Categorical over the full vocabulary without copying strings.
+        """
+        codes = np.asarray(codes, dtype=np.int64)
+        if len(codes) and codes.max() >= len(self._values):
+            # Coded by another process after this table was read
+            self.reload()
+        return pd.Categorical.from_codes(codes, categories=self._values)
+
+
+class CodeTables():
+    """
+    The shared code tables of a data folder and the columns of each CSV table they encode.
+    """
+
+    # CSV table -> {column: code table}
+    ENCODED_COLUMNS = {
+        'companies': {'company_status': 'company_status', 'company_type': 'company_type'},
+        'sic_codes': {'sic_codes': 'sic_code'},
+        'company_officers': {'officer_role': 'officer_role', 'nationality': 'nationality',
+                             'country_of_residence': 'country', 'occupation': 'occupation'},
+        'officer_appointments': {'company_status': 'company_status', 'officer_role': 'officer_role'},
+        'persons_significant_control': {'kind': 'psc_kind', 'nationality': 'nationality',
+                                        'country_of_residence': 'country'},
+        'natures_of_control': {'nature_of_control': 'nature_of_control'},
+    }
+
+    def __init__(self, directory: str = None) -> None:
+        if directory is None:
+            directory = ChAPI.getDataFolderLocation('code_tables')
+        os.makedirs(directory, exist_ok=True)
+        self._directory = directory
+        self._tables = dict()
+
+    @property
+    def directory(self) -> str:
+        return self._directory
+
+    def getTable(self, name: str) -> CodeTable:
+        table = self._tables.get(name)
+        if table is None:
+            table = CodeTable(os.path.join(self._directory, name + '.csv'))
+            self._tables[name] = table
+        return table
+
+    def encodeFrame(self, frame: pd.DataFrame, columns: dict) -> pd.DataFrame:
+        """
+        Replace each string column with its integer codes.
+
+        Args:
+            columns (dict): column -> code table name
+        """
+        encoded = frame.copy()
+        for column, name in columns.items():
+            if column in encoded:
+                encoded[column] = self.getTable(name).encode(encoded[column])
+        return encoded
+
+    def decodeFrame(self, frame: pd.DataFrame, columns: dict, categorical: bool = True) -> pd.DataFrame:
+        """
+        Turn integer code columns back into categoricals (or plain strings).
+        """
+        decoded = frame.copy()
+        for column, name in columns.items():
+            if column in decoded:
+                table = self.getTable(name)
+                if categorical:
+                    decoded[column] = table.toCategorical(decoded[column])
+                else:
+                    decoded[column] = table.decode(decoded[column])
+        return decoded
+
+    def loadTable(self, csv_fp: str, table: str) -> pd.DataFrame:
+        """
+        Load one of the exported CSV tables with its categorical columns integer coded.
+        """
+        frame = pd.read_csv(csv_fp, dtype=str, keep_default_na=False)
+        return self.encodeFrame(frame, self.ENCODED_COLUMNS.get(table, {}))
+
+    def writeEncoded(self, csv_fp: str, table: str, out_fp: str) -> None:
+        """
+        Store an exported CSV table with integer codes in place of its categorical strings.
+        """
+        self.loadTable(csv_fp, table).to_csv(out_fp, index=False)
@@ -2,29 +2,230 @@ import requests
 from requests.auth import HTTPBasicAuth
 import os
 import json
+import time
+import threading
+
+try:
+    from companies_house import metrics, tracing
+    from companies_house.circuit_breaker import CircuitBreaker, CircuitOpenError, UpstreamError
+    from companies_house.credentials import CredentialPool
+except ImportError:
+    import metrics
+    import tracing
+    from circuit_breaker import CircuitBreaker, CircuitOpenError, UpstreamError
+    from credentials import CredentialPool
 
 class ChAPI():
     """
     A class for interacting with the Companies House API. 
     """
     
+    # Optional limiter shared by every request made from this process
+    _rate_limiter = None
+    # Optional AdaptiveConcurrencyLimiter capping the requests in flight from this process
+    _concurrency_limiter = None
+    # Optional circuit breaker shared by every request made from this process
+    _circuit_breaker = None
+    # Optional ResponseCache consulted before, and filled after, every successful request
+    _response_cache = None
+    # Connect and read timeouts in seconds, so a hung upstream cannot hold a caller forever
+    _timeout = (3.05, 10.0)
+    # Credential pools loaded so far, by authentication file path (None for the environment)
+    _credential_pools = dict()
+    _credential_pools_lock = threading.Lock()
+    
     def __init__(self) -> None:
         pass
     
     
     @staticmethod
-    def getChData(url: str, api_key: str, params: dict = None, headers: dict = {'content-type': 'application/json'}) -> dict:
+    def setRateLimiter(rate_limiter) -> None:
+        """
+        Make every subsequent request wait for the given RateLimiter, or pass None to stop limiting.
+        """
+        ChAPI._rate_limiter = rate_limiter
+    
+    
+    @staticmethod
+    def setConcurrencyLimiter(concurrency_limiter) -> None:
+        """
+        Send every subsequent request through the given AdaptiveConcurrencyLimiter, or pass None to remove it.
+        """
+        ChAPI._concurrency_limiter = concurrency_limiter
+    
+    
+    @staticmethod
+    def getConcurrencyLimiter():
+        return ChAPI._concurrency_limiter
+    
+    
+    @staticmethod
+    def setCircuitBreaker(circuit_breaker: CircuitBreaker) -> None:
+        """
+        Send every subsequent request through the given CircuitBreaker, or pass None to remove it.
+        """
+        ChAPI._circuit_breaker = circuit_breaker
+    
+    
+    @staticmethod
+    def setResponseCache(response_cache) -> None:
+        """
+        Answer subsequent requests from the given ResponseCache when it holds them, or pass None to stop caching.
+        """
+        ChAPI._response_cache = response_cache
+    
+    
+    @staticmethod
+    def setTimeout(timeout) -> None:
+        """
+        Set the requests timeout: seconds, or a (connect, read) tuple.
+        """
+        ChAPI._timeout = timeout
+    
+    
+    @staticmethod
+    def getCredentialPool(authentication_fp: str = None) -> CredentialPool:
+        """
+        Get the credential pool for an authentication file, or for the environment if none is given.
+        Keys are only read once per process.
+        """
+        with ChAPI._credential_pools_lock:
+            pool = ChAPI._credential_pools.get(authentication_fp)
+            if pool is None:
+                pool = CredentialPool(CredentialPool.loadKeys(authentication_fp))
+                ChAPI._credential_pools[authentication_fp] = pool
+            return pool
+    
+    
+    @staticmethod
+    def getChData(url: str, api_key: str = None, params: dict = None, headers: dict = {'content-type': 'application/json'},
+                  credentials: CredentialPool = None, raise_errors: bool = False) -> dict:
         """
         Hits the Companies House API and returns data as a dictionary.
+        
+        Without an api key, the key is taken from the credential pool (the environment's pool
+        by default) and a request refused with a 429 is retried with another key if there is one.
+        
+        Failed requests return an empty dictionary. With raise_errors, an UpstreamError is raised
+        instead when Companies House could not be reached, is rate limiting or answered with a
+        server error (CircuitOpenError if the circuit breaker is open), so that callers can tell
+        an outage from an empty result.
+        
+        With a response cache set, cached responses are returned without a request and
+        successful responses are cached.
+        
+        Under a sampled trace each call is a getChData span with the url, resource type and cache
+        outcome, and a sendRequest child span per attempt.
+        """
+        with tracing.TRACER.span('getChData') as span:
+            if span is not None:
+                span.attributes.update(url=url, endpoint=metrics.getEndpointType(url), params=params)
+            return ChAPI._getChData(url, api_key, params, headers, credentials, raise_errors)
+    
+    
+    @staticmethod
+    def _getChData(url: str, api_key: str, params: dict, headers: dict, credentials: CredentialPool,
+                   raise_errors: bool) -> dict:
+        response_cache = ChAPI._response_cache
+        if response_cache is not None:
+            data = response_cache.get(url, params)
+            tracing.annotate(cache='miss' if data is None else 'hit')
+            if data is not None:
+                return data
+        else:
+            tracing.annotate(cache='off')
+        if api_key is None and credentials is None:
+            credentials = ChAPI.getCredentialPool()
+        attempts = 1 if api_key is not None else len(credentials)
+        for attempt in range(attempts):
+            key = api_key if api_key is not None else credentials.acquire()
+            try:
+                response = ChAPI.sendRequest(url, key, params, headers)
+            except CircuitOpenError as e:
+                if raise_errors:
+                    raise
+                print(f"Error during API request: {e}")
+                return {}
+            if response is None:
+                if raise_errors:
+                    raise UpstreamError(f"Could not reach {url}.")
+                return {}
+            if api_key is None:
+                credentials.report(key, response.status_code, response.headers)
+                if response.status_code == 429 and attempt + 1 < attempts:
+                    continue
+            try:
+                response.raise_for_status()  # Raise an HTTPError for bad responses
+                data = response.json()
+                if response_cache is not None:
+                    response_cache.set(url, params, data)
+                return data
+            except requests.RequestException as e:
+                print(f"Error during API request: {e}")
+                if raise_errors and (response.status_code >= 500 or response.status_code == 429):
+                    raise UpstreamError(str(e)) from e
+                return {}
+        
+    
+    @staticmethod
+    def sendRequest(url: str, api_key: str, params: dict = None, headers: dict = None) -> requests.Response:
+        """
+        Send one GET request to the Companies House API.
+        
+        Returns:
+            requests.Response: the response, or None if the request could not be sent
+        
+        Raises:
+            CircuitOpenError: if the circuit breaker is open, in which case nothing is sent
         """
+        with tracing.TRACER.span('sendRequest'):
+            return ChAPI._sendRequest(url, api_key, params, headers)
+    
+    
+    @staticmethod
+    def _sendRequest(url: str, api_key: str, params: dict, headers: dict) -> requests.Response:
+        circuit_breaker = ChAPI._circuit_breaker
+        trial = circuit_breaker.beforeCall() if circuit_breaker is not None else False
+        concurrency_limiter = ChAPI._concurrency_limiter
+        acquired = False
+        start = None
+        response = None
         try:
-            response = requests.get(url=url, auth=HTTPBasicAuth(api_key, ''), params=params, headers=headers)
-            response.raise_for_status()  # Raise an HTTPError for bad responses
-            return response.json()
+            if concurrency_limiter is not None:
+                concurrency_limiter.acquire()
+                acquired = True
+            if ChAPI._rate_limiter is not None:
+                ChAPI._rate_limiter.acquire()
+            start = time.perf_counter()
+            response = requests.get(url=url, auth=HTTPBasicAuth(api_key, ''), params=params, headers=headers,
+                                    timeout=ChAPI._timeout)
+            return response
         except requests.RequestException as e:
             print(f"Error during API request: {e}")
-            return {}   
-      
+            return None
+        finally:
+            if start is None:
+                # Waiting for the limiters failed, nothing was sent
+                if acquired:
+                    concurrency_limiter.cancel()
+                if circuit_breaker is not None:
+                    circuit_breaker.cancelCall(trial)
+            else:
+                duration = time.perf_counter() - start
+                tracing.annotate(status='error' if response is None else response.status_code,
+                                 bytes=None if response is None else len(response.content))
+                if response is None:
+                    metrics.recordUpstreamCall(url, 'error', duration)
+                else:
+                    metrics.recordUpstreamCall(url, response.status_code, duration,
+                                               response.headers, len(response.content))
+                if acquired:
+                    concurrency_limiter.release('error' if response is None else response.status_code, duration,
+                                                None if response is None else response.headers,
+                                                metrics.getEndpointType(url))
+                if circuit_breaker is not None:
+                    circuit_breaker.recordCall(response is None or response.status_code >= 500, duration, trial)
+
 
     @staticmethod
     def getApiKey(authentication_fp: str = None) -> str:
@@ -1,30 +1,64 @@
-import pandas as pd
 import csv
+import threading
 from urllib.parse import urljoin
-from companies_house_api import ChAPI
 from datetime import datetime
-import json
+
+try:
+    from companies_house import tracing
+    from companies_house.circuit_breaker import UpstreamError
+    from companies_house.companies_house_api import ChAPI
+    from companies_house.filing_history import FilingHistoryStore
+    from companies_house.manifest import EtagManifest
+    from companies_house.paginator import Paginator
+except ImportError:
+    import tracing
+    from circuit_breaker import UpstreamError
+    from companies_house_api import ChAPI
+    from filing_history import FilingHistoryStore
+    from manifest import EtagManifest
+    from paginator import Paginator
 
 class CompanyInfo():
     """
     GET request based on company number.
     The authentication method uses an api key stored in a text file located in the parent directory.
     Company information is exported to CSV files.
+    If an etag manifest is given, only companies and sub-resources that changed since
+    the previous run are fetched and exported, and each company is logged in the change log.
+    A resource that could not be fetched because of an outage is not exported and its etag is
+    not stored, nor is the company's, so that the next run fetches it again.
+    Several companies may be exported at once from different threads: rows are appended to the
+    shared CSV files in batches of up to BATCH_ROWS as pages arrive, one batch at a time, so memory
+    does not grow with the size of a company. Batches written before a page failed stay.
     """
     
-    def __init__(self, company_number: str, timestamp: str, authentication_fp: str = None, prefix: str = '') -> None:
+    # Serialises appends to the CSV files shared by every company of a search
+    _csv_lock = threading.Lock()
+    
+    # Rows held per table before they are appended, one page of officers, PSC or charges
+    BATCH_ROWS = 100
+    
+    def __init__(self, company_number: str, timestamp: str, authentication_fp: str = None, prefix: str = '',
+                 manifest: EtagManifest = None) -> None:
         self._company_number = company_number
         self._base_url = r'https://api.company-information.service.gov.uk/'
         self._company_url = urljoin(self.base_url + 'company/', str(self._company_number))
         self._prefix = prefix
         self._timestamp = timestamp
+        self._manifest = manifest
+        self._changed_resources = []
+        self._failed_resources = []
         
-        if authentication_fp is None:
-            self.__api_key = ChAPI.getApiKey()
-        else:
-            self.__api_key = ChAPI.getApiKey(authentication_fp)
+        # Keys are loaded once per process and shared by all companies
+        self.__credentials = ChAPI.getCredentialPool(authentication_fp)
         
-        self._company_data = ChAPI.getChData(self._company_url, self.__api_key)
+        with tracing.TRACER.trace('CompanyInfo.load', company_number=self._company_number):
+            try:
+                self._company_data = ChAPI.getChData(self._company_url, credentials=self.__credentials,
+                                                     raise_errors=True)
+            except UpstreamError as e:
+                self.resourceFailed('profile', e)
+                self._company_data = dict()
         # Links
         self._links = self._company_data.get('links', dict())
         self._officers_url = urljoin(self._base_url, self._links.get('officers', ''))
@@ -59,6 +93,9 @@ class CompanyInfo():
         # Officers
         self._officers = dict()
         
+        # Rows not yet appended, by table
+        self._batches = dict()
+        
         
     @property
     def company_status(self) -> str:
@@ -167,9 +204,23 @@ class CompanyInfo():
     @property
     def is_foreign_company(self) -> bool:
         return self._is_foreign_company
+    
+    @property
+    def etag(self) -> str:
+        return self._etag
+    
+    @property
+    def manifest(self) -> EtagManifest:
+        return self._manifest
+    
+    @property
+    def failed_resources(self) -> list:
+        return self._failed_resources
         
         
-    def exportCompanyInfo(self) -> None:
+    @tracing.traced('CompanyInfo.exportCompanyInfo', root=True,
+                    attributes=lambda self, *args, **kwargs: {'company_number': self.company_number})
+    def exportCompanyInfo(self, filing_history: bool = False, filing_store: FilingHistoryStore = None) -> bool:
         """
         Get company profile info from Companies House and export it to CSV files:
         
@@ -181,8 +232,25 @@ class CompanyInfo():
         {prefix}_officer_appointments_{timestamp}.csv,
         {prefix}_natures_of_control_{timestamp}.csv
         
-        The primary key is the company number.
+        The primary key is the company number. With an etag manifest, unchanged companies are
+        skipped and the outcome is written to {prefix}_change_log_{timestamp}.csv.
+        With filing_history, filings are added to filing_store (see getFilingHistory).
+        
+        Returns:
+            bool: False if any resource could not be fetched, see failed_resources
         """
+        if 'profile' in self._failed_resources:
+            if self._manifest is not None:
+                self.logChange(EtagManifest.FAILED)
+            return False
+        
+        if self._manifest is not None:
+            change = self._manifest.getChange(self._company_number, self._etag)
+            if change == EtagManifest.UNCHANGED:
+                # Nothing has changed since the previous run so there is nothing to re-fetch
+                self.logChange(change)
+                return True
+        
         # Get company profile information
         self.getCompanyInfo()
         
@@ -207,46 +275,119 @@ class CompanyInfo():
         # Get company charges
         self.getCharges()
         
+        # Filing history is only fetched on demand as it can run to many pages
+        if filing_history:
+            self.getFilingHistory(filing_store)
+        
+        if self._manifest is not None:
+            if self._failed_resources:
+                self.logChange(EtagManifest.FAILED)
+            else:
+                self._manifest.updateCompany(self._company_number, self._etag, self._timestamp)
+                self.logChange(change)
+        return not self._failed_resources
+        
+        
+    def logChange(self, change: str) -> None:
+        """
+        Record whether the company was new, changed or unchanged and which sub-resources were re-exported,
+        or that it failed and which resources could not be fetched.
+        """
+        resources = self._failed_resources if change == EtagManifest.FAILED else self._changed_resources
+        self.writeRows('change_log', [[self._company_number, change, ' '.join(resources)]])
+    
+    
+    def resourceFailed(self, resource: str, error: Exception) -> None:
+        print(f"Could not fetch {resource} of company {self._company_number}: {error}")
+        self._failed_resources.append(resource)
+    
+    
+    def writeRows(self, table: str, rows: list) -> None:
+        """
+        Append rows to {prefix}_{table}_{timestamp}.csv.
+        """
+        with CompanyInfo._csv_lock:
+            with open(ChAPI.getDataFolderLocation(self._prefix + '_' + table + '_' + self._timestamp + '.csv'),
+                      "a", newline='') as csv_file:
+                csv.writer(csv_file).writerows(rows)
+    
+    
+    def addRow(self, table: str, row: list) -> None:
+        """
+        Queue a row for {prefix}_{table}_{timestamp}.csv, appending the table's batch once it is full.
+        """
+        batch = self._batches.setdefault(table, [])
+        batch.append(row)
+        if len(batch) >= self.BATCH_ROWS:
+            self.flushRows(table)
+    
+    
+    def flushRows(self, *tables: str) -> None:
+        """
+        Append the queued rows of the given tables.
+        """
+        for table in tables:
+            rows = self._batches.pop(table, None)
+            if rows:
+                self.writeRows(table, rows)
+    
+    
+    def discardRows(self, *tables: str) -> None:
+        """
+        Drop the queued rows of the given tables, e.g. after one of their pages failed.
+        """
+        for table in tables:
+            self._batches.pop(table, None)
+    
+    
+    def isResourceUnchanged(self, resource: str, data: dict) -> bool:
+        """
+        True if the manifest already holds this version of a sub-resource.
+        """
+        if self._manifest is None:
+            return False
+        return self._manifest.isResourceUnchanged(self._company_number, resource, data.get('etag', ''))
+    
+    
+    def recordResource(self, resource: str, data: dict) -> None:
+        """
+        Remember the etag of an exported sub-resource for the next incremental run.
+        """
+        if self._manifest is None:
+            return
+        self._manifest.updateResource(self._company_number, resource, data.get('etag', ''))
+        self._changed_resources.append(resource)
+        
         
     def getCompanyInfo(self):
         """
         Get company profile information
         """
-        company_fp = ChAPI.getDataFolderLocation(self._prefix + '_companies_' + self._timestamp + '.csv')
-        with open(company_fp,"a",newline='') as company_file:
-            company_writer = csv.writer(company_file)
-            company_writer.writerow([self._company_number, self._company_name, self._company_status, self._company_type,
-                                    self._jurisdiction, self._is_foreign_company, self._date_of_creation, self._etag,
-                                    self._external_registration_number, self._address_line_1, self._locality, self._postal_code,
-                                    self._country, self._accounts_overdue, self._has_been_liquidated, self._has_charges,
-                                    self._has_insolvency_history, self._registered_office_is_in_dispute, 
-                                    self._undeliverable_registered_office_address])
+        self.writeRows('companies', [[self._company_number, self._company_name, self._company_status, self._company_type,
+                                      self._jurisdiction, self._is_foreign_company, self._date_of_creation, self._etag,
+                                      self._external_registration_number, self._address_line_1, self._locality, self._postal_code,
+                                      self._country, self._accounts_overdue, self._has_been_liquidated, self._has_charges,
+                                      self._has_insolvency_history, self._registered_office_is_in_dispute, 
+                                      self._undeliverable_registered_office_address]])
         
         
     def getSICCodes(self, sic_codes: list) -> None:
         """
         Get SIC codes
         """
-        sic_fp = ChAPI.getDataFolderLocation(self._prefix + "_sic_codes_" + self._timestamp + ".csv")
-        
-        with open(sic_fp,"a",newline='') as sic_file:
-            sf_writer = csv.writer(sic_file)
-            for sic in sic_codes:
-                sf_writer.writerow([self._company_number, sic])
+        self.writeRows('sic_codes', [[self._company_number, sic] for sic in sic_codes])
 
 
     def getPreviousCompanyNames(self, prev_companies: list) -> None:
         """
         Get previous company names
         """
-        prev_fp = ChAPI.getDataFolderLocation(self._prefix + "_previous_company_names_" + self._timestamp + ".csv")
-        
-        with open(prev_fp,"a",newline='') as prev_file:
-            pf_writer = csv.writer(prev_file)
-            for prev in prev_companies:
-                pf_writer.writerow([self._company_number,prev.get('ceased_on'),prev.get('effective_from'),prev.get('name')])
+        self.writeRows('previous_company_names', [
+            [self._company_number, prev.get('ceased_on'), prev.get('effective_from'), prev.get('name')]
+            for prev in prev_companies])
                 
                 
+    @tracing.traced('CompanyInfo.getCompanyOfficers')
     def getCompanyOfficers(self) -> None:
         """
         Get company officers
@@ -254,16 +395,17 @@ class CompanyInfo():
         if self._officers_url == self._base_url:
             return
         
-        # Fetch new officers data
-        officers_data = ChAPI.getChData(self._officers_url, self.__api_key)
-        officers = officers_data.get('items', [])
+        try:
+            # Fetch new officers data, all pages are streamed
+            officers = Paginator(self._officers_url, credentials=self.__credentials, raise_errors=True)
+            officers_data = officers.first_page
+            if self.isResourceUnchanged('officers', officers_data):
+                # Skips the appointments calls for every officer as well
+                return
 
-        # Update the _officers attribute with the new data
-        self._officers = dict()
+            # Update the _officers attribute with the new data
+            self._officers = dict()
 
-        with open(ChAPI.getDataFolderLocation(self._prefix + "_company_officers_" + self._timestamp + ".csv"), "a", newline='') as csv_file:
-            csv_writer = csv.writer(csv_file)
-            
             for officer in officers:
                 officer_name = officer.get('name')
                 if officer_name is not None:
@@ -307,14 +449,14 @@ class CompanyInfo():
                     }
                     # Export appointments data for all company officers to a csv file. Three fields will be saved in the class.
                     appointments_url = urljoin(self._base_url, appointments)
-                    appointments_data = ChAPI.getChData(appointments_url, self.__api_key)
-                    appointments_fields = self.getOfficerAppointments(appointments_data, officer_id,)
+                    appointments_fields = self.getOfficerAppointments(
+                        Paginator(appointments_url, credentials=self.__credentials, raise_errors=True), officer_id)
                     self._officers[officer_name]['appointment_kind'] = str(appointments_fields.get('kind', ''))
                     self._officers[officer_name]['is_corporate_officer'] = bool(appointments_fields.get('is_corporate_officer', None))
                     self._officers[officer_name]['total_company_appointments'] = appointments_fields.get('total_results', 0)
-                    
+                
                     # Write data to CSV
-                    csv_writer.writerow([
+                    self.addRow('company_officers', [
                         self._company_number,
                         self._officers[officer_name]['officer_surname'],
                         self._officers[officer_name]['officer_forename'],
@@ -340,35 +482,50 @@ class CompanyInfo():
                     ])
                 else:
                     print("Warning: Officer name is None.")
+        except UpstreamError as e:
+            # Batches already written stay, the officers are fetched again on the next run
+            self.discardRows('company_officers', 'officer_appointments')
+            self.resourceFailed('officers', e)
+            return
+        self.flushRows('company_officers')
+        self.recordResource('officers', officers_data)
                     
-    def getOfficerAppointments(self, appointments_data: dict, officer_id: str) -> dict:
+    @tracing.traced('CompanyInfo.getOfficerAppointments',
+                    attributes=lambda self, appointments, officer_id: {'officer_id': officer_id})
+    def getOfficerAppointments(self, appointments: Paginator, officer_id: str) -> dict:
         """
-        Get officer appointments and export to a csv file.
+        Get officer appointments, every page of them, and export to a csv file.
         
         Returns:
             dict: total appointments, is corporate officer, and kind of appointment
         """
-        with open(
-            ChAPI.getDataFolderLocation(self.prefix + "_officer_appointments_" + self._timestamp + ".csv"),
-            "a", newline='') as appointments_csv_file:
-            appointments_csv_writer = csv.writer(appointments_csv_file)
-            items = appointments_data.get('items', [])
-            for item in items:
-                appointments_csv_writer.writerow([
-                    officer_id,
-                    item.get('appointed_to', {}).get('company_number', ''),
-                    item.get('appointed_to', {}).get('company_name', ''),
-                    item.get('appointed_to', {}).get('company_status', ''),
-                    item.get('officer_role', ''),
-                    item.get('appointed_on', ''),
-                ])
-            return dict({
-                'kind': appointments_data.get('kind', ''), 
-                'is_corporate_officer': appointments_data.get('is_corporate_officer', None), 
-                'total_results': appointments_data.get('total_results', None)
-                })
+        appointments_data = appointments.first_page
+        items = appointments
+        appointments_etag = appointments_data.get('etag', '')
+        unchanged = self._manifest is not None and \
+            self._manifest.isAppointmentsUnchanged(self._company_number, officer_id, appointments_etag)
+        if unchanged:
+            items = []
+        for item in items:
+            self.addRow('officer_appointments', [
+                officer_id,
+                item.get('appointed_to', {}).get('company_number', ''),
+                item.get('appointed_to', {}).get('company_name', ''),
+                item.get('appointed_to', {}).get('company_status', ''),
+                item.get('officer_role', ''),
+                item.get('appointed_on', ''),
+            ])
+        self.flushRows('officer_appointments')
+        if self._manifest is not None and not unchanged:
+            self._manifest.updateAppointments(self._company_number, officer_id, appointments_etag)
+        return dict({
+            'kind': appointments_data.get('kind', ''), 
+            'is_corporate_officer': appointments_data.get('is_corporate_officer', None), 
+            'total_results': appointments_data.get('total_results', None)
+            })
         
     
+    @tracing.traced('CompanyInfo.getPersonsSignificantControl')
     def getPersonsSignificantControl(self):
         """
         Get persons with significant control of the company.
@@ -376,120 +533,141 @@ class CompanyInfo():
         if self._base_url == self._persons_significant_control_url:
             # There is no persons with significant control url link
             return
-        persons = ChAPI.getChData(self._persons_significant_control_url, self.__api_key)
-        with open(ChAPI.getDataFolderLocation(self._prefix + "_persons_significant_control_" + self._timestamp + ".csv"),
-                  "a", newline='') as significant_persons_csv_file:
-            significant_persons_csv_writer = csv.writer(significant_persons_csv_file)
-            # A separate file/table is needed to list each person's natures of control
-            with open(ChAPI.getDataFolderLocation(self._prefix + "_natures_of_control_" + self._timestamp + ".csv"),
-                      "a", newline='') as natures_of_control_csv_file:
-                natures_of_control_csv_writer = csv.writer(natures_of_control_csv_file)
-                
-                items = persons.get('items', [])
-                for item in items:
-                    etag = item.get('etag', '') 
-                    significant_persons_csv_writer.writerow([
-                        self._company_number,
-                        item.get('name', ''),
-                        item.get('name_elements', {}).get('title', ''),
-                        item.get('name_elements', {}).get('surname', ''),
-                        item.get('name_elements', {}).get('forename', ''),
-                        item.get('name_elements', {}).get('other_forenames', ''),
-                        item.get('date_of_birth', {}).get('month', ''),
-                        item.get('date_of_birth', {}).get('year', ''),
-                        item.get('kind', ''),
-                        item.get('notified_on', ''),
-                        item.get('nationality', ''),
-                        item.get('country_of_residence', ''),
-                        item.get("address", {}).get('premises', ''),
-                        item.get('address', {}).get('address_line_1', ''),
-                        item.get('address', {}).get('address_line_2', ''),
-                        item.get('address', {}).get('locality', ''),
-                        item.get('address', {}).get('postal_code', ''),
-                        item.get('address', {}).get('country', ''),
-                        etag,
-                        item.get('identification', {}).get('registration_number', ''),
-                        item.get('identification', {}).get('legal_form', ''),
-                        item.get('identification', {}).get('legal_authority', ''),
-                        item.get('identification', {}).get('country_registered', ''),
-                        item.get('identification', {}).get('place_registered', ''),
-                    ])
-                    natures_of_control = item.get('natures_of_control', [])
-                    if not natures_of_control:
-                        # There is no data on this person's natures of control
-                        return
-                    else:
-                        for nature_of_control in natures_of_control:
-                            natures_of_control_csv_writer.writerow([
-                                etag,
-                                nature_of_control,
-                            ])
+        try:
+            persons = Paginator(self._persons_significant_control_url, credentials=self.__credentials,
+                                raise_errors=True)
+            if self.isResourceUnchanged('persons_significant_control', persons.first_page):
+                return
+            for item in persons:
+                etag = item.get('etag', '') 
+                self.addRow('persons_significant_control', [
+                    self._company_number,
+                    item.get('name', ''),
+                    item.get('name_elements', {}).get('title', ''),
+                    item.get('name_elements', {}).get('surname', ''),
+                    item.get('name_elements', {}).get('forename', ''),
+                    item.get('name_elements', {}).get('other_forenames', ''),
+                    item.get('date_of_birth', {}).get('month', ''),
+                    item.get('date_of_birth', {}).get('year', ''),
+                    item.get('kind', ''),
+                    item.get('notified_on', ''),
+                    item.get('nationality', ''),
+                    item.get('country_of_residence', ''),
+                    item.get("address", {}).get('premises', ''),
+                    item.get('address', {}).get('address_line_1', ''),
+                    item.get('address', {}).get('address_line_2', ''),
+                    item.get('address', {}).get('locality', ''),
+                    item.get('address', {}).get('postal_code', ''),
+                    item.get('address', {}).get('country', ''),
+                    etag,
+                    item.get('identification', {}).get('registration_number', ''),
+                    item.get('identification', {}).get('legal_form', ''),
+                    item.get('identification', {}).get('legal_authority', ''),
+                    item.get('identification', {}).get('country_registered', ''),
+                    item.get('identification', {}).get('place_registered', ''),
+                ])
+                natures_of_control = item.get('natures_of_control', [])
+                if not natures_of_control:
+                    # There is no data on this person's natures of control
+                    continue
+                else:
+                    for nature_of_control in natures_of_control:
+                        self.addRow('natures_of_control', [etag, nature_of_control])
+        except UpstreamError as e:
+            self.discardRows('persons_significant_control', 'natures_of_control')
+            self.resourceFailed('persons_significant_control', e)
+            return
+        self.flushRows('persons_significant_control', 'natures_of_control')
+        self.recordResource('persons_significant_control', persons.first_page)
                             
     
-    def getFilingHistory(self):
+    @tracing.traced('CompanyInfo.getFilingHistory')
+    def getFilingHistory(self, store: FilingHistoryStore = None) -> int:
         """
-        Get a list of the company's filing history.
+        Get the company's filing history and add new filings to the filing history store,
+        data/filing_history.sqlite by default, opened and closed for this company only.
+        Filings are listed newest first, so paging stops at the first filing that is already stored.
+        
+        Returns:
+            int: number of new filings
         """
         if self._base_url == self._filing_history_url:
-            return
-        filing_history = ChAPI.getChData(url=self._filing_history_url, api_key=self.__api_key)
-        print(json.dumps(filing_history, indent=2))
+            return 0
+        owned = store is None
+        if owned:
+            store = FilingHistoryStore(ChAPI.getDataFolderLocation('filing_history.sqlite'))
+        try:
+            known_filings = store.knownTransactionIds(self._company_number)
+            new_filings = []
+            try:
+                for filing in Paginator(self._filing_history_url, credentials=self.__credentials, raise_errors=True):
+                    if filing.get('transaction_id') in known_filings:
+                        break
+                    new_filings.append(filing)
+            except UpstreamError as e:
+                self.resourceFailed('filing_history', e)
+                return 0
+            store.addFilings(self._company_number, new_filings)
+            return len(new_filings)
+        finally:
+            if owned:
+                store.close()
         
         
+    @tracing.traced('CompanyInfo.getCharges')
     def getCharges(self):
         """
         Get a list of the company's charges.
         """
         if self._base_url == self._charges_url:
             return
-        charges = ChAPI.getChData(url=self._charges_url, api_key=self.__api_key)
-        charges_items = charges.get('items', [])
-        with open(ChAPI.getDataFolderLocation(self._prefix + '_company_charges_' + self._timestamp + '.csv'),
-                  "a", newline='') as charges_file:
-            charges_writer = csv.writer(charges_file)
-            with open(ChAPI.getDataFolderLocation(self._prefix + '_charges_persons_entitled_' + self._timestamp + '.csv'),
-                  "a", newline='') as entitled_file:
-                entitled_writer = csv.writer(entitled_file)
-                with open(ChAPI.getDataFolderLocation(self._prefix + '_charges_transactions_' + self._timestamp + '.csv'),
-                  "a", newline='') as transactions_file:
-                    transactions_writer = csv.writer(transactions_file) 
-                    for charge in charges_items:
-                        particulars = charge.get('particulars', {})
-                        charge_number = charge.get('charge_number', '')
-                        charge_code = str(int(self._company_number + '0000') + int(charge_number))
-                        charges_writer.writerow([
-                            self._company_number,
-                            charge_code,
-                            charge.get('classification', {}).get('description', ''),
-                            charge_number,
-                            charge.get('status', ''),
-                            charge.get('delivered_on', ''),
-                            charge.get('created_on', ''),
-                            particulars.get('description', ''),
-                            particulars.get('contains_fixed_charge', ''),
-                            particulars.get('contains_floating_charge', ''),
-                            particulars.get('floating_charge_covers_all', ''),
-                            particulars.get('contains_negative_pledge')
-                        ])
-                        for persons_entitled in charge.get('persons_entitled', []):
-                            entitled_writer.writerow([
-                                charge_code,
-                                persons_entitled.get('name', '')
-                            ])
-                        for transaction in charge.get('transactions', []):
-                            transactions_writer.writerow([
-                                charge_code,
-                                transaction.get('filing_type', ''),
-                                transaction.get('delivered_on', ''),
-                                transaction.get('links', {}).get('filing', '')
-                            ])
+        try:
+            charges_items = Paginator(self._charges_url, credentials=self.__credentials, raise_errors=True)
+            if self.isResourceUnchanged('charges', charges_items.first_page):
+                return
+            for charge in charges_items:
+                particulars = charge.get('particulars', {})
+                charge_number = charge.get('charge_number', '')
+                charge_code = str(int(self._company_number + '0000') + int(charge_number))
+                self.addRow('company_charges', [
+                    self._company_number,
+                    charge_code,
+                    charge.get('classification', {}).get('description', ''),
+                    charge_number,
+                    charge.get('status', ''),
+                    charge.get('delivered_on', ''),
+                    charge.get('created_on', ''),
+                    particulars.get('description', ''),
+                    particulars.get('contains_fixed_charge', ''),
+                    particulars.get('contains_floating_charge', ''),
+                    particulars.get('floating_charge_covers_all', ''),
+                    particulars.get('contains_negative_pledge')
+                ])
+                for persons_entitled in charge.get('persons_entitled', []):
+                    self.addRow('charges_persons_entitled', [
+                        charge_code,
+                        persons_entitled.get('name', '')
+                    ])
+                for transaction in charge.get('transactions', []):
+                    self.addRow('charges_transactions', [
+                        charge_code,
+                        transaction.get('filing_type', ''),
+                        transaction.get('delivered_on', ''),
+                        transaction.get('links', {}).get('filing', '')
+                    ])
+        except UpstreamError as e:
+            self.discardRows('company_charges', 'charges_persons_entitled', 'charges_transactions')
+            self.resourceFailed('charges', e)
+            return
+        self.flushRows('company_charges', 'charges_persons_entitled', 'charges_transactions')
+        self.recordResource('charges', charges_items.first_page)
 
     
     def setAuthenticationFilePath(self, auth_fp: any) -> None:
         """
-        Change the api key by entering a new file path for the authentication file.    
+        Change the api keys by entering a new file path for the authentication file.    
         """
-        self.__api_key = ChAPI.getApiKey(auth_fp)
+        self.__credentials = ChAPI.getCredentialPool(auth_fp)
     
 
 if __name__ == '__main__':
@@ -1,14 +1,38 @@
-from companies_house_api import ChAPI
-from company_info import CompanyInfo
+from concurrent.futures import ThreadPoolExecutor
+import contextvars
+import argparse
 from datetime import datetime
 import csv
 
+try:
+    from companies_house import tracing
+    from companies_house.companies_house_api import ChAPI
+    from companies_house.company_info import CompanyInfo
+    from companies_house.concurrency_limit import AdaptiveConcurrencyLimiter
+    from companies_house.filing_history import FilingHistoryStore
+    from companies_house.manifest import EtagManifest
+except ImportError:
+    import tracing
+    from companies_house_api import ChAPI
+    from company_info import CompanyInfo
+    from concurrency_limit import AdaptiveConcurrencyLimiter
+    from filing_history import FilingHistoryStore
+    from manifest import EtagManifest
+
 class CompanySearch():
     """
     Search for companies by keyword.
+    In incremental mode an etag manifest from previous runs is kept in the data folder, so that
+    unchanged companies are skipped and only new or changed rows are exported, plus a change log.
+    With workers above 1, that many companies are loaded and exported at a time through an adaptive
+    concurrency limiter, which settles on as many requests in flight as Companies House sustains.
+    With snapshots, each run's CSV set is stored as a delta in data/snapshots.sqlite and then deleted;
+    snapshot_store.py writes the set of any stored run back out.
     """
     
-    def __init__(self, authentication_fp: str = None) -> None:
+    def __init__(self, authentication_fp: str = None, incremental: bool = False, 
+                 manifest_fp: str = 'etag_manifest.json', filing_history: bool = False, workers: int = 1,
+                 snapshots: bool = False) -> None:
         self._company_headers = ["company_number", "company_name", "company_status", "company_type", "jurisdiction", 
                                  "is_foreign_company", "date_of_creation", "etag", "external_registration_number", 
                                  "address_line_1", "locality", "postal_code", "country", "accounts_overdue", "has_been_liquidated", 
@@ -34,13 +58,32 @@ class CompanySearch():
                                          "floating_charge_covers_all", "contains_negative_pledge"]
         self._charges_persons_entitled_headers = ["charge_code", "persons_entitled"]
         self._charges_transactions_headers = ["charge_code", "filing_type", "delivered_on", "links"]
+        self._change_log_headers = ["company_number", "change", "resources"]
+        # Filing history goes to data/filing_history.sqlite rather than the CSV set
+        self._filing_history = filing_history
         
-        if authentication_fp is None:
-            self.__api_key = ChAPI.getApiKey()
+        if incremental:
+            self._manifest = EtagManifest(ChAPI.getDataFolderLocation(manifest_fp))
         else:
-            self.__api_key = ChAPI.getApiKey(authentication_fp)
+            self._manifest = None
+        
+        self._snapshots = None
+        if snapshots:
+            # Imported here as the store needs pandas, which plain searches do not
+            try:
+                from companies_house.snapshot_store import SnapshotStore
+            except ImportError:
+                from snapshot_store import SnapshotStore
+            self._snapshots = SnapshotStore(ChAPI.getDataFolderLocation('snapshots.sqlite'))
+        
+        self.__credentials = ChAPI.getCredentialPool(authentication_fp)
+        self._workers = workers
+        if workers > 1 and ChAPI.getConcurrencyLimiter() is None:
+            ChAPI.setConcurrencyLimiter(AdaptiveConcurrencyLimiter(max_limit=workers))
         
     
+    @tracing.traced('CompanySearch.searchAll', root=True,
+                    attributes=lambda self, query, *args, **kwargs: {'query': query})
     def searchAll(self, query: str, items_per_page: int = 25, start_index: int = 0) -> None:
         """_summary_
         Returns results for a search of Companies House data using the search all function. 
@@ -58,7 +101,7 @@ class CompanySearch():
         url = r'https://api.company-information.service.gov.uk/search'
         
         params = {"q":query, "items_per_page":items_per_page, "start_index":start_index}
-        search = ChAPI.getChData(url=url, api_key=self.__api_key, params=params)
+        search = ChAPI.getChData(url=url, credentials=self.__credentials, params=params)
         
         # current date and time
         now = datetime.now()
@@ -68,12 +111,12 @@ class CompanySearch():
         prefix = padded_query[:5]
         self.insertHeaders(prefix, timestamp)
         
-        for item in search.get('items', []):
-            company_no = item.get('company_number') 
-            if company_no:
-                CompanyInfo(str(company_no), timestamp, prefix=prefix).exportCompanyInfo()
+        company_numbers = [str(item['company_number']) for item in search.get('items', []) if item.get('company_number')]
+        self.exportCompanies(company_numbers, timestamp, prefix)
 
 
+    @tracing.traced('CompanySearch.searchAddress', root=True,
+                    attributes=lambda self, query, *args, **kwargs: {'query': query})
     def searchAddress(self, query: str, size: str='25'):
         """_summary_
         Returns results for a search of Companies House data using the search by address function. 
@@ -86,7 +129,7 @@ class CompanySearch():
         url = r'https://api.company-information.service.gov.uk/advanced-search/companies'
 
         params = {"location":query, "size":size}
-        search = ChAPI.getChData(url=url, api_key=self.__api_key, params=params)
+        search = ChAPI.getChData(url=url, credentials=self.__credentials, params=params)
         
         # current date and time
         now = datetime.now()
@@ -96,10 +139,41 @@ class CompanySearch():
         prefix = padded_query[:5]
         self.insertHeaders(prefix, timestamp)
         
-        for item in search.get('items', []):
-            company_no = item.get('company_number') 
-            if company_no:
-                CompanyInfo(str(company_no), timestamp, prefix=prefix).exportCompanyInfo()
+        company_numbers = [str(item['company_number']) for item in search.get('items', []) if item.get('company_number')]
+        self.exportCompanies(company_numbers, timestamp, prefix)
+    
+    
+    def exportCompanies(self, company_numbers: list, timestamp: str, prefix: str) -> None:
+        """
+        Export every company, up to workers at a time: each thread loads a company's profile and then
+        fetches and exports its officers, appointments, persons with significant control and charges.
+        Batches of rows of different companies may therefore be interleaved in the CSV files.
+        """
+        # One filing history store for the whole search rather than a connection per company
+        filing_store = None
+        if self._filing_history:
+            filing_store = FilingHistoryStore(ChAPI.getDataFolderLocation('filing_history.sqlite'))
+        
+        def export(company_no: str) -> None:
+            company_info = CompanyInfo(company_no, timestamp, prefix=prefix, manifest=self._manifest)
+            company_info.exportCompanyInfo(filing_history=self._filing_history, filing_store=filing_store)
+        
+        try:
+            with ThreadPoolExecutor(max_workers=self._workers) as executor:
+                # Copy the context per company so that its spans join the search trace
+                exports = [executor.submit(contextvars.copy_context().run, export, company_no)
+                           for company_no in company_numbers]
+                for company_export in exports:
+                    company_export.result()
+        finally:
+            if filing_store is not None:
+                filing_store.close()
+        
+        if self._manifest is not None:
+            self._manifest.save()
+        
+        if self._snapshots is not None:
+            self._snapshots.recordCsvSet(prefix, timestamp, remove=True)
     
     
     def insertHeaders(self, prefix: str, timestamp: str):
@@ -160,6 +234,29 @@ class CompanySearch():
         with open(transactions_fp,"w", newline='') as transactions_file:
             transactions_writer = csv.writer(transactions_file)
             transactions_writer.writerow(self._charges_transactions_headers)
+        # Change log
+        if self._manifest is not None:
+            change_log_fp = ChAPI.getDataFolderLocation(prefix + '_change_log_' + timestamp + '.csv')
+            with open(change_log_fp,"w", newline='') as change_log_file:
+                change_log_writer = csv.writer(change_log_file)
+                change_log_writer.writerow(self._change_log_headers)
 
 if __name__ == '__main__':
-    CompanySearch().searchAddress("Drury Lane")
+    parser = argparse.ArgumentParser(description="Search Companies House by address and export every company found.")
+    parser.add_argument('address', nargs='?', default="Drury Lane")
+    parser.add_argument('--size', default='25', help="maximum companies")
+    parser.add_argument('--workers', type=int, default=1, help="companies exported at a time")
+    parser.add_argument('--incremental', action='store_true', help="skip companies unchanged since the last run")
+    parser.add_argument('--snapshots', action='store_true',
+                        help="store the run as a delta in data/snapshots.sqlite instead of a CSV set")
+    parser.add_argument('--trace', help="write a trace of the search to this file, e.g. search_trace.json")
+    parser.add_argument('--trace-format', choices=('chrome', 'json'), default='chrome',
+                        help="chrome for chrome://tracing or Perfetto, json for the span tree")
+    args = parser.parse_args()
+    if args.trace:
+        tracing.TRACER.setSampleRate(1.0)
+    CompanySearch(incremental=args.incremental, workers=args.workers,
+                  snapshots=args.snapshots).searchAddress(args.address, args.size)
+    if args.trace:
+        export = tracing.exportChromeTrace if args.trace_format == 'chrome' else tracing.exportJson
+        export(tracing.TRACER.traces(), args.trace)
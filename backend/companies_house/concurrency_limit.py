@@ -0,0 +1,145 @@
+import threading
+import time
+from collections import deque
+
+try:
+    from companies_house import metrics
+except ImportError:
+    import metrics
+
+
+CONCURRENCY_LIMIT = metrics.REGISTRY.gauge(
+    'ch_concurrency_limit', 'Upstream requests allowed in flight at once by the adaptive limiter.', ('limiter',))
+CONCURRENCY_IN_FLIGHT = metrics.REGISTRY.gauge(
+    'ch_concurrency_in_flight', 'Upstream requests currently in flight through the adaptive limiter.', ('limiter',))
+CONCURRENCY_DECREASES = metrics.REGISTRY.counter(
+    'ch_concurrency_decreases_total', 'Cuts of the adaptive concurrency limit by cause (throttled, error, latency).',
+    ('limiter', 'reason'))
+
+
+class AdaptiveConcurrencyLimiter():
+    """
+    Find how many requests Companies House sustains in flight at once (AIMD, like TCP congestion control).
+
+    Every healthy response raises the limit by 1/limit, so it grows by about one per round trip.
+    A 429, a 5xx, a connection error or sustained slowness multiplies it by backoff, at most once
+    per round trip so that requests already in flight do not cut it again. A 429 with a Retry-After
+    header also holds back every new request until it has passed.
+
+    Latency is judged per endpoint type, as a search and a page of officers take very different
+    times: the endpoint counts as slow once its recent latency (an exponential moving average)
+    exceeds latency_tolerance times its baseline, the fastest recent response of that type.
+    """
+
+    def __init__(self, name: str = 'companies_house', initial: int = 4, min_limit: int = 1, max_limit: int = 64,
+                 backoff: float = 0.5, latency_tolerance: float = 2.0, latency_smoothing: float = 0.2,
+                 history_size: int = 1000) -> None:
+        self._name = name
+        self._limit = float(initial)
+        self._min_limit = min_limit
+        self._max_limit = max_limit
+        self._backoff = backoff
+        self._latency_tolerance = latency_tolerance
+        self._latency_smoothing = latency_smoothing
+        self._in_flight = 0
+        # Endpoint type -> fastest recent response, and -> moving average of its responses
+        self._baselines = dict()
+        self._latencies = dict()
+        self._last_decrease = 0.0
+        self._paused_until = 0.0
+        # (time, limit, reason) for every change of the whole number limit
+        self._history = deque(maxlen=history_size)
+        self._condition = threading.Condition()
+        self._record('initial')
+
+    @property
+    def name(self) -> str:
+        return self._name
+
+    @property
+    def limit(self) -> int:
+        return int(self._limit)
+
+    @property
+    def in_flight(self) -> int:
+        return self._in_flight
+
+    @property
+    def history(self) -> list:
+        with self._condition:
+            return list(self._history)
+
+    def acquire(self) -> None:
+        """
+        Block until a request may be sent, then count it as in flight.
+        """
+        with self._condition:
+            while True:
+                pause = self._paused_until - time.monotonic()
+                if pause <= 0 and self._in_flight < int(self._limit):
+                    break
+                self._condition.wait(pause if pause > 0 else None)
+            self._in_flight += 1
+            CONCURRENCY_IN_FLIGHT.set(self._name, value=self._in_flight)
+
+    def release(self, status, duration: float, headers: dict = None, endpoint: str = 'other') -> None:
+        """
+        Account for a request allowed by acquire: its HTTP status (or 'error'), duration, response
+        headers and endpoint type (metrics.getEndpointType).
+        """
+        with self._condition:
+            self._in_flight -= 1
+            CONCURRENCY_IN_FLIGHT.set(self._name, value=self._in_flight)
+            now = time.monotonic()
+            if status == 429:
+                retry_after = (headers or {}).get('Retry-After')
+                if retry_after is not None and str(retry_after).isdigit():
+                    self._paused_until = max(self._paused_until, now + int(retry_after))
+                self._decrease('throttled', now, duration)
+            elif status == 'error' or status >= 500:
+                self._decrease('error', now, duration)
+            elif self._isSlow(endpoint, duration):
+                self._decrease('latency', now, duration)
+            else:
+                self._increase()
+            self._condition.notify_all()
+
+    def cancel(self) -> None:
+        """
+        Give back a request allowed by acquire that was not sent, without judging the limit.
+        """
+        with self._condition:
+            self._in_flight -= 1
+            CONCURRENCY_IN_FLIGHT.set(self._name, value=self._in_flight)
+            self._condition.notify_all()
+
+    def _isSlow(self, endpoint: str, duration: float) -> bool:
+        baseline = self._baselines.get(endpoint)
+        latency = self._latencies.get(endpoint)
+        if baseline is None:
+            self._baselines[endpoint] = self._latencies[endpoint] = duration
+            return False
+        latency += (duration - latency) * self._latency_smoothing
+        self._latencies[endpoint] = latency
+        # The baseline drops to any faster response at once and drifts up slowly otherwise
+        self._baselines[endpoint] = min(duration, baseline + (duration - baseline) * 0.01)
+        return latency > baseline * self._latency_tolerance
+
+    def _increase(self) -> None:
+        before = int(self._limit)
+        self._limit = min(self._limit + 1 / self._limit, float(self._max_limit))
+        if int(self._limit) != before:
+            self._record('increase')
+
+    def _decrease(self, reason: str, now: float, duration: float) -> None:
+        # Requests sent before the last cut report the congestion that caused it
+        if now - self._last_decrease < duration:
+            return
+        self._last_decrease = now
+        self._limit = max(self._limit * self._backoff, float(self._min_limit))
+        CONCURRENCY_DECREASES.inc(self._name, reason)
+        self._record(reason)
+
+    def _record(self, reason: str) -> None:
+        self._history.append((time.time(), int(self._limit), reason))
+        CONCURRENCY_LIMIT.set(self._name, value=int(self._limit))
@@ -0,0 +1,125 @@
+import json
+import os
+import threading
+import time
+
+
+class MissingCredentialsError(RuntimeError):
+    """
+    Raised when no Companies House api key is configured.
+    """
+
+
+class ApiKeyState():
+    """
+    Request budget of one api key in its current rate limit window.
+    """
+
+    def __init__(self, key: str, limit: int, period: float) -> None:
+        self.key = key
+        self.limit = limit
+        self.period = period
+        self.window_reset = 0.0
+        self.remaining = limit
+        self.throttled_until = 0.0
+
+    def refresh(self, now: float) -> None:
+        if now >= self.window_reset:
+            self.window_reset = now + self.period
+            self.remaining = self.limit
+
+    def availableAt(self, now: float) -> float:
+        """
+        Time at which this key can next be used.
+        """
+        if self.throttled_until > now:
+            return self.throttled_until
+        if self.remaining <= 0 and self.window_reset > now:
+            return self.window_reset
+        return now
+
+
+class CredentialPool():
+    """
+    Several Companies House api keys used as one, each with its own quota.
+
+    Every request is assigned to the key with the most budget left in its rate limit
+    window. A key that gets a 429 is taken out of rotation until its Retry-After (or
+    the end of its window) has passed, so throughput scales with the number of keys.
+    """
+
+    def __init__(self, keys: list, limit: int = 600, period: float = 300.0) -> None:
+        if not keys:
+            raise MissingCredentialsError("No Companies House api key found.")
+        self._states = {key: ApiKeyState(key, limit, period) for key in dict.fromkeys(keys)}
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._states)
+
+    @staticmethod
+    def loadKeys(authentication_fp: str = None) -> list:
+        """
+        Read api keys from the CH_API_KEYS (comma separated) or CH_API_KEY environment
+        variables, or from a JSON file holding "api_keys" (a list) or "api_key".
+        """
+        if authentication_fp is None:
+            keys = os.getenv('CH_API_KEYS') or os.getenv('CH_API_KEY') or ''
+            return [key.strip() for key in keys.split(',') if key.strip()]
+        try:
+            with open(authentication_fp, 'r') as f:
+                auth_dict = json.load(f)
+        except FileNotFoundError:
+            raise RuntimeError(f"Config file '{authentication_fp}' not found.")
+        except json.JSONDecodeError:
+            raise RuntimeError(f"Invalid JSON in '{authentication_fp}'.")
+        if 'api_keys' in auth_dict:
+            return list(auth_dict['api_keys'])
+        return [auth_dict['api_key']]
+
+    def acquire(self) -> str:
+        """
+        Take one request from the key with the most remaining budget, waiting if every key is spent or throttled.
+        """
+        while True:
+            with self._lock:
+                now = time.time()
+                for state in self._states.values():
+                    state.refresh(now)
+                available = [state for state in self._states.values() if state.availableAt(now) <= now]
+                if available:
+                    state = max(available, key=lambda state: state.remaining)
+                    state.remaining -= 1
+                    return state.key
+                wait = min(state.availableAt(now) for state in self._states.values()) - now
+            time.sleep(max(wait, 0.01))
+
+    def report(self, key: str, status: int, headers: dict = None) -> None:
+        """
+        Update a key's budget from the response to a request made with it.
+        """
+        state = self._states.get(key)
+        if state is None:
+            return
+        headers = headers or {}
+        with self._lock:
+            now = time.time()
+            remaining = headers.get('X-Ratelimit-Remain')
+            reset = headers.get('X-Ratelimit-Reset')
+            if remaining is not None and str(remaining).isdigit():
+                state.remaining = int(remaining)
+            if reset is not None and str(reset).isdigit():
+                state.window_reset = float(reset)
+            if status == 429:
+                retry_after = headers.get('Retry-After')
+                if retry_after is not None and str(retry_after).isdigit():
+                    state.throttled_until = now + int(retry_after)
+                else:
+                    state.throttled_until = max(state.window_reset, now + 1)
+                state.remaining = 0
+
+    def remaining(self, key: str) -> int:
+        return self._states[key].remaining
+
+    def isThrottled(self, key: str) -> bool:
+        return self._states[key].throttled_until > time.time()
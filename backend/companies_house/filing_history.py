@@ -0,0 +1,106 @@
+import sqlite3
+import threading
+
+
+class FilingHistoryStore():
+    """
+    Typed, persistent table of company filings (SQLite).
+
+    Filings are keyed by transaction id, so a company's history only ever needs the
+    filings made since it was last fetched. One store can be shared by the threads of a search.
+    """
+
+    COLUMNS = ["company_number", "transaction_id", "category", "type", "date", "description", "action_date",
+               "pages", "barcode"]
+
+    def __init__(self, store_fp: str) -> None:
+        self._store_fp = store_fp
+        self._conn = sqlite3.connect(store_fp, timeout=60, check_same_thread=False)
+        self._lock = threading.Lock()
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS filings (company_number TEXT NOT NULL, "
+                           "transaction_id TEXT NOT NULL, category TEXT, type TEXT, date TEXT, description TEXT, "
+                           "action_date TEXT, pages INTEGER, barcode TEXT, "
+                           "PRIMARY KEY (company_number, transaction_id))")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS filings_date ON filings (company_number, date)")
+
+    @property
+    def store_fp(self) -> str:
+        return self._store_fp
+
+    def knownTransactionIds(self, company_number: str) -> set:
+        with self._lock:
+            rows = self._conn.execute("SELECT transaction_id FROM filings WHERE company_number = ?",
+                                      (company_number,))
+            return {row[0] for row in rows}
+
+    def addFilings(self, company_number: str, filings: list) -> None:
+        """
+        Add filings as returned by the filing history endpoint.
+        """
+        rows = [(company_number, filing.get('transaction_id'), filing.get('category'), filing.get('type'),
+                 filing.get('date'), filing.get('description'), filing.get('action_date'), filing.get('pages'),
+                 filing.get('barcode'))
+                for filing in filings if filing.get('transaction_id')]
+        with self._lock, self._conn:
+            self._conn.executemany("INSERT OR IGNORE INTO filings VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+
+    def loadFrame(self, company_numbers: list = None) -> 'pd.DataFrame':
+        """
+        Load filings as a typed DataFrame: dates as datetimes, category and type as categoricals.
+        """
+        # pandas is only needed for analysis, not by the searches that store filings
+        import pandas as pd
+
+        query = "SELECT * FROM filings"
+        params = ()
+        if company_numbers is not None:
+            query += f" WHERE company_number IN ({','.join('?' * len(company_numbers))})"
+            params = tuple(company_numbers)
+        with self._lock:
+            filings = pd.read_sql_query(query, self._conn, params=params)
+        filings['date'] = pd.to_datetime(filings['date'], errors='coerce')
+        filings['action_date'] = pd.to_datetime(filings['action_date'], errors='coerce')
+        filings['category'] = filings['category'].astype('category')
+        filings['type'] = filings['type'].astype('category')
+        filings['pages'] = filings['pages'].astype('Int64')
+        return filings
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+def getFilingFeatures(filings: 'pd.DataFrame', as_of: 'pd.Timestamp' = None) -> 'pd.DataFrame':
+    """
+    Derive per-company filing cadence features in one vectorised pass.
+
+    Returns:
+        pd.DataFrame: indexed by company number with total_filings, filings_per_year,
+        filings_last_12_months, days_since_last_filing, accounts_filings and days_since_last_accounts
+    """
+    import pandas as pd
+
+    if as_of is None:
+        as_of = pd.Timestamp.now().normalize()
+    dates = filings['date']
+    by_company = dates.groupby(filings['company_number'])
+    first_filing = by_company.min()
+    last_filing = by_company.max()
+    # Histories shorter than a year count as one year, so new companies are not inflated
+    years = ((as_of - first_filing).dt.days / 365.25).clip(lower=1.0)
+
+    is_accounts = (filings['category'] == 'accounts').to_numpy()
+    last_accounts = dates[is_accounts].groupby(filings['company_number'][is_accounts]).max()
+    is_recent = (dates >= as_of - pd.Timedelta(days=365)).to_numpy()
+
+    features = pd.DataFrame({'total_filings': by_company.size()})
+    features['filings_per_year'] = features['total_filings'] / years
+    features['filings_last_12_months'] = (
+        filings['company_number'][is_recent].value_counts().reindex(features.index, fill_value=0))
+    features['days_since_last_filing'] = (as_of - last_filing).dt.days
+    features['accounts_filings'] = (
+        filings['company_number'][is_accounts].value_counts().reindex(features.index, fill_value=0))
+    features['days_since_last_accounts'] = (as_of - last_accounts.reindex(features.index)).dt.days
+    features.index.name = 'company_number'
+    return features
@@ -0,0 +1,79 @@
+import json
+import os
+
+
+class EtagManifest():
+    """
+    Company number -> etags seen on previous runs, used to skip unchanged companies.
+
+    Each entry holds the etag of the company profile and of the sub-resources that
+    were exported for it (officers, persons with significant control, charges and each
+    officer's appointments), so that an incremental run only re-fetches and re-exports
+    what Companies House reports as changed.
+    """
+
+    NEW = 'new'
+    CHANGED = 'changed'
+    UNCHANGED = 'unchanged'
+    # Logged for a company some of whose resources could not be fetched. Its profile etag is not stored,
+    # so the next run fetches it again along with every resource that failed.
+    FAILED = 'failed'
+
+    def __init__(self, manifest_fp: str) -> None:
+        self._manifest_fp = manifest_fp
+        try:
+            with open(manifest_fp, 'r') as f:
+                self._entries = json.load(f)
+        except FileNotFoundError:
+            self._entries = dict()
+        except json.JSONDecodeError:
+            raise RuntimeError(f"Invalid JSON in '{manifest_fp}'.")
+
+    @property
+    def manifest_fp(self) -> str:
+        return self._manifest_fp
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def getChange(self, company_number: str, etag: str) -> str:
+        """
+        Compare a company profile etag with the previous run.
+        """
+        entry = self._entries.get(company_number)
+        if entry is None:
+            return self.NEW
+        if etag and entry.get('etag') == etag:
+            return self.UNCHANGED
+        return self.CHANGED
+
+    def isResourceUnchanged(self, company_number: str, resource: str, etag: str) -> bool:
+        """
+        True if a sub-resource (e.g. officers) has the same etag as on the previous run.
+        """
+        return bool(etag) and self._entries.get(company_number, {}).get(resource) == etag
+
+    def isAppointmentsUnchanged(self, company_number: str, officer_id: str, etag: str) -> bool:
+        appointments = self._entries.get(company_number, {}).get('appointments', {})
+        return bool(etag) and appointments.get(officer_id) == etag
+
+    def updateCompany(self, company_number: str, etag: str, timestamp: str) -> None:
+        entry = self._entries.setdefault(company_number, dict())
+        entry['etag'] = etag
+        entry['last_seen'] = timestamp
+
+    def updateResource(self, company_number: str, resource: str, etag: str) -> None:
+        self._entries.setdefault(company_number, dict())[resource] = etag
+
+    def updateAppointments(self, company_number: str, officer_id: str, etag: str) -> None:
+        entry = self._entries.setdefault(company_number, dict())
+        entry.setdefault('appointments', dict())[officer_id] = etag
+
+    def save(self) -> None:
+        """
+        Write the manifest atomically so that a crash never leaves it half written.
+        """
+        tmp_fp = self._manifest_fp + '.tmp'
+        with open(tmp_fp, 'w') as f:
+            json.dump(self._entries, f)
+        os.replace(tmp_fp, self._manifest_fp)
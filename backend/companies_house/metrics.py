@@ -0,0 +1,284 @@
+import bisect
+import contextvars
+import functools
+import threading
+import time
+from urllib.parse import urlparse
+
+
+class Counter():
+    """
+    A monotonically increasing value per label set.
+    """
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = ()) -> None:
+        self._name = name
+        self._documentation = documentation
+        self._labelnames = tuple(labelnames)
+        self._values = dict()
+        self._lock = threading.Lock()
+
+    @property
+    def name(self) -> str:
+        return self._name
+
+    def inc(self, *labelvalues: str, amount: float = 1) -> None:
+        with self._lock:
+            self._values[labelvalues] = self._values.get(labelvalues, 0) + amount
+
+    def value(self, *labelvalues: str) -> float:
+        return self._values.get(labelvalues, 0)
+
+    def render(self) -> list:
+        lines = [f"# HELP {self._name} {self._documentation}", f"# TYPE {self._name} counter"]
+        with self._lock:
+            items = sorted(self._values.items())
+        for labelvalues, value in items:
+            lines.append(f"{self._name}{formatLabels(self._labelnames, labelvalues)} {formatValue(value)}")
+        return lines
+
+
+class Gauge(Counter):
+    """
+    A value per label set that can go up and down.
+    """
+
+    def set(self, *labelvalues: str, value: float) -> None:
+        with self._lock:
+            self._values[labelvalues] = value
+
+    def render(self) -> list:
+        lines = super().render()
+        lines[1] = f"# TYPE {self._name} gauge"
+        return lines
+
+
+class Histogram():
+    """
+    Cumulative bucketed observations per label set.
+    """
+
+    DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = (), buckets: tuple = DEFAULT_BUCKETS) -> None:
+        self._name = name
+        self._documentation = documentation
+        self._labelnames = tuple(labelnames)
+        self._buckets = tuple(sorted(buckets))
+        # labelvalues -> [per-bucket counts..., +Inf count, sum]
+        self._values = dict()
+        self._lock = threading.Lock()
+
+    @property
+    def name(self) -> str:
+        return self._name
+
+    def observe(self, *labelvalues: str, value: float) -> None:
+        index = bisect.bisect_left(self._buckets, value)
+        with self._lock:
+            counts = self._values.get(labelvalues)
+            if counts is None:
+                counts = [0] * (len(self._buckets) + 2)
+                self._values[labelvalues] = counts
+            counts[index] += 1
+            counts[-1] += value
+
+    def count(self, *labelvalues: str) -> int:
+        counts = self._values.get(labelvalues)
+        return 0 if counts is None else sum(counts[:-1])
+
+    def render(self) -> list:
+        lines = [f"# HELP {self._name} {self._documentation}", f"# TYPE {self._name} histogram"]
+        with self._lock:
+            items = sorted((labelvalues, list(counts)) for labelvalues, counts in self._values.items())
+        for labelvalues, counts in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self._buckets + (float('inf'),), counts[:-1]):
+                cumulative += bucket_count
+                labels = formatLabels(self._labelnames + ('le',), labelvalues + (formatValue(bound),))
+                lines.append(f"{self._name}_bucket{labels} {cumulative}")
+            labels = formatLabels(self._labelnames, labelvalues)
+            lines.append(f"{self._name}_sum{labels} {formatValue(counts[-1])}")
+            lines.append(f"{self._name}_count{labels} {cumulative}")
+        return lines
+
+
+class MetricsRegistry():
+    """
+    Holds the metrics of this process and renders them in the Prometheus text format.
+    """
+
+    CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+    def __init__(self) -> None:
+        self._metrics = dict()
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            return self._metrics.setdefault(metric.name, metric)
+
+    def counter(self, name: str, documentation: str, labelnames: tuple = ()) -> Counter:
+        return self.register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames: tuple = ()) -> Gauge:
+        return self.register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str, labelnames: tuple = (),
+                  buckets: tuple = Histogram.DEFAULT_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self) -> str:
+        lines = []
+        for metric in list(self._metrics.values()):
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+def formatValue(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def formatLabels(labelnames: tuple, labelvalues: tuple) -> str:
+    if not labelnames:
+        return ''
+    pairs = []
+    for name, value in zip(labelnames, labelvalues):
+        value = str(value).replace('\\', r'\\').replace('\n', r'\n').replace('"', r'\"')
+        pairs.append(f'{name}="{value}"')
+    return '{' + ','.join(pairs) + '}'
+
+
+def getEndpointType(url: str) -> str:
+    """
+    Classify a Companies House url into the kind of resource it fetches,
+    e.g. /company/00000006/officers -> officers.
+    """
+    parts = [part for part in urlparse(url).path.split('/') if part]
+    if not parts:
+        return 'other'
+    if parts[0] in ('search', 'advanced-search'):
+        return 'search'
+    if parts[0] == 'officers' and parts[-1] == 'appointments':
+        return 'appointments'
+    if parts[0] == 'company':
+        if len(parts) == 2:
+            return 'profile'
+        return {
+            'officers': 'officers',
+            'persons-with-significant-control': 'psc',
+            'charges': 'charges',
+            'filing-history': 'filing_history',
+        }.get(parts[2], 'other')
+    return 'other'
+
+
+REGISTRY = MetricsRegistry()
+
+UPSTREAM_REQUESTS = REGISTRY.counter(
+    'ch_upstream_requests_total', 'Companies House API calls by endpoint type and HTTP status.', ('endpoint', 'status'))
+UPSTREAM_LATENCY = REGISTRY.histogram(
+    'ch_upstream_request_duration_seconds', 'Companies House API call latency by endpoint type.', ('endpoint',))
+UPSTREAM_RESPONSE_BYTES = REGISTRY.histogram(
+    'ch_upstream_response_bytes', 'Size of Companies House API response bodies by endpoint type.', ('endpoint',),
+    buckets=(1e3, 1e4, 5e4, 1e5, 2.5e5, 5e5, 1e6, 2.5e6, 5e6))
+UPSTREAM_RATELIMIT_REMAINING = REGISTRY.gauge(
+    'ch_upstream_ratelimit_remaining', 'Requests left in the current Companies House rate limit window.')
+UPSTREAM_RATELIMIT_LIMIT = REGISTRY.gauge(
+    'ch_upstream_ratelimit_limit', 'Size of the Companies House rate limit window.')
+CACHE_REQUESTS = REGISTRY.counter(
+    'ch_cache_requests_total', 'Cache lookups for upstream data by cache and result (hit or miss).', ('cache', 'result'))
+VIEW_REQUESTS = REGISTRY.counter(
+    'address_view_requests_total', 'Requests served by the address views by view and HTTP status.', ('view', 'status'))
+VIEW_LATENCY = REGISTRY.histogram(
+    'address_view_duration_seconds', 'Time spent serving each address view.', ('view',))
+VIEW_UPSTREAM_CALLS = REGISTRY.histogram(
+    'address_view_upstream_calls', 'Companies House API calls made while serving one request.', ('view',),
+    buckets=(0, 1, 2, 5, 10, 25, 50, 100))
+
+# Number of upstream calls made by the request currently being served, if any.
+_upstream_calls = contextvars.ContextVar('upstream_calls', default=None)
+
+
+def recordUpstreamCall(url: str, status: str, duration: float, headers: dict = None, size: int = None) -> None:
+    """
+    Account for one Companies House API call.
+    """
+    endpoint = getEndpointType(url)
+    UPSTREAM_REQUESTS.inc(endpoint, str(status))
+    UPSTREAM_LATENCY.observe(endpoint, value=duration)
+    if size is not None:
+        UPSTREAM_RESPONSE_BYTES.observe(endpoint, value=size)
+    if headers:
+        remaining = headers.get('X-Ratelimit-Remain')
+        limit = headers.get('X-Ratelimit-Limit')
+        if remaining is not None and str(remaining).isdigit():
+            UPSTREAM_RATELIMIT_REMAINING.set(value=int(remaining))
+        if limit is not None and str(limit).isdigit():
+            UPSTREAM_RATELIMIT_LIMIT.set(value=int(limit))
+    calls = _upstream_calls.get()
+    if calls is not None:
+        calls[0] += 1
+
+
+def recordCacheLookup(cache: str, hit: bool) -> None:
+    CACHE_REQUESTS.inc(cache, 'hit' if hit else 'miss')
+
+
+def instrumentView(name: str):
+    """
+    Decorator recording request counts, latency and upstream call counts for a view.
+
+    A streaming response is only produced after the view returns, so its content is generated in the
+    request's context and recorded once the stream finishes or the client goes away.
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            calls = [0]
+            token = _upstream_calls.set(calls)
+            start = time.perf_counter()
+            status = 500
+            streaming = False
+
+            def record():
+                VIEW_LATENCY.observe(name, value=time.perf_counter() - start)
+                VIEW_REQUESTS.inc(name, str(status))
+                VIEW_UPSTREAM_CALLS.observe(name, value=calls[0])
+
+            try:
+                response = view(*args, **kwargs)
+                status = response.status_code
+                streaming = getattr(response, 'streaming', False)
+                if streaming:
+                    response.streaming_content = streamInContext(
+                        response.streaming_content, contextvars.copy_context(), record)
+                return response
+            finally:
+                if not streaming:
+                    record()
+                _upstream_calls.reset(token)
+        return wrapper
+    return decorator
+
+
+def streamInContext(content, context: contextvars.Context, finished):
+    """
+    Yield the chunks of content, each generated in context, and call finished at the end of the stream.
+    """
+    iterator = iter(content)
+    try:
+        while True:
+            try:
+                chunk = context.run(next, iterator)
+            except StopIteration:
+                return
+            yield chunk
+    finally:
+        if hasattr(iterator, 'close'):
+            context.run(iterator.close)
+        finished()
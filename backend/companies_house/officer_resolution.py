@@ -0,0 +1,199 @@
+import numpy as np
+import pandas as pd
+import argparse
+import glob
+
+
+def normaliseText(values: pd.Series) -> pd.Series:
+    """
+    Upper case letters and single spaces only, e.g. "O'Brien-Smith " -> 'OBRIEN SMITH'.
+    """
+    values = values.fillna('').astype(str).str.upper()
+    values = values.str.replace(r"['.]", '', regex=True).str.replace(r'[^A-Z]+', ' ', regex=True)
+    return values.str.strip()
+
+
+def prepareOfficers(officers: pd.DataFrame) -> pd.DataFrame:
+    """
+    Comparison fields of company officers CSV rows: surname, forenames, date of birth and postcode.
+
+    Names without a comma (mostly corporate officers) have no parsed surname,
+    so the whole name stands in for it.
+    """
+    def column(name: str) -> pd.Series:
+        if name not in officers:
+            return pd.Series('', index=officers.index)
+        return officers[name].fillna('').astype(str)
+
+    prepared = pd.DataFrame(index=officers.index)
+    surname = normaliseText(column('officer_surname'))
+    prepared['surname'] = surname.where(surname != '', normaliseText(column('officer_name')))
+    other_forenames = column('officer_other_forenames')
+    other_forenames = other_forenames.mask(other_forenames == 'None', '')
+    prepared['forenames'] = normaliseText(column('officer_forename') + ' ' + other_forenames)
+    month = pd.to_numeric(column('dob_month'), errors='coerce').fillna(0).astype(int)
+    year = pd.to_numeric(column('dob_year'), errors='coerce').fillna(0).astype(int)
+    # Unknown dates of birth never match anything
+    prepared['dob'] = (year.astype(str) + '-' + month.astype(str).str.zfill(2)).where((year > 0) & (month > 0), '')
+    prepared['postcode'] = column('postal_code').str.upper().str.replace(r'\s+', '', regex=True)
+    prepared['officer_id'] = column('officer_id')
+    return prepared
+
+
+def nameGrams(values) -> pd.DataFrame:
+    """
+    Distinct padded character bigrams of each value, one (value position, gram) row per bigram.
+    """
+    grams = pd.Series([sorted({f' {value} '[i:i + 2] for i in range(len(value) + 1)}) for value in values])
+    grams = grams.explode().dropna()
+    return pd.DataFrame({'value': grams.index.to_numpy(), 'gram': grams.to_numpy()})
+
+
+def diceSimilarity(pairs: pd.DataFrame, values: pd.Series) -> np.ndarray:
+    """
+    Dice coefficient of the padded bigrams of values[left] and values[right] for every candidate pair.
+
+    Bigrams are computed once per distinct value and shared bigrams are counted with joins,
+    so there is no Python call per pair. Identical values score 1 without a join.
+    """
+    codes, uniques = pd.factorize(values)
+    left, right = codes[pairs['left'].to_numpy()], codes[pairs['right'].to_numpy()]
+    similarity = (left == right).astype(float)
+    differ = np.flatnonzero(left != right)
+    if len(differ) == 0:
+        return similarity
+    grams = nameGrams(uniques)
+    counts = grams.groupby('value').size().reindex(range(len(uniques)), fill_value=0).to_numpy()
+    distinct = pd.DataFrame({'pair': differ, 'left': left[differ], 'right': right[differ]})
+    shared = distinct.merge(grams, left_on='left', right_on='value') \
+        .merge(grams, left_on=['right', 'gram'], right_on=['value', 'gram']) \
+        .groupby('pair').size()
+    shared = shared.reindex(differ, fill_value=0).to_numpy()
+    total = counts[left[differ]] + counts[right[differ]]
+    similarity[differ] = np.divide(2 * shared, total, out=np.zeros(len(differ)), where=total > 0)
+    return similarity
+
+
+def connectedComponents(size: int, left: np.ndarray, right: np.ndarray) -> np.ndarray:
+    """
+    Component label (smallest member) of each of size nodes given the edges left[i] - right[i].
+
+    Vectorised label propagation with pointer jumping, so no Python loop over edges.
+    """
+    labels = np.arange(size)
+    if len(left) == 0:
+        return labels
+    while True:
+        minimum = np.minimum(labels[left], labels[right])
+        updated = labels.copy()
+        np.minimum.at(updated, left, minimum)
+        np.minimum.at(updated, right, minimum)
+        updated = updated[updated]
+        while not np.array_equal(updated, updated[updated]):
+            updated = updated[updated]
+        if np.array_equal(updated, labels):
+            return labels
+        labels = updated
+
+
+class OfficerResolver():
+    """
+    Cluster company officer rows that refer to the same person.
+
+    Companies House gives the same person different officer ids and spellings across companies.
+    Rows are only compared within blocks sharing a blocking key (surname + date of birth and date
+    of birth + postcode by default, so that a misspelt surname is still caught), and blocks larger
+    than max_block_size are skipped, so the work grows with the sum of squared block sizes rather
+    than with all pairs. A pair matches if its weighted name, date of birth and postcode
+    similarity reaches threshold. Rows with the same officer id are always the same person.
+    """
+
+    BLOCKING_KEYS = (('surname', 'dob'), ('dob', 'postcode'))
+    # Weights of surname similarity, forename similarity, same date of birth and same postcode
+    WEIGHTS = (0.45, 0.35, 0.1, 0.1)
+
+    def __init__(self, threshold: float = 0.8, max_block_size: int = 1000, blocking_keys: tuple = None,
+                 pair_chunk_size: int = 1_000_000) -> None:
+        self._threshold = threshold
+        self._max_block_size = max_block_size
+        self._blocking_keys = blocking_keys or self.BLOCKING_KEYS
+        self._pair_chunk_size = pair_chunk_size
+
+    @property
+    def threshold(self) -> float:
+        return self._threshold
+
+    def candidatePairs(self, prepared: pd.DataFrame) -> pd.DataFrame:
+        """
+        Distinct (left, right) row positions sharing at least one blocking key, left < right.
+        """
+        blocks = []
+        for key in self._blocking_keys:
+            known = prepared[list(key)].ne('').all(axis=1)
+            block = prepared.loc[known, key[0]]
+            for column in key[1:]:
+                block = block + '|' + prepared.loc[known, column]
+            sizes = block.map(block.value_counts())
+            block = block[(sizes > 1) & (sizes <= self._max_block_size)]
+            rows = pd.DataFrame({'position': prepared.index.get_indexer(block.index), 'block': block.to_numpy()})
+            pairs = rows.merge(rows, on='block', suffixes=('_left', '_right'))
+            pairs = pairs[pairs['position_left'] < pairs['position_right']]
+            blocks.append(pairs[['position_left', 'position_right']])
+        pairs = pd.concat(blocks, ignore_index=True).drop_duplicates()
+        return pairs.rename(columns={'position_left': 'left', 'position_right': 'right'}).reset_index(drop=True)
+
+    def scorePairs(self, prepared: pd.DataFrame, pairs: pd.DataFrame) -> np.ndarray:
+        surnames = prepared['surname'].reset_index(drop=True)
+        forenames = prepared['forenames'].reset_index(drop=True)
+        dobs = prepared['dob'].to_numpy()
+        postcodes = prepared['postcode'].to_numpy()
+        left, right = pairs['left'].to_numpy(), pairs['right'].to_numpy()
+        surname_weight, forename_weight, dob_weight, postcode_weight = self.WEIGHTS
+        return (surname_weight * diceSimilarity(pairs, surnames)
+                + forename_weight * diceSimilarity(pairs, forenames)
+                + dob_weight * ((dobs[left] == dobs[right]) & (dobs[left] != ''))
+                + postcode_weight * ((postcodes[left] == postcodes[right]) & (postcodes[left] != '')))
+
+    def resolve(self, officers: pd.DataFrame) -> pd.DataFrame:
+        """
+        Add a person_id column (the smallest officer id in each cluster) and cluster_size.
+        """
+        prepared = prepareOfficers(officers.reset_index(drop=True))
+        pairs = self.candidatePairs(prepared)
+        matches = []
+        for start in range(0, len(pairs), self._pair_chunk_size):
+            chunk = pairs.iloc[start:start + self._pair_chunk_size].reset_index(drop=True)
+            matches.append(chunk[self.scorePairs(prepared, chunk) >= self._threshold])
+
+        # Rows sharing an officer id are linked to the first row with that id
+        with_id = prepared[prepared['officer_id'] != '']
+        firsts = with_id.index.to_series().groupby(with_id['officer_id']).transform('min')
+        linked = firsts[firsts != firsts.index]
+        matches.append(pd.DataFrame({'left': linked.to_numpy(), 'right': linked.index.to_numpy()}))
+
+        edges = pd.concat(matches, ignore_index=True)
+        labels = connectedComponents(len(prepared), edges['left'].to_numpy(dtype=np.int64),
+                                     edges['right'].to_numpy(dtype=np.int64))
+        ids = prepared['officer_id'].mask(prepared['officer_id'] == '', 'row-' + prepared.index.to_series().astype(str))
+        # Sorting beats a groupby min, which falls back to Python for strings
+        representatives = pd.DataFrame({'label': labels, 'id': ids.to_numpy()}).sort_values(['label', 'id']) \
+            .drop_duplicates('label').set_index('label')['id']
+        resolved = officers.reset_index(drop=True).copy()
+        resolved['person_id'] = representatives.reindex(labels).to_numpy()
+        resolved['cluster_size'] = resolved.groupby('person_id')['person_id'].transform('size')
+        return resolved
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Assign person ids to company officers across companies.")
+    parser.add_argument('officers', nargs='+', help="company officers CSV files or glob patterns")
+    parser.add_argument('--output', default='data/officer_persons.csv')
+    parser.add_argument('--threshold', type=float, default=0.8, help="similarity needed for a match")
+    parser.add_argument('--max-block-size', type=int, default=1000, help="larger blocks are not compared")
+    args = parser.parse_args()
+    officers_fps = sorted({fp for pattern in args.officers for fp in glob.glob(pattern)})
+    officers = pd.concat([pd.read_csv(fp, dtype=str, keep_default_na=False) for fp in officers_fps],
+                         ignore_index=True)
+    resolved = OfficerResolver(args.threshold, args.max_block_size).resolve(officers)
+    resolved.to_csv(args.output, index=False)
+    print(f"{len(resolved)} officer rows resolved to {resolved['person_id'].nunique()} people")
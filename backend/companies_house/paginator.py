@@ -0,0 +1,98 @@
+from concurrent.futures import ThreadPoolExecutor
+import contextvars
+from collections import deque
+
+try:
+    from companies_house.companies_house_api import ChAPI
+    from companies_house.credentials import CredentialPool
+    from companies_house import metrics
+except ImportError:
+    from companies_house_api import ChAPI
+    from credentials import CredentialPool
+    import metrics
+
+
+class Paginator():
+    """
+    Iterate over every item of a paged Companies House list resource.
+
+    The first page is fetched with the largest page size the endpoint allows. Once its
+    total is known the remaining pages are fetched concurrently, a few at a time, and their
+    items are yielded in order as soon as each page arrives, so a long list is never held
+    in memory at once.
+
+    With raise_errors, a page that could not be fetched because of an outage raises an
+    UpstreamError (from the constructor for the first page, from iteration for the others)
+    instead of counting as an empty page.
+    """
+
+    # Largest items_per_page accepted by each kind of list resource
+    MAX_ITEMS_PER_PAGE = {
+        'officers': 100,
+        'appointments': 50,
+        'psc': 100,
+        'charges': 100,
+        'filing_history': 100,
+    }
+
+    def __init__(self, url: str, api_key: str = None, items_per_page: int = None, max_workers: int = 4,
+                 params: dict = None, credentials: CredentialPool = None, raise_errors: bool = False) -> None:
+        self._url = url
+        self._api_key = api_key
+        self._credentials = credentials
+        if items_per_page is None:
+            items_per_page = self.MAX_ITEMS_PER_PAGE.get(metrics.getEndpointType(url), 100)
+        self._items_per_page = items_per_page
+        self._max_workers = max_workers
+        self._params = dict(params or {})
+        self._raise_errors = raise_errors
+        self._first_page = self.getPage(0)
+
+    @property
+    def url(self) -> str:
+        return self._url
+
+    @property
+    def items_per_page(self) -> int:
+        return self._items_per_page
+
+    @property
+    def first_page(self) -> dict:
+        """
+        The first page as returned by the API, with list metadata such as etag and kind.
+        """
+        return self._first_page
+
+    @property
+    def total_results(self) -> int:
+        total = self._first_page.get('total_results', self._first_page.get('total_count'))
+        if total is None:
+            return len(self._first_page.get('items', []))
+        return int(total)
+
+    def getPage(self, start_index: int) -> dict:
+        params = dict(self._params, items_per_page=self._items_per_page, start_index=start_index)
+        return ChAPI.getChData(self._url, self._api_key, params=params, credentials=self._credentials,
+                               raise_errors=self._raise_errors)
+
+    def __iter__(self):
+        first_items = self._first_page.get('items', [])
+        yield from first_items
+        if not first_items:
+            return
+
+        # Step by the page size the API actually honoured, which may be below the one asked for
+        start_indexes = iter(range(len(first_items), self.total_results, len(first_items)))
+        with ThreadPoolExecutor(max_workers=self._max_workers) as executor:
+            pending = deque()
+            for start_index in start_indexes:
+                # Each page runs in a copy of this context, so it belongs to the current trace span
+                pending.append(executor.submit(contextvars.copy_context().run, self.getPage, start_index))
+                if len(pending) >= self._max_workers:
+                    break
+            while pending:
+                items = pending.popleft().result().get('items', [])
+                next_index = next(start_indexes, None)
+                if next_index is not None:
+                    pending.append(executor.submit(contextvars.copy_context().run, self.getPage, next_index))
+                yield from items
@@ -0,0 +1,99 @@
+import multiprocessing
+import os
+import struct
+import threading
+import time
+
+
+class RateLimiter():
+    """
+    Spread requests evenly over a rate limit window (GCRA, a leaky bucket without a queue).
+
+    Companies House allows 600 requests per key per 5 minutes. With shared=True the
+    limiter state lives in shared memory, so one limiter created before forking worker
+    processes keeps all of them under a single limit. With a state file the state lives in that
+    file under a file lock instead, so processes started independently, such as web workers
+    and batch scripts on one host, share the limit too.
+    """
+
+    def __init__(self, rate: int = 600, period: float = 300.0, burst: int = 10, shared: bool = False,
+                 state_fp: str = None) -> None:
+        self._rate = rate
+        self._period = period
+        self._burst = burst
+        self._interval = period / rate
+        self._tolerance = self._interval * (burst - 1)
+        if state_fp is not None:
+            from filelock import FileLock
+
+            self._lock = FileLock(state_fp + '.lock')
+            self._tat = _FileValue(state_fp)
+        elif shared:
+            self._lock = multiprocessing.Lock()
+            self._tat = multiprocessing.Value('d', 0.0, lock=False)
+        else:
+            self._lock = threading.Lock()
+            self._tat = _LocalValue()
+
+    @property
+    def rate(self) -> int:
+        return self._rate
+
+    @property
+    def period(self) -> float:
+        return self._period
+
+    def tryAcquire(self) -> float:
+        """
+        Take a slot if one is free. Returns 0 on success, otherwise the seconds to wait.
+        """
+        with self._lock:
+            now = time.time()
+            tat = max(self._tat.value, now)
+            wait = tat - self._tolerance - now
+            if wait <= 0:
+                self._tat.value = tat + self._interval
+                return 0.0
+            return wait
+
+    def acquire(self) -> None:
+        """
+        Block until a request may be sent.
+        """
+        while True:
+            wait = self.tryAcquire()
+            if wait <= 0:
+                return
+            time.sleep(wait)
+
+
+class _LocalValue():
+    """
+    Same interface as multiprocessing.Value for a limiter used within one process.
+    """
+
+    def __init__(self) -> None:
+        self.value = 0.0
+
+
+class _FileValue():
+    """
+    Same interface as multiprocessing.Value for a float kept in a file, read and written under the limiter's lock.
+    """
+
+    def __init__(self, value_fp: str) -> None:
+        self._value_fp = value_fp
+        os.makedirs(os.path.dirname(os.path.abspath(value_fp)), exist_ok=True)
+
+    @property
+    def value(self) -> float:
+        try:
+            with open(self._value_fp, 'rb') as f:
+                return struct.unpack('<d', f.read(8))[0]
+        except (FileNotFoundError, struct.error):
+            return 0.0
+
+    @value.setter
+    def value(self, value: float) -> None:
+        with open(self._value_fp, 'wb') as f:
+            f.write(struct.pack('<d', value))
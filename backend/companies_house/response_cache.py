@@ -0,0 +1,191 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+import zlib
+
+try:
+    from companies_house import metrics
+except ImportError:
+    import metrics
+
+
+class ResponseCache():
+    """
+    Companies House responses by url and query parameters, shared by every process that opens the same store.
+
+    Values are compact JSON compressed with zlib. How long a response is kept depends on the kind
+    of resource (see metrics.getEndpointType): searches change as companies register, profiles
+    and officers far less often. Resources with a ttl of 0 are not cached.
+    Subclasses implement _read and _write.
+    """
+
+    # Seconds a response is kept, by endpoint type
+    DEFAULT_TTLS = {
+        'search': 15 * 60,
+        'profile': 24 * 60 * 60,
+        'officers': 24 * 60 * 60,
+        'appointments': 24 * 60 * 60,
+        'psc': 24 * 60 * 60,
+        'charges': 24 * 60 * 60,
+        'filing_history': 24 * 60 * 60,
+        'other': 0,
+    }
+
+    def __init__(self, ttls: dict = None) -> None:
+        self._ttls = dict(self.DEFAULT_TTLS, **(ttls or {}))
+
+    def ttl(self, url: str) -> int:
+        return self._ttls.get(metrics.getEndpointType(url), 0)
+
+    @staticmethod
+    def key(url: str, params: dict = None) -> str:
+        request = json.dumps([url, sorted((str(name), str(value)) for name, value in (params or {}).items())])
+        return hashlib.sha1(request.encode('utf-8')).hexdigest()
+
+    @staticmethod
+    def encode(data: dict) -> bytes:
+        return zlib.compress(json.dumps(data, separators=(',', ':')).encode('utf-8'))
+
+    @staticmethod
+    def decode(value: bytes) -> dict:
+        return json.loads(zlib.decompress(value))
+
+    def get(self, url: str, params: dict = None):
+        """
+        The cached response, or None.
+        """
+        if not self.ttl(url):
+            return None
+        value = self._read(self.key(url, params))
+        metrics.recordCacheLookup(f'upstream_{metrics.getEndpointType(url)}', value is not None)
+        return self.decode(value) if value is not None else None
+
+    def set(self, url: str, params: dict, data: dict) -> None:
+        ttl = self.ttl(url)
+        if ttl:
+            self._write(self.key(url, params), metrics.getEndpointType(url), self.encode(data), ttl)
+
+    def _read(self, key: str):
+        raise NotImplementedError
+
+    def _write(self, key: str, resource: str, value: bytes, ttl: int) -> None:
+        raise NotImplementedError
+
+
+class SqliteResponseCache(ResponseCache):
+    """
+    ResponseCache in a SQLite file. WAL mode lets web workers and batch workers on the
+    same host read and write it concurrently; each thread opens its own connection.
+
+    Once the stored values exceed max_bytes, expired entries and then the least recently
+    used ones are deleted until the store is back under 90% of max_bytes. The size is
+    checked every evict_every writes rather than on each one.
+    """
+
+    # Reads only mark an entry as used if its last use is older than this, to keep reads read-only
+    TOUCH_INTERVAL = 60.0
+
+    def __init__(self, cache_fp: str, max_bytes: int = 256 * 1024 * 1024, ttls: dict = None,
+                 evict_every: int = 100) -> None:
+        super().__init__(ttls)
+        self._cache_fp = cache_fp
+        self._max_bytes = max_bytes
+        self._evict_every = evict_every
+        self._writes = 0
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    @property
+    def cache_fp(self) -> str:
+        return self._cache_fp
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self._cache_fp, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, resource TEXT NOT NULL, "
+                         "value BLOB NOT NULL, size INTEGER NOT NULL, expires REAL NOT NULL, accessed REAL NOT NULL)")
+            conn.execute("CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)")
+            self._local.conn = conn
+        return conn
+
+    def _read(self, key: str):
+        now = time.time()
+        try:
+            conn = self._connection()
+            row = conn.execute("SELECT value, accessed FROM responses WHERE key = ? AND expires > ?",
+                               (key, now)).fetchone()
+            if row is None:
+                return None
+            if row[1] < now - self.TOUCH_INTERVAL:
+                conn.execute("UPDATE responses SET accessed = ? WHERE key = ?", (now, key))
+            return row[0]
+        except sqlite3.Error as e:
+            print(f"Response cache read failed: {e}")
+            return None
+
+    def _write(self, key: str, resource: str, value: bytes, ttl: int) -> None:
+        now = time.time()
+        try:
+            self._connection().execute("INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?)",
+                                       (key, resource, value, len(value), now + ttl, now))
+        except sqlite3.Error as e:
+            print(f"Response cache write failed: {e}")
+            return
+        with self._lock:
+            self._writes += 1
+            evict = self._writes % self._evict_every == 0
+        if evict:
+            self.evict()
+
+    def evict(self) -> int:
+        """
+        Delete expired entries, then least recently used ones while over max_bytes.
+
+        Returns:
+            int: number of entries deleted
+        """
+        conn = self._connection()
+        deleted = conn.execute("DELETE FROM responses WHERE expires <= ?", (time.time(),)).rowcount
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        if total > self._max_bytes:
+            excess = total - int(self._max_bytes * 0.9)
+            deleted += conn.execute(
+                "DELETE FROM responses WHERE key IN (SELECT key FROM (SELECT key, SUM(size) OVER "
+                "(ORDER BY accessed, key) - size AS freed FROM responses) WHERE freed < ?)", (excess,)).rowcount
+        return deleted
+
+    def stats(self) -> dict:
+        """
+        {resource: (entries, bytes)} of the entries stored, expired or not.
+        """
+        rows = self._connection().execute("SELECT resource, COUNT(*), SUM(size) FROM responses GROUP BY resource")
+        return {resource: (entries, size) for resource, entries, size in rows}
+
+    def close(self) -> None:
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+
+class DjangoResponseCache(ResponseCache):
+    """
+    ResponseCache in a Django cache, e.g. the file or database backend shared by all workers.
+    Expiry and eviction are left to the backend (TIMEOUT, MAX_ENTRIES).
+    """
+
+    def __init__(self, cache, ttls: dict = None, prefix: str = 'ch_response') -> None:
+        super().__init__(ttls)
+        self._cache = cache
+        self._prefix = prefix
+
+    def _read(self, key: str):
+        return self._cache.get(f'{self._prefix}:{key}')
+
+    def _write(self, key: str, resource: str, value: bytes, ttl: int) -> None:
+        self._cache.set(f'{self._prefix}:{key}', value, ttl)
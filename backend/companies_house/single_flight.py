@@ -0,0 +1,148 @@
+import hashlib
+import json
+import os
+import threading
+import time
+
+try:
+    from companies_house import metrics
+except ImportError:
+    import metrics
+
+
+COALESCED_REQUESTS = metrics.REGISTRY.counter(
+    'ch_coalesced_requests_total', 'Lookups served by another in-flight identical lookup, by group and scope.',
+    ('group', 'scope'))
+
+
+class _Call():
+    """
+    An in-flight call that other threads can wait on.
+    """
+
+    def __init__(self) -> None:
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight():
+    """
+    Coalesce concurrent identical calls so that only one of them does the work.
+
+    Within a process, callers asking for a key that is already in flight wait for
+    that call and get its result. If a lock directory is given, the leader also
+    takes a file lock per key and publishes its result there for a short time, so
+    that identical calls from other worker processes reuse it instead of fetching again.
+    Leaders sweep the lock directory at most once per result_ttl, deleting the lock and
+    result files of keys whose result has expired and that nobody holds.
+    """
+
+    def __init__(self, group: str, lock_dir: str = None, result_ttl: float = 5.0) -> None:
+        self._group = group
+        self._lock_dir = lock_dir
+        self._result_ttl = result_ttl
+        self._calls = dict()
+        self._lock = threading.Lock()
+        self._swept_at = 0.0
+        if lock_dir is not None:
+            os.makedirs(lock_dir, exist_ok=True)
+
+    @property
+    def group(self) -> str:
+        return self._group
+
+    @property
+    def lock_dir(self) -> str:
+        return self._lock_dir
+
+    def do(self, key: str, fn):
+        """
+        Run fn() for key unless an identical call is already running, in which case
+        wait for it and return its result (or raise its error).
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = _Call()
+                self._calls[key] = call
+
+        if not leader:
+            COALESCED_REQUESTS.inc(self._group, 'process')
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            if self._lock_dir is None:
+                call.result = fn()
+            else:
+                call.result = self._doShared(key, fn)
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result
+
+    def _doShared(self, key: str, fn):
+        """
+        Run fn() under a per-key file lock shared by all worker processes.
+        """
+        from filelock import FileLock
+
+        digest = hashlib.sha1(f"{self._group}:{key}".encode('utf-8')).hexdigest()
+        lock_fp = os.path.join(self._lock_dir, digest + '.lock')
+        result_fp = os.path.join(self._lock_dir, digest + '.json')
+
+        with FileLock(lock_fp):
+            # Another worker may have finished the same call while we waited for the lock
+            try:
+                if time.time() - os.path.getmtime(result_fp) < self._result_ttl:
+                    with open(result_fp, 'r') as f:
+                        result = json.load(f)
+                    COALESCED_REQUESTS.inc(self._group, 'shared')
+                    return result
+            except (FileNotFoundError, json.JSONDecodeError):
+                pass
+
+            result = fn()
+            if result:
+                tmp_fp = f"{result_fp}.{os.getpid()}.tmp"
+                with open(tmp_fp, 'w') as f:
+                    json.dump(result, f)
+                os.replace(tmp_fp, result_fp)
+        self._sweep()
+        return result
+
+    def _sweep(self) -> None:
+        """
+        Delete the files of every key whose newest file is older than the result ttl.
+        """
+        from filelock import FileLock, Timeout
+
+        with self._lock:
+            now = time.time()
+            if now - self._swept_at < self._result_ttl:
+                return
+            self._swept_at = now
+
+        # digest -> its lock, result and leftover temporary files
+        entries = dict()
+        for name in os.listdir(self._lock_dir):
+            entries.setdefault(name.split('.', 1)[0], []).append(os.path.join(self._lock_dir, name))
+        for digest, paths in entries.items():
+            try:
+                if now - max(os.path.getmtime(path) for path in paths) < self._result_ttl:
+                    continue
+                # A key still held by a leader, here or in another worker, is left alone
+                lock_fp = os.path.join(self._lock_dir, digest + '.lock')
+                with FileLock(lock_fp, timeout=0):
+                    for path in set(paths) | {lock_fp}:
+                        os.remove(path)
+            except (Timeout, OSError):
+                continue
@@ -0,0 +1,416 @@
+import argparse
+import csv
+import glob
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import time
+
+import pandas as pd
+
+try:
+    from companies_house.code_tables import CodeTables
+    from companies_house.companies_house_api import ChAPI
+except ImportError:
+    from code_tables import CodeTables
+    from companies_house_api import ChAPI
+
+
+# Exported CSV tables and the column holding the entity each row belongs to. Natures of control
+# and charge details carry no company number and are assigned through their parent rows.
+ENTITY_COLUMNS = {
+    'companies': 'company_number',
+    'sic_codes': 'company_number',
+    'previous_company_names': 'company_number',
+    'company_officers': 'company_number',
+    'officer_appointments': 'officer_id',
+    'persons_significant_control': 'company_number',
+    'natures_of_control': 'etag',
+    'company_charges': 'company_number',
+    'charges_persons_entitled': 'charge_code',
+    'charges_transactions': 'charge_code',
+}
+# Tables re-exported with each sub-resource an incremental run reports as changed
+RESOURCE_TABLES = {
+    'profile': ('companies', 'sic_codes', 'previous_company_names'),
+    'officers': ('company_officers',),
+    'persons_significant_control': ('persons_significant_control', 'natures_of_control'),
+    'charges': ('company_charges', 'charges_persons_entitled', 'charges_transactions'),
+}
+# The companies found by each search, keyed by prefix
+SEARCH_RESULTS = 'search_results'
+CSV_SET_PATTERN = re.compile(r'^(?P<prefix>.*)_companies_(?P<timestamp>[0-9]+(?:\.[0-9]+)?)\.csv$')
+
+
+def csvSetPath(prefix: str, table: str, timestamp: str, folder: str = None) -> str:
+    name = f'{prefix}_{table}_{timestamp}.csv'
+    return os.path.join(folder, name) if folder else ChAPI.getDataFolderLocation(name)
+
+
+def readCsvSet(prefix: str, timestamp: str, folder: str = None) -> tuple:
+    """
+    Read the CSV set of one search run.
+
+    Returns:
+        tuple: ({table: (columns, rows)}, {company_number: resources exported}), where resources
+        is None for a full export and a set of RESOURCE_TABLES keys for an incremental one
+    """
+    tables = dict()
+    for table in ENTITY_COLUMNS:
+        try:
+            with open(csvSetPath(prefix, table, timestamp, folder), newline='') as f:
+                reader = csv.reader(f)
+                columns = next(reader, [])
+                tables[table] = (columns, list(reader))
+        except FileNotFoundError:
+            continue
+    companies = tables.get('companies', ([], []))
+    number = companies[0].index('company_number') if 'company_number' in companies[0] else 0
+    exported = {row[number]: None for row in companies[1]}
+    try:
+        with open(csvSetPath(prefix, 'change_log', timestamp, folder), newline='') as f:
+            reader = csv.DictReader(f)
+            for row in reader:
+                if row['change'] == 'unchanged':
+                    exported[row['company_number']] = set()
+                else:
+                    exported[row['company_number']] = {'profile'} | set(row['resources'].split())
+    except FileNotFoundError:
+        pass
+    return tables, exported
+
+
+class SnapshotStore():
+    """
+    History of exported search runs as one base version per entity plus a delta per run (SQLite).
+
+    Each distinct row is stored once. A run only records the rows added to and removed from the
+    entities it exported (companies, and officers for their appointments), so the store grows with
+    churn rather than with the number of runs. The state as of a run is the base plus the deltas
+    up to it; rebase() folds old deltas into a new base to keep those queries short.
+
+    Categorical columns (CodeTables.ENCODED_COLUMNS) are stored as integer codes of the shared
+    code tables, by default the code_tables folder next to the store, and read back as
+    pandas Categoricals.
+    """
+
+    def __init__(self, store_fp: str, code_tables: CodeTables = None) -> None:
+        self._store_fp = store_fp
+        if code_tables is None:
+            code_tables = CodeTables(os.path.join(os.path.dirname(os.path.abspath(store_fp)), 'code_tables'))
+        self._code_tables = code_tables
+        self._conn = sqlite3.connect(store_fp, timeout=60)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS runs (run_id INTEGER PRIMARY KEY, prefix TEXT NOT NULL, "
+                           "timestamp TEXT NOT NULL, time REAL NOT NULL, UNIQUE (prefix, timestamp))")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS columns (table_name TEXT PRIMARY KEY, columns TEXT NOT NULL)")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS rows (row_id INTEGER PRIMARY KEY, digest TEXT UNIQUE NOT NULL, "
+                           "value TEXT NOT NULL)")
+        # op is 1 when a row was added to the entity and -1 when it was removed
+        self._conn.execute("CREATE TABLE IF NOT EXISTS changes (table_name TEXT NOT NULL, entity TEXT NOT NULL, "
+                           "row_id INTEGER NOT NULL, run_id INTEGER NOT NULL, op INTEGER NOT NULL, "
+                           "PRIMARY KEY (table_name, entity, row_id, run_id))")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS changes_run ON changes (run_id)")
+
+    @property
+    def store_fp(self) -> str:
+        return self._store_fp
+
+    def runs(self) -> pd.DataFrame:
+        """
+        Runs still held, oldest first. The first is the base of every entity it holds.
+        """
+        return pd.read_sql_query("SELECT run_id, prefix, timestamp, time FROM runs ORDER BY run_id", self._conn)
+
+    def runAt(self, when: float = None, prefix: str = None) -> int:
+        """
+        The last run at or before a unix time (the last run if when is None), optionally of one search prefix.
+        A prefix whose runs up to then have all been folded by rebase() falls back to the base run.
+        """
+        query = "SELECT MAX(run_id) FROM runs WHERE time <= ?"
+        params = [float('inf') if when is None else when]
+        if prefix is not None:
+            query += " AND prefix = ?"
+            params.append(prefix)
+        run_id = self._conn.execute(query, params).fetchone()[0]
+        if run_id is None and prefix is not None:
+            base = self._conn.execute("SELECT MIN(run_id) FROM runs WHERE time <= ?", params[:1]).fetchone()[0]
+            if base is not None and self._conn.execute(
+                    "SELECT 1 FROM changes WHERE table_name = ? AND entity = ? AND run_id = ? LIMIT 1",
+                    (SEARCH_RESULTS, prefix, base)).fetchone() is not None:
+                run_id = base
+        if run_id is None:
+            raise LookupError(f"No run at or before {when}.")
+        return run_id
+
+    def recordRun(self, prefix: str, timestamp: str, tables: dict, exported: dict) -> int:
+        """
+        Store the delta of one run against the current state of the entities it exported.
+
+        Args:
+            tables (dict): table -> (columns, rows) as read by readCsvSet
+            exported (dict): company_number -> None if every table was exported for it, otherwise
+                the resources an incremental run re-exported. Officers' appointments are only
+                replaced for officers with appointment rows in the run.
+        Returns:
+            int: the run id
+        """
+        with self._conn:
+            existing = self._conn.execute("SELECT run_id FROM runs WHERE prefix = ? AND timestamp = ?",
+                                          (prefix, timestamp)).fetchone()
+            if existing is not None:
+                return existing[0]
+            latest = self._conn.execute("SELECT MAX(time) FROM runs").fetchone()[0]
+            if latest is not None and float(timestamp) < latest:
+                raise ValueError(f"Run {prefix} {timestamp} is older than the last run recorded; "
+                                 f"runs must be recorded in time order.")
+            run_id = self._conn.execute("INSERT INTO runs (prefix, timestamp, time) VALUES (?, ?, ?)",
+                                        (prefix, timestamp, float(timestamp))).lastrowid
+            for table, (columns, _) in tables.items():
+                self._conn.execute("INSERT OR REPLACE INTO columns VALUES (?, ?)", (table, json.dumps(columns)))
+            self._conn.execute("INSERT OR IGNORE INTO columns VALUES (?, ?)", (SEARCH_RESULTS, '["company_number"]'))
+
+            observed = self._groupRows(self._encodeTables(tables), exported)
+            observed[SEARCH_RESULTS] = {prefix: [[company_number] for company_number in exported]}
+            for table, entities in observed.items():
+                self._recordTable(table, entities, run_id)
+        return run_id
+
+    def _encodeTables(self, tables: dict) -> dict:
+        """
+        Tables with the values of their categorical columns replaced by integer codes.
+        """
+        encoded = dict()
+        for table, (columns, rows) in tables.items():
+            rows = [list(row) for row in rows]
+            for column, name in CodeTables.ENCODED_COLUMNS.get(table, {}).items():
+                if column in columns and rows:
+                    index = columns.index(column)
+                    codes = self._code_tables.getTable(name).encode([row[index] for row in rows])
+                    for row, code in zip(rows, codes.tolist()):
+                        row[index] = code
+            encoded[table] = (columns, rows)
+        return encoded
+
+    def _groupRows(self, tables: dict, exported: dict) -> dict:
+        """
+        {table: {entity: rows}} for every entity of every table the run exported, including empty ones.
+        """
+        owners = dict()
+        for parent, child in (('persons_significant_control', 'etag'), ('company_charges', 'charge_code')):
+            columns, rows = tables.get(parent, ([], []))
+            if child in columns:
+                key, number = columns.index(child), columns.index('company_number')
+                owners.update({row[key]: row[number] for row in rows})
+
+        grouped = dict()
+        for table, column in ENTITY_COLUMNS.items():
+            columns, rows = tables.get(table, ([], []))
+            entities = dict()
+            if table != 'officer_appointments':
+                resource = next(resource for resource, names in RESOURCE_TABLES.items() if table in names)
+                entities = {company_number: [] for company_number, resources in exported.items()
+                            if resources is None or resource in resources}
+            if column in columns:
+                key = columns.index(column)
+                for row in rows:
+                    entity = row[key] if column in ('company_number', 'officer_id') else owners.get(row[key])
+                    if entity is not None and (table == 'officer_appointments' or entity in entities):
+                        entities.setdefault(entity, []).append(row)
+            grouped[table] = entities
+        return grouped
+
+    def _recordTable(self, table: str, entities: dict, run_id: int) -> None:
+        added, removed = [], []
+        names = list(entities)
+        for start in range(0, len(names), 500):
+            chunk = names[start:start + 500]
+            current = dict()
+            for entity, row_id in self._conn.execute(
+                    f"SELECT entity, row_id FROM changes WHERE table_name = ? AND entity IN "
+                    f"({','.join('?' * len(chunk))}) GROUP BY entity, row_id HAVING SUM(op) > 0", [table] + chunk):
+                current.setdefault(entity, set()).add(row_id)
+            for entity in chunk:
+                rows = {self._rowId(table, row) for row in entities[entity]}
+                before = current.get(entity, set())
+                added += [(table, entity, row_id, run_id, 1) for row_id in rows - before]
+                removed += [(table, entity, row_id, run_id, -1) for row_id in before - rows]
+        self._conn.executemany("INSERT INTO changes VALUES (?, ?, ?, ?, ?)", added + removed)
+
+    def _rowId(self, table: str, row: list) -> int:
+        value = json.dumps(row, separators=(',', ':'))
+        digest = hashlib.sha1(f'{table}\n{value}'.encode('utf-8')).hexdigest()
+        found = self._conn.execute("SELECT row_id FROM rows WHERE digest = ?", (digest,)).fetchone()
+        if found is not None:
+            return found[0]
+        return self._conn.execute("INSERT INTO rows (digest, value) VALUES (?, ?)", (digest, value)).lastrowid
+
+    def recordCsvSet(self, prefix: str, timestamp: str, folder: str = None, remove: bool = False) -> int:
+        """
+        Record the CSV set of a run, optionally deleting its files once stored.
+        """
+        tables, exported = readCsvSet(prefix, timestamp, folder)
+        run_id = self.recordRun(prefix, timestamp, tables, exported)
+        if remove:
+            for table in list(ENTITY_COLUMNS) + ['change_log']:
+                try:
+                    os.remove(csvSetPath(prefix, table, timestamp, folder))
+                except FileNotFoundError:
+                    pass
+        return run_id
+
+    def _columns(self, table: str) -> list:
+        row = self._conn.execute("SELECT columns FROM columns WHERE table_name = ?", (table,)).fetchone()
+        if row is None:
+            raise KeyError(f"No rows of '{table}' have been stored.")
+        return json.loads(row[0])
+
+    def _frame(self, table: str, rows: list, extra: dict = None) -> pd.DataFrame:
+        frame = pd.DataFrame([json.loads(value) for value in rows], columns=self._columns(table), dtype=object)
+        frame = self._code_tables.decodeFrame(frame, CodeTables.ENCODED_COLUMNS.get(table, {}))
+        for column, values in (extra or {}).items():
+            frame[column] = values
+        return frame
+
+    def asOf(self, table: str, run_id: int = None, entities: list = None) -> pd.DataFrame:
+        """
+        A table as it stood after a run (the last run by default), optionally for some entities only.
+        """
+        if run_id is None:
+            run_id = self.runAt()
+        query = "SELECT entity, row_id FROM changes WHERE table_name = ? AND run_id <= ?"
+        chunks = [None] if entities is None else [entities[start:start + 500] for start in range(0, len(entities), 500)]
+        values = []
+        for chunk in chunks:
+            params = [table, run_id]
+            condition = ''
+            if chunk is not None:
+                condition = f" AND entity IN ({','.join('?' * len(chunk))})"
+                params += list(chunk)
+            values += [row[0] for row in self._conn.execute(
+                f"SELECT value FROM ({query}{condition} GROUP BY entity, row_id HAVING SUM(op) > 0) "
+                f"JOIN rows USING (row_id) ORDER BY entity, row_id", params)]
+        return self._frame(table, values)
+
+    def searchResults(self, prefix: str, run_id: int = None) -> list:
+        return sorted(self.asOf(SEARCH_RESULTS, run_id, [prefix])['company_number'])
+
+    def diff(self, table: str, from_run: int, to_run: int = None) -> pd.DataFrame:
+        """
+        Rows added to or removed from a table between two runs, with a change column.
+        """
+        if to_run is None:
+            to_run = self.runAt()
+        first = self._conn.execute("SELECT MIN(run_id) FROM runs").fetchone()[0]
+        if first is None or from_run < first:
+            raise LookupError(f"Run {from_run} has been folded into the base run {first}.")
+        rows = self._conn.execute(
+            "SELECT value, net FROM (SELECT entity, row_id, SUM(op) AS net FROM changes WHERE table_name = ? "
+            "AND run_id > ? AND run_id <= ? GROUP BY entity, row_id HAVING net != 0) JOIN rows USING (row_id) "
+            "ORDER BY entity, net, row_id", (table, from_run, to_run)).fetchall()
+        return self._frame(table, [row[0] for row in rows],
+                           {'change': ['added' if net > 0 else 'removed' for _, net in rows]})
+
+    def exportCsvSet(self, prefix: str, run_id: int = None, folder: str = None) -> str:
+        """
+        Write the CSV set a search prefix had as of a run, as CompanySearch would have exported it.
+
+        Returns:
+            str: the timestamp in the file names
+        """
+        if run_id is None:
+            run_id = self.runAt(prefix=prefix)
+        timestamp = self._conn.execute("SELECT timestamp FROM runs WHERE run_id = ?", (run_id,)).fetchone()[0]
+        companies = self.searchResults(prefix, run_id)
+        officers = None
+        for table in ENTITY_COLUMNS:
+            try:
+                if table == 'officer_appointments':
+                    officer_ids = sorted(set(officers['officer_id'])) if officers is not None else []
+                    frame = self.asOf(table, run_id, officer_ids)
+                else:
+                    frame = self.asOf(table, run_id, companies)
+            except KeyError:
+                continue
+            if table == 'company_officers':
+                officers = frame
+            frame.to_csv(csvSetPath(prefix, table, timestamp, folder), index=False)
+        return timestamp
+
+    def rebase(self, run_id: int) -> int:
+        """
+        Fold every run up to run_id into a single base version, dropping their history. Search
+        prefixes with no later run are then read and exported as of the base run.
+
+        Returns:
+            int: rows no longer referenced and deleted
+        """
+        with self._conn:
+            self._conn.execute("CREATE TEMP TABLE base AS SELECT table_name, entity, row_id FROM changes "
+                               "WHERE run_id <= ? GROUP BY table_name, entity, row_id HAVING SUM(op) > 0", (run_id,))
+            self._conn.execute("DELETE FROM changes WHERE run_id <= ?", (run_id,))
+            self._conn.execute("INSERT INTO changes SELECT table_name, entity, row_id, ?, 1 FROM base", (run_id,))
+            self._conn.execute("DROP TABLE base")
+            self._conn.execute("DELETE FROM runs WHERE run_id < ?", (run_id,))
+            deleted = self._conn.execute(
+                "DELETE FROM rows WHERE row_id NOT IN (SELECT row_id FROM changes)").rowcount
+        self._conn.execute("VACUUM")
+        return deleted
+
+    def stats(self) -> dict:
+        return {
+            'runs': self._conn.execute("SELECT COUNT(*) FROM runs").fetchone()[0],
+            'rows': self._conn.execute("SELECT COUNT(*) FROM rows").fetchone()[0],
+            'changes': self._conn.execute("SELECT COUNT(*) FROM changes").fetchone()[0],
+            'bytes': os.path.getsize(self._store_fp),
+        }
+
+    def close(self) -> None:
+        self._conn.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Keep search runs as deltas instead of full CSV sets.")
+    parser.add_argument('--store', default=ChAPI.getDataFolderLocation('snapshots.sqlite'))
+    commands = parser.add_subparsers(dest='command', required=True)
+    record = commands.add_parser('record', help="store CSV sets, oldest first")
+    record.add_argument('companies_csvs', nargs='+', help="companies CSV files or glob patterns, e.g. "
+                                                          "'../data/*_companies_*.csv'")
+    record.add_argument('--remove', action='store_true', help="delete each CSV set once stored")
+    commands.add_parser('runs', help="list stored runs")
+    export = commands.add_parser('export', help="write the CSV set of a search prefix as of a time")
+    export.add_argument('prefix')
+    export.add_argument('--as-of', type=float, help="unix time, defaults to the last run")
+    export.add_argument('--folder', help="defaults to the data folder")
+    diff = commands.add_parser('diff', help="rows changed in a table between two runs")
+    diff.add_argument('table')
+    diff.add_argument('from_run', type=int)
+    diff.add_argument('to_run', type=int, nargs='?')
+    rebase = commands.add_parser('rebase', help="fold runs up to one into a new base")
+    rebase.add_argument('run_id', type=int)
+    args = parser.parse_args()
+
+    store = SnapshotStore(args.store)
+    if args.command == 'record':
+        csv_sets = []
+        for fp in {fp for pattern in args.companies_csvs for fp in glob.glob(pattern)}:
+            match = CSV_SET_PATTERN.match(os.path.basename(fp))
+            if match:
+                csv_sets.append((float(match['timestamp']), match['prefix'], match['timestamp'], os.path.dirname(fp)))
+        for _, prefix, timestamp, folder in sorted(csv_sets):
+            start = time.perf_counter()
+            run_id = store.recordCsvSet(prefix, timestamp, folder, remove=args.remove)
+            print(f"Run {run_id}: {prefix} {timestamp} in {time.perf_counter() - start:.2f}s")
+        print(store.stats())
+    elif args.command == 'runs':
+        print(store.runs().to_string(index=False))
+    elif args.command == 'export':
+        run_id = store.runAt(args.as_of, prefix=args.prefix)
+        print(f"Wrote {args.prefix} as of run {run_id} with timestamp {store.exportCsvSet(args.prefix, run_id, args.folder)}")
+    elif args.command == 'diff':
+        print(store.diff(args.table, args.from_run, args.to_run).to_string(index=False))
+    else:
+        print(f"Deleted {store.rebase(args.run_id)} rows")
+    store.close()
@@ -0,0 +1,192 @@
+import contextvars
+import functools
+import json
+import os
+import random
+import threading
+import time
+import uuid
+from collections import deque
+
+
+class Span():
+    """
+    One timed operation of a trace, with attributes and child spans.
+    """
+
+    def __init__(self, name: str, trace_id: str, parent=None, attributes: dict = None) -> None:
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent = parent
+        self.attributes = dict(attributes or {})
+        self.children = []
+        self.thread_id = threading.get_ident()
+        self.start = time.time()
+        self._start = time.perf_counter()
+        self.duration = None
+
+    def finish(self) -> None:
+        self.duration = time.perf_counter() - self._start
+
+    def toDict(self) -> dict:
+        return {
+            'name': self.name,
+            'trace_id': self.trace_id,
+            'span_id': self.span_id,
+            'start': self.start,
+            'duration_ms': None if self.duration is None else self.duration * 1000,
+            'attributes': self.attributes,
+            'children': [child.toDict() for child in list(self.children)],
+        }
+
+
+# Marks code running under a trace that was not sampled, so its spans are skipped as well
+_NOT_SAMPLED = object()
+_current_span = contextvars.ContextVar('current_span', default=None)
+
+
+class Tracer():
+    """
+    Span trees of sampled operations, e.g. one per search with a child per company and per upstream call.
+
+    A root span is sampled with probability sample_rate; spans opened while it is current become
+    its children, including in threads started with contextvars.copy_context(). Outside a sampled
+    trace a span costs one context variable lookup. The last max_traces finished traces are kept.
+    """
+
+    def __init__(self, sample_rate: float = 0.0, max_traces: int = 100) -> None:
+        self._sample_rate = sample_rate
+        self._traces = deque(maxlen=max_traces)
+
+    @property
+    def sample_rate(self) -> float:
+        return self._sample_rate
+
+    def setSampleRate(self, sample_rate: float) -> None:
+        self._sample_rate = sample_rate
+
+    def traces(self) -> list:
+        return list(self._traces)
+
+    def clear(self) -> None:
+        self._traces.clear()
+
+    def trace(self, name: str, **attributes):
+        """
+        Context manager opening a root span (or a child span when a trace is already current).
+        """
+        return _SpanContext(self, name, attributes, root=True)
+
+    def span(self, name: str, **attributes):
+        """
+        Context manager opening a child span of the current span, or doing nothing outside a sampled trace.
+        """
+        return _SpanContext(self, name, attributes, root=False)
+
+    def _finishRoot(self, span: Span) -> None:
+        self._traces.append(span)
+
+
+class _SpanContext():
+    def __init__(self, tracer: Tracer, name: str, attributes: dict, root: bool) -> None:
+        self._tracer = tracer
+        self._name = name
+        self._attributes = attributes
+        self._root = root
+        self._span = None
+        self._token = None
+
+    def __enter__(self):
+        parent = _current_span.get()
+        if parent is _NOT_SAMPLED:
+            return None
+        if parent is None:
+            if not self._root:
+                return None
+            if random.random() >= self._tracer.sample_rate:
+                self._token = _current_span.set(_NOT_SAMPLED)
+                return None
+            self._span = Span(self._name, uuid.uuid4().hex, attributes=self._attributes)
+        else:
+            self._span = Span(self._name, parent.trace_id, parent, self._attributes)
+            parent.children.append(self._span)
+        self._token = _current_span.set(self._span)
+        return self._span
+
+    def __exit__(self, exc_type, exc, traceback):
+        if self._token is not None:
+            _current_span.reset(self._token)
+        if self._span is not None:
+            if exc is not None:
+                self._span.attributes['error'] = f'{exc_type.__name__}: {exc}'
+            self._span.finish()
+            if self._span.parent is None:
+                self._tracer._finishRoot(self._span)
+        return False
+
+
+TRACER = Tracer(sample_rate=float(os.getenv('CH_TRACE_SAMPLE_RATE', '0')))
+
+
+def traced(name: str, root: bool = False, attributes=None):
+    """
+    Decorator running a function in a child span of the current trace, or in a new trace with root.
+    attributes(*args, **kwargs) gives the span's attributes and is only called for sampled spans.
+    """
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with (TRACER.trace(name) if root else TRACER.span(name)) as span:
+                if span is not None and attributes is not None:
+                    span.attributes.update(attributes(*args, **kwargs))
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def annotate(**attributes) -> None:
+    """
+    Add attributes to the current span, if any.
+    """
+    span = _current_span.get()
+    if span is not None and span is not _NOT_SAMPLED:
+        span.attributes.update(attributes)
+
+
+def exportJson(traces: list, trace_fp: str) -> None:
+    """
+    Write span trees as JSON, one object per trace.
+    """
+    with open(trace_fp, 'w') as f:
+        json.dump([trace.toDict() for trace in traces], f, indent=2, default=str)
+
+
+def chromeTraceEvents(traces: list) -> list:
+    """
+    Complete ('X') events of every span in the Chrome trace event format, one row per thread.
+    """
+    events = []
+    pending = list(traces)
+    while pending:
+        span = pending.pop()
+        events.append({
+            'name': span.name,
+            'cat': span.attributes.get('endpoint', 'span'),
+            'ph': 'X',
+            'ts': span.start * 1e6,
+            'dur': (span.duration or 0.0) * 1e6,
+            'pid': int(span.trace_id[:8], 16),
+            'tid': span.thread_id,
+            'args': span.attributes,
+        })
+        pending.extend(span.children)
+    return sorted(events, key=lambda event: event['ts'])
+
+
+def exportChromeTrace(traces: list, trace_fp: str) -> None:
+    """
+    Write traces as a file for chrome://tracing or https://ui.perfetto.dev.
+    """
+    with open(trace_fp, 'w') as f:
+        json.dump({'traceEvents': chromeTraceEvents(traces), 'displayTimeUnit': 'ms'}, f, default=str)